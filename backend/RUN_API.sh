@@ -3,6 +3,8 @@ set -Eeuo pipefail
 cd "$(dirname "$0")"
 source .venv/bin/activate
 export VRS_DISABLE_AUTH="${VRS_DISABLE_AUTH:-1}"
+# API importuje wspólne moduły z worker/ (korzeń repo)
+export PYTHONPATH="$(cd .. && pwd)${PYTHONPATH:+:$PYTHONPATH}"
 # broker/backend też na localhost (spójnie z workerem)
 export VRS_CELERY_BROKER_URL="${VRS_CELERY_BROKER_URL:-redis://127.0.0.1:6379/0}"
 export VRS_CELERY_BACKEND_URL="${VRS_CELERY_BACKEND_URL:-redis://127.0.0.1:6379/1}"
@@ -1,5 +1,71 @@
-import os
+import logging, threading
 from celery import Celery
-BROKER_URL = os.getenv("CELERY_BROKER_URL", "redis://redis:6379/0")
-RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND", BROKER_URL)
-celery = Celery("client", broker=BROKER_URL, backend=RESULT_BACKEND)
+from . import config as config_mod
+
+# Jedna aplikacja Celery na proces API: pula połączeń do brokera (kombu) i result backendu (redis-py)
+# zamiast nowej aplikacji i nowych połączeń na każde /generate i /status.
+
+log = logging.getLogger(__name__)
+_app: Celery | None = None
+_lock = threading.Lock()
+
+def _build() -> Celery:
+    s = config_mod.get_settings()
+    app = Celery("vrillsy", broker=s.CELERY_BROKER_URL, backend=s.CELERY_BACKEND_URL)
+    app.conf.update(
+        broker_pool_limit=s.CELERY_BROKER_POOL_LIMIT,
+        broker_connection_timeout=s.CELERY_CONNECT_TIMEOUT_S,
+        broker_connection_retry_on_startup=True,
+        broker_transport_options={"max_connections": s.CELERY_BROKER_POOL_LIMIT},
+        redis_max_connections=s.CELERY_REDIS_MAX_CONNECTIONS,
+        redis_socket_connect_timeout=s.CELERY_CONNECT_TIMEOUT_S,
+        task_default_queue="vrillsy",
+    )
+    return app
+
+def get_celery() -> Celery:
+    global _app
+    if _app is None:
+        with _lock:
+            if _app is None: _app = _build()
+    return _app
+
+def init_celery() -> Celery:
+    """Wołane na starcie API: tworzy aplikację i rozgrzewa połączenie z brokerem (błąd tylko logujemy)."""
+    app = get_celery()
+    try:
+        with app.pool.acquire(block=True, timeout=config_mod.get_settings().CELERY_CONNECT_TIMEOUT_S) as conn:
+            conn.ensure_connection(max_retries=1)
+    except Exception as e:
+        log.warning("celery broker not reachable at startup: %s", e)
+    return app
+
+def close_celery() -> None:
+    global _app
+    with _lock:
+        if _app is not None:
+            try: _app.pool.force_close_all()
+            except Exception: pass
+            _app = None
+
+def pool_stats() -> dict:
+    """Wykorzystanie pul: broker (kombu ConnectionPool) i result backend (redis-py ConnectionPool).
+    Czyta prywatne atrybuty obu bibliotek – przy innej wersji/transporcie dana pula to None zamiast błędu /metrics."""
+    app = get_celery()
+    out = {"broker": None, "backend": None}
+    try:
+        pool = app.pool
+        in_use = len(pool._dirty); idle = pool._resource.qsize()
+        out["broker"] = {"limit": pool.limit, "in_use": in_use, "idle": idle,
+                         "utilization": round(in_use / pool.limit, 3) if pool.limit else None}
+    except Exception as e:
+        log.debug("broker pool stats unavailable: %s", e)
+    try:
+        rpool = app.backend.client.connection_pool
+        in_use = len(rpool._in_use_connections); idle = len(rpool._available_connections)
+        limit = rpool.max_connections
+        out["backend"] = {"limit": limit, "in_use": in_use, "idle": idle,
+                          "utilization": round(in_use / limit, 3) if limit else None}
+    except Exception as e:
+        log.debug("backend pool stats unavailable: %s", e)
+    return out
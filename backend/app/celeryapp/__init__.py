@@ -1,4 +1,5 @@
 from celery import Celery
+from worker.utils import lanes
 from ..config import get_settings
 s = get_settings()
 celery_app = Celery(
@@ -8,5 +9,6 @@ celery_app = Celery(
 )
 celery_app.conf.update(
     imports=["worker.tasks.render_job"],  # <- najważniejsze
-    task_default_queue="celery",
 )
+# te same lane'y/ack/prefetch/fair share co worker/app/celery_app; "celery" = dawna domyślna kolejka, słuchana na końcu
+lanes.configure(celery_app, extra_queues=("celery",))
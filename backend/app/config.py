@@ -1,14 +1,21 @@
 from functools import lru_cache
+from pathlib import Path
 from typing import List
-from pydantic import EmailStr
+from pydantic import AliasChoices, EmailStr, Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
     # Katalog współdzielony na joby
-    SHARED_DIR: str = "shared"
+    SHARED_DIR: str = Field("shared", validation_alias=AliasChoices("VRS_SHARED_DIR", "SHARED_DIR"))
+    # Content-addressed store uploadów (hardlinki z katalogów jobów); "" = SHARED_DIR/.media
+    MEDIA_DEDUP: bool = True
+    MEDIA_STORE_DIR: str = ""
     # Limity
     MAX_VIDEOS: int = 20
     MAX_TOTAL_UPLOAD_MB: int = 512  # MiB, audio+video łącznie
+    # Wznawialne uploady (/uploads)
+    UPLOAD_CHUNK_MAX_MB: int = 64
+    UPLOAD_TTL_H: int = 24  # od ostatniej aktywności sesji
     # MIME
     ALLOWED_VIDEO_MIME: List[str] = [
         "video/mp4", "video/quicktime", "video/x-matroska", "video/webm", "video/x-msvideo"
@@ -16,9 +23,24 @@ class Settings(BaseSettings):
     ALLOWED_AUDIO_MIME: List[str] = [
         "audio/mpeg", "audio/wav", "audio/x-wav", "audio/flac", "audio/mp4", "audio/aac", "audio/ogg"
     ]
-    # Celery
-    CELERY_BROKER_URL: str = "redis://redis:6379/0"
-    CELERY_BACKEND_URL: str = "redis://redis:6379/1"
+    # Celery (akceptuje też stare nazwy bez prefiksu z docker-compose)
+    CELERY_BROKER_URL: str = Field("redis://redis:6379/0", validation_alias=AliasChoices(
+        "VRS_CELERY_BROKER_URL", "CELERY_BROKER_URL", "REDIS_URL"))
+    CELERY_BACKEND_URL: str = Field("redis://redis:6379/1", validation_alias=AliasChoices(
+        "VRS_CELERY_BACKEND_URL", "CELERY_BACKEND_URL", "CELERY_RESULT_BACKEND"))
+    # Redis z postępem jobów (hash job:<id> + kanał job:<id>:events) – ten sam co REDIS_URL workera
+    REDIS_URL: str = Field("redis://redis:6379/0", validation_alias=AliasChoices("VRS_REDIS_URL", "REDIS_URL"))
+    PROGRESS_KEEPALIVE_S: float = 15.0   # komentarz SSE / ping WS, żeby proxy nie zamykały bezczynnych strumieni
+    # Identyczne zlecenia (te same treści wejść i parametry) dostają gotowy wynik albo biegnący task
+    RENDER_CACHE: bool = True
+    # Render o szacowanym koszcie (s pracy workera) od tego progu idzie do długiej kolejki
+    ROUTE_LONG_COST_S: float = 60.0
+    # Batch wariantów (/generate/batch -> task render_batch z worker.tasks.render_job; lane wg kosztu jak render)
+    BATCH_MAX_VARIANTS: int = 10
+    # Pule połączeń jednego, procesowego klienta Celery (app.celery_client)
+    CELERY_BROKER_POOL_LIMIT: int = 10       # połączenia kombu do brokera
+    CELERY_REDIS_MAX_CONNECTIONS: int = 20   # pula redis-py result backendu
+    CELERY_CONNECT_TIMEOUT_S: float = 2.0
 
     # Pydantic v2 config
     model_config = SettingsConfigDict(
@@ -26,6 +48,10 @@ class Settings(BaseSettings):
         case_sensitive=False,
     )
 
+def media_store_dir(s: "Settings") -> str | None:
+    if not s.MEDIA_DEDUP: return None
+    return s.MEDIA_STORE_DIR or str(Path(s.SHARED_DIR) / ".media")
+
 @lru_cache
 def get_settings() -> Settings:
     return Settings()
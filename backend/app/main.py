@@ -1,10 +1,33 @@
-import os
-from fastapi import FastAPI, Depends, HTTPException, status
+import os, time, asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends, HTTPException, Request, status
 from fastapi.middleware.cors import CORSMiddleware
-from routers.generate import router as generate_router
-from routers.status import router as status_router
+from fastapi.responses import PlainTextResponse
+from starlette.concurrency import run_in_threadpool
+from worker.utils import metrics, fairshare, estimator, cpubudget
+from app.celery_client import init_celery, close_celery, pool_stats
+from app.routers.generate import router as generate_router
+from app.routers.status import router as status_router
+from app.routers.uploads import router as uploads_router
+from app.routers.events import router as events_router
+from app.utils.progress_hub import close_hub
 
-app = FastAPI(title="Vrillsy API")
+async def _flush_metrics():
+    while True:
+        await asyncio.sleep(metrics.FLUSH_S)
+        await run_in_threadpool(metrics.flush)
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    await run_in_threadpool(init_celery)
+    flusher = asyncio.create_task(_flush_metrics())
+    yield
+    flusher.cancel()
+    await close_hub()
+    close_celery()
+    await run_in_threadpool(metrics.flush)
+
+app = FastAPI(title="Vrillsy API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -14,6 +37,17 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def request_latency(request: Request, call_next):
+    t0 = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    # szablon ścieżki (/status/{task_id}), nie surowy URL – ograniczona liczba serii; do Redis w tle (_flush_metrics)
+    metrics.observe_buffered("vrs_http_request_duration_seconds", time.perf_counter() - t0, metrics.LATENCY_BUCKETS,
+                             method=request.method, route=getattr(route, "path", "unmatched"),
+                             status=str(response.status_code))
+    return response
+
 def get_current_user():
     if os.getenv('VRS_DISABLE_AUTH','').lower() in {'1','true','yes'}:
         return {'sub':'dev'}
@@ -21,7 +55,43 @@ def get_current_user():
 
 @app.get("/health")
 def health():
-    return {"ok": True}
+    return {"ok": True, "celery_pools": pool_stats()}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    metrics.flush()  # własne zbuforowane próbki tego procesu od razu widoczne
+    lines = ["# HELP vrs_celery_pool_connections Celery client connection pools of this API process",
+             "# TYPE vrs_celery_pool_connections gauge"]
+    for pool, st in pool_stats().items():
+        for state in ("limit", "in_use", "idle"):
+            if st and st[state] is not None:
+                lines.append(f'vrs_celery_pool_connections{{pool="{pool}",state="{state}"}} {st[state]}')
+    try: fs = fairshare.stats()
+    except Exception: fs = None
+    if fs:
+        lines += ["# HELP vrs_fairshare_pending_jobs Renders waiting for a free per-user slot",
+                  "# TYPE vrs_fairshare_pending_jobs gauge", f"vrs_fairshare_pending_jobs {fs['pending_jobs']}",
+                  "# HELP vrs_fairshare_waiting_users Users with renders waiting for a slot",
+                  "# TYPE vrs_fairshare_waiting_users gauge", f"vrs_fairshare_waiting_users {fs['waiting_users']}"]
+    try: budgets = cpubudget.nodes()
+    except Exception: budgets = {}
+    if budgets:
+        lines += ["# HELP vrs_cpu_budget_tokens CPU token budget of worker nodes (last reported state)",
+                  "# TYPE vrs_cpu_budget_tokens gauge"]
+        for node, b in budgets.items():
+            lines += [f'vrs_cpu_budget_tokens{{node="{node}",state="{k}"}} {b[k]}' for k in ("total", "used", "waiting")]
+    try: models = estimator.stats()
+    except Exception: models = {}
+    if models:
+        lines += ["# HELP vrs_estimator_mape Mean absolute percentage error of the render cost model on its samples",
+                  "# TYPE vrs_estimator_mape gauge"]
+        lines += [f'vrs_estimator_mape{{pipeline="{p}"}} {m["mape"]}' for p, m in models.items() if m["mape"] is not None]
+        lines += ["# HELP vrs_estimator_samples Samples the render cost model was fitted on",
+                  "# TYPE vrs_estimator_samples gauge"]
+        lines += [f'vrs_estimator_samples{{pipeline="{p}"}} {m["n"]}' for p, m in models.items()]
+    return PlainTextResponse(metrics.render() + "\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
 
 app.include_router(generate_router, dependencies=[Depends(get_current_user)])
 app.include_router(status_router, dependencies=[Depends(get_current_user)])
+app.include_router(uploads_router, dependencies=[Depends(get_current_user)])
+app.include_router(events_router, dependencies=[Depends(get_current_user)])
@@ -0,0 +1,91 @@
+import asyncio
+import json
+from pathlib import Path
+from fastapi import APIRouter, HTTPException, Request, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import StreamingResponse
+from worker.utils.progress import TERMINAL
+from app import config as config_mod
+from app.utils.progress_hub import get_hub
+
+# Strumień postępu joba zamiast odpytywania /status: SSE (GET /jobs/{id}/events) albo WebSocket (/ws/jobs/{id}).
+# Najpierw subskrypcja (potwierdzona przez Redis), potem snapshot z hasha job:<id> – nic nie ginie między nimi
+# (najwyżej duplikat); strumień kończy się na zdarzeniu "done"/"error". Nieznany/wygasły job (brak hasha i katalogu) = 404.
+
+router = APIRouter()
+
+def _job_dir_exists(job_id: str) -> bool:
+    # job przyjęty, ale worker jeszcze nic nie opublikował – hash job:<id> powstaje dopiero przy pierwszym etapie
+    if job_id in (".", "..") or "/" in job_id: return False
+    return (Path(config_mod.get_settings().SHARED_DIR) / job_id).is_dir()
+
+async def _open(job_id: str):
+    hub = get_hub()
+    q = hub.subscribe(job_id)
+    try:
+        await hub.ready()
+        snap = await hub.snapshot(job_id)
+    except Exception:
+        hub.unsubscribe(job_id, q)
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail={"ok": False, "error": "progress_unavailable"})
+    if not snap and not _job_dir_exists(job_id):
+        hub.unsubscribe(job_id, q)
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail={"ok": False, "error": "job_not_found"})
+    return hub, q, snap
+
+def _sse(ev: dict, seq: int) -> str:
+    return f"id: {seq}\nevent: progress\ndata: {json.dumps(ev, ensure_ascii=False)}\n\n"
+
+@router.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, request: Request):
+    keepalive = config_mod.get_settings().PROGRESS_KEEPALIVE_S
+    hub, q, snap = await _open(job_id)
+
+    async def stream():
+        seq = 0
+        try:
+            yield "retry: 3000\n\n"
+            if snap:
+                seq += 1; yield _sse(snap, seq)
+                if snap.get("stage") in TERMINAL: return
+            while True:
+                try:
+                    ev = await asyncio.wait_for(q.get(), keepalive)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected(): return
+                    yield ": keepalive\n\n"
+                    continue
+                seq += 1; yield _sse(ev, seq)
+                if ev.get("stage") in TERMINAL: return
+        finally:
+            hub.unsubscribe(job_id, q)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@router.websocket("/ws/jobs/{job_id}")
+async def job_events_ws(websocket: WebSocket, job_id: str):
+    keepalive = config_mod.get_settings().PROGRESS_KEEPALIVE_S
+    await websocket.accept()
+    try:
+        hub, q, snap = await _open(job_id)
+    except HTTPException as e:
+        await websocket.send_json(e.detail)
+        await websocket.close(code=4404 if e.status_code == status.HTTP_404_NOT_FOUND else 1011)
+        return
+    try:
+        ev = snap
+        if ev: await websocket.send_json(ev)
+        while not ev or ev.get("stage") not in TERMINAL:
+            try:
+                ev = await asyncio.wait_for(q.get(), keepalive)
+            except asyncio.TimeoutError:
+                ev = None
+                await websocket.send_json({"type": "ping"})
+                continue
+            await websocket.send_json(ev)
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        hub.unsubscribe(job_id, q)
@@ -1,58 +1,168 @@
-import os, uuid, shutil
+import json, re, uuid
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import List
-from fastapi import APIRouter, UploadFile, File, HTTPException, status
-from celery import Celery
+from typing import List, Optional
+from fastapi import APIRouter, Request, HTTPException, status
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field
+from app import config as config_mod
+from app.utils import resumable, tasks as tasks_mod
+from app.utils.upload import FileRule, receive_multipart, serialize_manifest
+from worker.utils import media_store
 
 router = APIRouter()
 
-def _shared_dir() -> Path:
-    return Path(os.getenv("SHARED_DIR", "/shared"))
+RENDER_MODES = ("final", "preview")
 
-def _outputs_dir() -> Path:
-    return Path(os.getenv("OUTPUT_DIR", "/outputs"))
+_FORM_SCHEMA = {"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": {
+    "type": "object", "required": ["audio", "videos"],
+    "properties": {
+        "audio": {"type": "string", "format": "binary"},
+        "videos": {"type": "array", "items": {"type": "string", "format": "binary"}},
+        "user_id": {"type": "string"}, "email": {"type": "string"},
+        "params": {"type": "string", "description": "JSON"},
+        "mode": {"type": "string", "enum": list(RENDER_MODES), "default": "final"},
+    }}}}}}
 
-def _celery() -> Celery:
-    broker = os.getenv("CELERY_BROKER_URL", os.getenv("REDIS_URL", "redis://redis:6379/0"))
-    backend = os.getenv("CELERY_RESULT_BACKEND", "redis://redis:6379/1")
-    return Celery("vrillsy", broker=broker, backend=backend)
+def _bad(error: str, **extra) -> HTTPException:
+    return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail={"ok": False, "error": error, **extra})
 
-def _save(upload: UploadFile, dst: Path) -> int:
-    dst.parent.mkdir(parents=True, exist_ok=True)
-    with dst.open("wb") as f:
-        shutil.copyfileobj(upload.file, f)
-    return dst.stat().st_size
+def _manifest(job_id: str, user_id: Optional[str], email: Optional[str], params: dict, mode: str,
+              audio: dict, videos: List[dict]) -> dict:
+    return {
+        "job_id": job_id,
+        "user_id": user_id,
+        "email": email,
+        "params": params,
+        "mode": mode,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "files": {"audio": audio, "videos": videos},
+    }
 
-@router.post("/generate")
-async def generate(
-    audio: UploadFile = File(...),
-    videos: List[UploadFile] = File(...),
-):
-    if not videos:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="no_videos")
+def _submit(job_id: str, job_dir: Path, store_dir: Optional[str], mode: str) -> dict:
+    sub = tasks_mod.submit_render_job(job_id)
+    if sub["job_id"] != job_id:
+        media_store.release_dir(str(job_dir), store_dir)  # duplikat – wynik/render należy do wcześniejszego joba
+    return {"ok": True, "mode": mode, **sub}
 
+# Body nie przechodzi przez parser formularzy Starlette (spool do pliku tymczasowego) –
+# utils.upload zapisuje części od razu pod docelowe ścieżki w SHARED_DIR/<job_id>/.
+@router.post("/generate", openapi_extra=_FORM_SCHEMA)
+async def generate(request: Request):
+    s = config_mod.get_settings()
     job_id = uuid.uuid4().hex
-    job_dir = _shared_dir() / job_id
-    job_dir.mkdir(parents=True, exist_ok=True)
-
-    # save audio
-    a_name = f"audio_{audio.filename or 'track'}"
-    a_path = job_dir / a_name
-    if _save(audio, a_path) <= 0:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="audio_empty")
-
-    # save videos
-    v_paths: List[str] = []
-    for v in videos:
-        v_name = f"video_{v.filename or 'clip.mp4'}"
-        v_path = job_dir / v_name
-        _save(v, v_path)
-        v_paths.append(str(v_path))
-
-    # enqueue task
-    out_dir = str(_outputs_dir())
-    res = _celery().send_task("vrillsy.render_job",
-                              args=[job_id, str(a_path), v_paths, out_dir],
-                              queue="vrillsy")
-
-    return {"ok": True, "job_id": job_id, "task_id": res.id}
+    job_dir = Path(s.SHARED_DIR) / job_id
+    store_dir = config_mod.media_store_dir(s)
+    rules = {
+        "audio": FileRule("audio", s.ALLOWED_AUDIO_MIME, 1),
+        "videos": FileRule("video", s.ALLOWED_VIDEO_MIME, s.MAX_VIDEOS),
+    }
+    try:
+        form = await receive_multipart(request, job_dir, rules, s.MAX_TOTAL_UPLOAD_MB * 1024 * 1024, store_dir)
+        audio, videos = form.files["audio"], form.files["videos"]
+        if not audio: raise _bad("no_audio")
+        if audio[0].size <= 0: raise _bad("audio_empty")
+        if not videos: raise _bad("no_videos")
+        mode = form.fields.get("mode", "final")
+        if mode not in RENDER_MODES: raise _bad("invalid_mode")
+        try: params = json.loads(form.fields.get("params") or "{}")
+        except ValueError: raise _bad("invalid_params")
+
+        manifest = _manifest(job_id, form.fields.get("user_id"), form.fields.get("email"), params, mode,
+                             audio[0].to_manifest(), [v.to_manifest() for v in videos])
+        serialize_manifest(manifest, str(job_dir / "manifest.json"))
+    except BaseException:
+        media_store.release_dir(str(job_dir), store_dir)
+        raise
+
+    return await run_in_threadpool(_submit, job_id, job_dir, store_dir, mode)
+
+class GenerateFromMedia(BaseModel):
+    audio: str
+    videos: List[str]
+    user_id: Optional[str] = None
+    email: Optional[str] = None
+    params: dict = {}
+    mode: str = "final"
+
+def _job_from_media(s, audio_id: str, video_ids: List[str], user_id: Optional[str], email: Optional[str],
+                    params: dict, mode: str, **extra) -> tuple[str, Path]:
+    if not video_ids: raise _bad("no_videos")
+    if len(video_ids) > s.MAX_VIDEOS: raise _bad("too_many_files", limit=s.MAX_VIDEOS)
+    if mode not in RENDER_MODES: raise _bad("invalid_mode")
+
+    metas = [resumable.load(s.SHARED_DIR, mid) for mid in [audio_id, *video_ids]]
+    for meta, kind in zip(metas, ["audio"] + ["video"] * len(video_ids)):
+        if meta["kind"] != kind: raise _bad("wrong_media_kind", media_id=meta["upload_id"], expected=kind)
+        if meta.get("sha256") is None:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                                detail={"ok": False, "error": "upload_incomplete", "media_id": meta["upload_id"]})
+        allowed = s.ALLOWED_AUDIO_MIME if kind == "audio" else s.ALLOWED_VIDEO_MIME
+        if meta["content_type"] not in allowed:
+            raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                                detail={"ok": False, "error": "mime_not_allowed", "media_id": meta["upload_id"]})
+    if sum(m["size"] for m in metas) > s.MAX_TOTAL_UPLOAD_MB * 1024 * 1024:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail={"ok": False, "error": "payload_too_large", "limit_mb": s.MAX_TOTAL_UPLOAD_MB})
+
+    job_id = uuid.uuid4().hex
+    job_dir = Path(s.SHARED_DIR) / job_id
+    try:
+        entries = []
+        for i, meta in enumerate(metas):
+            sub, idx = ("audio", 0) if i == 0 else ("video", i - 1)
+            dst = job_dir / sub / f"{idx:03d}_{meta['filename']}"
+            resumable.link_into(meta, dst)
+            entries.append(resumable.manifest_entry(meta, dst))
+        manifest = _manifest(job_id, user_id, email, params, mode, entries[0], entries[1:])
+        manifest.update(extra)
+        serialize_manifest(manifest, str(job_dir / "manifest.json"))
+    except BaseException:
+        media_store.release_dir(str(job_dir), config_mod.media_store_dir(s))
+        raise
+    return job_id, job_dir
+
+# Odpowiednik /generate dla mediów wgranych wcześniej przez /uploads (bez ponownego wysyłania bajtów):
+# te same limity z Settings, pliki trafiają do katalogu joba jako hardlinki.
+@router.post("/generate/media")
+def generate_from_media(body: GenerateFromMedia):
+    s = config_mod.get_settings()
+    job_id, job_dir = _job_from_media(s, body.audio, body.videos, body.user_id, body.email, body.params, body.mode)
+    return _submit(job_id, job_dir, config_mod.media_store_dir(s), body.mode)
+
+class Variant(BaseModel):
+    name: Optional[str] = Field(None, max_length=40)
+    seed: Optional[int] = None
+    target_duration_s: Optional[float] = Field(None, gt=0, le=600)
+    shuffle: bool = True
+
+class GenerateBatch(GenerateFromMedia):
+    variants: List[Variant]
+
+# N wariantów tego samego materiału (seed/target/shuffle) w jednym tasku render_batch:
+# normalizacja i analiza audio raz, potem tylko planowanie i składanie per wariant.
+@router.post("/generate/batch")
+def generate_batch(body: GenerateBatch):
+    s = config_mod.get_settings()
+    if not body.variants: raise _bad("no_variants")
+    if len(body.variants) > s.BATCH_MAX_VARIANTS: raise _bad("too_many_variants", limit=s.BATCH_MAX_VARIANTS)
+    variants = [v.model_dump(exclude_none=True) for v in body.variants]
+    job_id, _ = _job_from_media(s, body.audio, body.videos, body.user_id, body.email, body.params, body.mode,
+                                variants=variants)
+    task_id = tasks_mod.enqueue_render_batch(job_id)
+    return {"ok": True, "job_id": job_id, "task_id": task_id, "mode": body.mode, "variants": len(variants)}
+
+class RenderExisting(BaseModel):
+    mode: str = "final"
+
+# Render już wgranego joba zadaniem z planem montażu: najpierw {"mode": "preview"}, potem {"mode": "final"}
+# tego samego job_id – final używa planu zapisanego przez podgląd (te same cięcia, bez ponownej analizy).
+@router.post("/jobs/{job_id}/render")
+def render_existing(job_id: str, body: RenderExisting = RenderExisting()):
+    if body.mode not in RENDER_MODES: raise _bad("invalid_mode")
+    if not re.fullmatch(r"[0-9a-f]{32}", job_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail={"ok": False, "error": "job_not_found"})
+    try: task_id = tasks_mod.enqueue_plan_render(job_id, body.mode)
+    except FileNotFoundError:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail={"ok": False, "error": "job_not_found"})
+    return {"ok": True, "job_id": job_id, "task_id": task_id, "mode": body.mode}
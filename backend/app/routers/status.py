@@ -1,24 +1,34 @@
-import os
+import os, time
 from pathlib import Path
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import FileResponse
-from celery import Celery
+from fastapi import APIRouter, HTTPException, Request
+from app.celery_client import get_celery
+from app.utils.http_range import file_response
+from worker.utils import estimator, render_cache
 
 router = APIRouter()
 
-def _celery() -> Celery:
-    broker = os.getenv("CELERY_BROKER_URL", os.getenv("REDIS_URL", "redis://redis:6379/0"))
-    backend = os.getenv("CELERY_RESULT_BACKEND", "redis://redis:6379/1")
-    return Celery("vrillsy", broker=broker, backend=backend)
-
 def _outputs_dir() -> Path:
     return Path(os.getenv("OUTPUT_DIR", "/outputs"))
 
+def _cached(task_id: str) -> dict | None:
+    """Wynik z cache renderu – po result_expires Celery zgłasza już tylko PENDING."""
+    try: rec = render_cache.by_task(task_id)
+    except Exception: return None
+    return {"ok": True, "job_id": rec["job_id"], "out": rec["out"]} if rec else None
+
 @router.get("/status/{task_id}")
 def status(task_id: str):
-    app = _celery()
+    app = get_celery()
     res = app.AsyncResult(task_id)
+    if res.state == "PENDING":
+        cached = _cached(task_id)
+        if cached: return {"state": "SUCCESS", "ready": True, "result": cached, "cache": "hit"}
     payload = {"state": res.state, "ready": res.ready()}
+    est = estimator.recall(task_id)
+    if est:
+        payload["estimate_s"] = est["estimate_s"]
+        # ETA od zlecenia (obejmuje czas w kolejce/fair share) – zgrubna, dopóki task nie skończy
+        if not res.ready(): payload["eta_s"] = round(max(0.0, est["submitted_at"] + est["estimate_s"] - time.time()), 1)
     if res.ready():
         try:
             payload["result"] = res.result  # expected: {'ok': True, 'output': '/outputs/..', ...}
@@ -26,20 +36,21 @@ def status(task_id: str):
             payload["result_error"] = str(e)
     return payload
 
-@router.get("/download/{job_id}")
-def download(job_id: str):
+@router.api_route("/download/{job_id}", methods=["GET", "HEAD"])
+def download(job_id: str, request: Request):
     path = _outputs_dir() / f"{job_id}_final.mp4"
     if not path.exists():
         raise HTTPException(status_code=404, detail="file_not_found")
-    return FileResponse(str(path), media_type="video/mp4", filename=f"{job_id}.mp4")
+    return file_response(request, path, "video/mp4", filename=f"{job_id}.mp4")
 
-@router.get("/download_by_task/{task_id}")
-def download_by_task(task_id: str):
-    app = _celery()
+@router.api_route("/download_by_task/{task_id}", methods=["GET", "HEAD"])
+def download_by_task(task_id: str, request: Request):
+    app = get_celery()
     res = app.AsyncResult(task_id)
-    if not res.ready() or not res.result or not isinstance(res.result, dict):
+    result = res.result if res.ready() else _cached(task_id) if res.state == "PENDING" else None
+    if not result or not isinstance(result, dict):
         raise HTTPException(status_code=404, detail="not_ready")
-    out = res.result.get("output")
+    out = result.get("output") or result.get("out")
     if not out or not Path(out).exists():
         raise HTTPException(status_code=404, detail="file_not_found")
-    return FileResponse(out, media_type="video/mp4", filename=Path(out).name)
+    return file_response(request, Path(out), "video/mp4", filename=Path(out).name)
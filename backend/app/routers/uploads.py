@@ -0,0 +1,60 @@
+from typing import Literal, Optional
+from fastapi import APIRouter, Request, Response, status
+from pydantic import BaseModel, Field
+from app import config as config_mod
+from app.utils import resumable
+
+router = APIRouter()
+
+class UploadCreate(BaseModel):
+    kind: Literal["audio", "video"]
+    filename: str
+    content_type: str
+    size: int = Field(gt=0)
+    sha256: Optional[str] = None
+
+def _headers(st: dict) -> dict:
+    return {"Upload-Offset": str(st["offset"]), "Upload-Length": str(st["size"]),
+            "X-Upload-Received": str(st["received"]), "Cache-Control": "no-store"}
+
+@router.post("/uploads", status_code=status.HTTP_201_CREATED)
+def create_upload(body: UploadCreate, response: Response):
+    s = config_mod.get_settings()
+    allowed = s.ALLOWED_AUDIO_MIME if body.kind == "audio" else s.ALLOWED_VIDEO_MIME
+    ctype = body.content_type.split(";")[0].strip().lower()
+    if ctype not in allowed:
+        raise resumable._reject(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, "mime_not_allowed", mime=ctype)
+    if body.size > s.MAX_TOTAL_UPLOAD_MB * 1024 * 1024:
+        raise resumable._reject(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, "payload_too_large", limit_mb=s.MAX_TOTAL_UPLOAD_MB)
+    store_dir = config_mod.media_store_dir(s)
+    resumable.expire(s.SHARED_DIR, s.UPLOAD_TTL_H * 3600, store_dir)
+    meta = resumable.create(s.SHARED_DIR, body.kind, body.filename, ctype, body.size, body.sha256)
+    response.headers["Location"] = f"/uploads/{meta['upload_id']}"
+    return {"ok": True, "upload_id": meta["upload_id"], "chunk_max_bytes": s.UPLOAD_CHUNK_MAX_MB * 1024 * 1024}
+
+@router.put("/uploads/{upload_id}", status_code=status.HTTP_204_NO_CONTENT)
+@router.patch("/uploads/{upload_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def put_chunk(upload_id: str, request: Request):
+    s = config_mod.get_settings()
+    st = await resumable.write_chunk(request, s.SHARED_DIR, upload_id, s.UPLOAD_CHUNK_MAX_MB * 1024 * 1024)
+    return Response(status_code=status.HTTP_204_NO_CONTENT, headers=_headers(st))
+
+@router.head("/uploads/{upload_id}")
+def head_upload(upload_id: str):
+    st = resumable.status_of(resumable.load(config_mod.get_settings().SHARED_DIR, upload_id))
+    return Response(status_code=status.HTTP_200_OK, headers=_headers(st))
+
+@router.get("/uploads/{upload_id}")
+def get_upload(upload_id: str):
+    return resumable.status_of(resumable.load(config_mod.get_settings().SHARED_DIR, upload_id))
+
+@router.post("/uploads/{upload_id}/complete")
+def complete_upload(upload_id: str):
+    s = config_mod.get_settings()
+    return resumable.complete(s.SHARED_DIR, upload_id, config_mod.media_store_dir(s))
+
+@router.delete("/uploads/{upload_id}", status_code=status.HTTP_204_NO_CONTENT)
+def delete_upload(upload_id: str):
+    s = config_mod.get_settings()
+    resumable.delete(s.SHARED_DIR, upload_id, config_mod.media_store_dir(s))
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
@@ -1,35 +1,52 @@
 import os
 from typing import Dict
-import soundfile as sf
+import numpy as np
 from .assemble import assemble_videos_for_cuts  # dostosuj nazwę jeśli inna
 from ..celery_app import celery_app
 from ..utils.cut_strategies import load_cfg, detect_beats_and_onsets, pro_cutplan
+from worker.config import ANALYSIS_BACKEND
+from worker.utils.analysis import analyze
+from worker.utils import analysis_cache
+from worker.utils.audio_io import load_mono, peak_rss_mb
+
+PRO_ANALYSIS_SR = int(os.getenv("PRO_ANALYSIS_SR", "22050"))
+PRO_SHARED_DIR = os.getenv("PRO_SHARED_DIR", "/app/shared")
+OUTPUT_DIR = os.getenv("OUTPUT_DIR", "/outputs")
 
 @celery_app.task(name="tasks.pro_render.render_job_pro")
-def render_job_pro(job_id: str, attention_min_s: float, attention_max_s: float, shuffle: bool=False, order=None) -> Dict:
-    job_root = f"/app/shared/{job_id}"
+def render_job_pro(job_id: str, attention_min_s: float, attention_max_s: float, shuffle: bool=False, order=None,
+                   target_duration_s: float | None = None) -> Dict:
+    job_root = os.path.join(PRO_SHARED_DIR, job_id)
     audio_dir = os.path.join(job_root, "audio")
     video_dir = os.path.join(job_root, "video")
-    outputs = "/outputs"
+    outputs = OUTPUT_DIR
     os.makedirs(outputs, exist_ok=True)
 
     audios = [f for f in os.listdir(audio_dir) if f.lower().endswith((".mp3",".wav",".m4a",".flac",".ogg"))]
     if len(audios)!=1: raise ValueError("no_or_multiple_audio")
     audio_path = os.path.join(audio_dir, audios[0])
 
-    y, sr = sf.read(audio_path, always_2d=False)
-    try:
-        import numpy as np
-        if getattr(y, "ndim", 1) > 1:
-            y = np.mean(y, axis=1).astype("float32")
-        else:
-            y = y.astype("float32", copy=False)
-    except Exception:
-        pass
-
-    beat_times, onsets = detect_beats_and_onsets(y, sr)
     cfg = load_cfg(os.path.join(job_root, "config.json"))
-    cuts = pro_cutplan(beat_times, onsets, cfg, total_duration=float(len(y)/sr))
+    akey = analysis_cache.cache_key(audio_path, pipeline="pro", backend=ANALYSIS_BACKEND, sr=PRO_ANALYSIS_SR,
+                                    trim_s=target_duration_s)
+    cached = analysis_cache.load(akey)
+    if cached:
+        beat_times, onsets = np.array(cached["beats"]), np.array(cached["onsets"])
+        total_duration = float(cached["duration_s"])
+    elif ANALYSIS_BACKEND == "native":
+        # bez ładowania całego pliku: dekod blokami + onsety/beaty w worker.utils.analysis
+        res = analyze(audio_path, max_duration_s=target_duration_s)
+        beat_times, onsets = np.array(res.beats), np.array(res.onsets)
+        total_duration = res.duration_s
+    else:
+        # blokowy downmix + resampling do PRO_ANALYSIS_SR zamiast sf.read całego pliku
+        sr = PRO_ANALYSIS_SR
+        y = load_mono(audio_path, sr, max_duration_s=target_duration_s)
+        beat_times, onsets = detect_beats_and_onsets(y, sr)
+        total_duration = float(len(y)/sr)
+    if not cached:
+        analysis_cache.store(akey, beats=beat_times, onsets=onsets, duration_s=total_duration)
+    cuts = pro_cutplan(beat_times, onsets, cfg, total_duration=total_duration)
 
     vids = [os.path.join(video_dir, v) for v in sorted(os.listdir(video_dir)) if v.lower().endswith((".mp4",".mov",".mkv",".webm"))]
     if not vids: raise ValueError("no_video")
@@ -45,5 +62,7 @@ def render_job_pro(job_id: str, attention_min_s: float, attention_max_s: float,
         "duration_s": cuts[-1],
         "clips_in": len(vids),
         "segments_total": segments_total,
-        "strategy": "pro"
+        "strategy": "pro",
+        "analysis_cache": "hit" if cached else "miss",
+        "peak_rss_mb": peak_rss_mb()
     }
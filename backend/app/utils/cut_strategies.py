@@ -2,6 +2,7 @@ import json, random
 from typing import List, Dict
 import numpy as np
 import librosa
+from worker.utils.beatgrid import BeatGrid
 
 def load_cfg(cfg_path: str) -> Dict:
     try:
@@ -15,11 +16,9 @@ def detect_beats_and_onsets(y, sr):
     return np.array(beats), np.array(onsets)
 
 def snap_time(t, onsets, snap_ms=60):
-    if onsets.size==0: return t
-    idx = np.argmin(np.abs(onsets - t))
-    if abs(onsets[idx]-t) <= (snap_ms/1000.0):
-        return float(onsets[idx])
-    return float(t)
+    grid = onsets if isinstance(onsets, BeatGrid) else BeatGrid(onsets)
+    if not grid: return t
+    return grid.snap(t, snap_ms/1000.0)
 
 def pro_cutplan(beat_times: np.ndarray, onsets: np.ndarray, cfg: Dict, total_duration: float) -> List[float]:
     db_every = int(cfg.get("downbeat_every", 4))
@@ -32,6 +31,7 @@ def pro_cutplan(beat_times: np.ndarray, onsets: np.ndarray, cfg: Dict, total_dur
     wts = np.array(wts)/sum(wts)
 
     grid = beat_times if len(beat_times) >= 4 else np.arange(0, total_duration, 0.5)
+    onset_grid, beat_grid = BeatGrid(onsets), BeatGrid(grid)
     cuts=[0.0]; beat_idx=0
     while cuts[-1] < total_duration - 0.2:
         prefer_downbeat = (beat_idx % db_every == 0)
@@ -44,13 +44,13 @@ def pro_cutplan(beat_times: np.ndarray, onsets: np.ndarray, cfg: Dict, total_dur
             local_beat_sec = float(np.mean(np.diff(grid)) if len(grid)>1 else 0.5)
         target = cuts[-1] + dur_beats*local_beat_sec
         target += (random.random()*2-1)*(jitter/1000.0)
-        target = snap_time(max(0.0, target), onsets, snap_ms=snap)
+        target = snap_time(max(0.0, target), onset_grid, snap_ms=snap)
         target = max(target, cuts[-1] + 0.15)
         if target >= total_duration: break
         if prefer_downbeat and len(grid):
-            idx = int(np.argmin(np.abs(grid - target)))
-            if abs(grid[idx]-target) < 0.12:
-                target = float(grid[idx])
+            nb = beat_grid.nearest(target)
+            if abs(nb-target) < 0.12:
+                target = nb
         cuts.append(float(target))
         while beat_idx < len(grid) and grid[beat_idx] <= target:
             beat_idx += 1
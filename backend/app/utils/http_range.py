@@ -0,0 +1,105 @@
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Iterator, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import Response, StreamingResponse
+
+CHUNK = 256 * 1024
+
+def etag_for(st: os.stat_result) -> str:
+    # silny ETag z (inode, rozmiar, mtime_ns) – plik wyjściowy jest zapisywany raz i nie jest nadpisywany w miejscu
+    return f'"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}"'
+
+def _etag_list(header: str) -> list:
+    return [t.strip().removeprefix("W/") for t in header.split(",") if t.strip()]
+
+def not_modified(request: Request, etag: str, mtime: float) -> bool:
+    inm = request.headers.get("if-none-match")
+    if inm is not None:
+        tags = _etag_list(inm)
+        return "*" in tags or etag in tags
+    ims = request.headers.get("if-modified-since")
+    if ims:
+        try:
+            return int(mtime) <= parsedate_to_datetime(ims).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Zwraca (start, end) włącznie; None = cały plik; ValueError = zakres niespełnialny."""
+    if not header or not header.startswith("bytes="):
+        return None
+    spec = header[6:].strip()
+    if "," in spec:
+        return None  # multipart/byteranges nie obsługujemy – oddajemy całość (RFC 9110 dopuszcza)
+    first, _, last = spec.partition("-")
+    try:
+        if first == "":
+            n = int(last)
+            if n <= 0: raise ValueError("empty suffix range")
+            return max(0, size - n), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        raise ValueError(f"bad range: {header}")
+    if start >= size or end < start:
+        raise ValueError(f"unsatisfiable range: {header}")
+    return start, min(end, size - 1)
+
+def _if_range_ok(request: Request, etag: str, mtime: float) -> bool:
+    ir = request.headers.get("if-range")
+    if not ir:
+        return True
+    if ir.startswith('"') or ir.startswith("W/"):
+        return ir == etag
+    try:
+        return int(mtime) == int(parsedate_to_datetime(ir).timestamp())
+    except (TypeError, ValueError):
+        return False
+
+def _iter_file(path: Path, start: int, length: int) -> Iterator[bytes]:
+    with path.open("rb") as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK, length))
+            if not chunk: break
+            length -= len(chunk)
+            yield chunk
+
+def file_response(request: Request, path: Path, media_type: str, filename: Optional[str] = None) -> Response:
+    """Odpowiedź na GET/HEAD pliku z obsługą Range (206/416), ETag/Last-Modified i 304."""
+    st = path.stat()
+    etag = etag_for(st)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(st.st_mtime, usegmt=True),
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, max-age=0, must-revalidate",
+    }
+    if filename:
+        headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+
+    if not_modified(request, etag, st.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    size = st.st_size
+    try:
+        rng = parse_range(request.headers.get("range"), size) if _if_range_ok(request, etag, st.st_mtime) else None
+    except ValueError:
+        headers["Content-Range"] = f"bytes */{size}"
+        return Response(status_code=416, headers=headers)
+
+    if rng is None:
+        start, end, code = 0, size - 1, 200
+    else:
+        start, end = rng; code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    length = end - start + 1 if size else 0
+    headers["Content-Length"] = str(length)
+
+    if request.method == "HEAD":
+        return Response(status_code=code, headers=headers, media_type=media_type)
+    return StreamingResponse(_iter_file(path, start, length), status_code=code, headers=headers, media_type=media_type)
@@ -0,0 +1,98 @@
+import asyncio
+import json
+import logging
+from typing import Dict, Optional, Set
+import redis.asyncio as aioredis
+from worker.utils import progress
+from app import config as config_mod
+
+# Push postępu jobów do klientów: jedna subskrypcja PSUBSCRIBE job:*:events na proces API
+# (zamiast połączenia Redis na klienta), zdarzenia rozsyłane do kolejek asyncio subskrybentów danego joba.
+# Listener startuje przy pierwszym subskrybencie i sam wznawia połączenie po awarii Redis. ready() czeka na
+# potwierdzenie PSUBSCRIBE – snapshot czytany dopiero potem, więc zdarzenie między nimi nie ginie.
+
+log = logging.getLogger(__name__)
+QUEUE_MAX = 64  # wolny klient traci najstarsze zdarzenia, nie blokuje pozostałych
+READY_TIMEOUT_S = 5.0
+
+class ProgressHub:
+    def __init__(self, redis_url: str):
+        self._redis = aioredis.from_url(redis_url, decode_responses=True)
+        self._subs: Dict[str, Set[asyncio.Queue]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._ready = asyncio.Event()
+
+    async def snapshot(self, job_id: str) -> dict:
+        d = await self._redis.hgetall(progress.hash_key(job_id))
+        return progress.event(job_id, d) if d else {}
+
+    def subscribe(self, job_id: str) -> asyncio.Queue:
+        q: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_MAX)
+        self._subs.setdefault(job_id, set()).add(q)
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._listen())
+        return q
+
+    async def ready(self, timeout: float = READY_TIMEOUT_S) -> None:
+        """Subskrypcja wzorca aktywna w Redis; asyncio.TimeoutError, gdy listener nie może się połączyć."""
+        await asyncio.wait_for(self._ready.wait(), timeout)
+
+    def unsubscribe(self, job_id: str, q: asyncio.Queue) -> None:
+        subs = self._subs.get(job_id)
+        if subs is None: return
+        subs.discard(q)
+        if not subs: del self._subs[job_id]
+
+    def subscribers(self) -> int:
+        return sum(len(s) for s in self._subs.values())
+
+    def dispatch(self, chan: str, data: str) -> None:
+        subs = self._subs.get(progress.job_of(chan))
+        if not subs: return
+        try: ev = json.loads(data)
+        except ValueError: return
+        for q in subs:
+            if q.full(): q.get_nowait()
+            q.put_nowait(ev)
+
+    async def _listen(self) -> None:
+        delay = 0.5
+        while True:
+            pubsub = self._redis.pubsub()
+            try:
+                await pubsub.psubscribe(progress.CHANNEL_PATTERN)
+                delay = 0.5
+                async for msg in pubsub.listen():
+                    if msg["type"] == "pmessage": self.dispatch(msg["channel"], msg["data"])
+                    elif msg["type"] == "psubscribe": self._ready.set()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.warning("progress listener: %s (retry in %.1fs)", e, delay)
+            finally:
+                self._ready.clear()
+                try: await pubsub.aclose()
+                except Exception: pass
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 10.0)
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try: await self._task
+            except (asyncio.CancelledError, Exception): pass
+            self._task = None
+        await self._redis.aclose()
+
+_hub: Optional[ProgressHub] = None
+
+def get_hub() -> ProgressHub:
+    global _hub
+    if _hub is None: _hub = ProgressHub(config_mod.get_settings().REDIS_URL)
+    return _hub
+
+async def close_hub() -> None:
+    global _hub
+    if _hub is not None:
+        hub, _hub = _hub, None
+        await hub.close()
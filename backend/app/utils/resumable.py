@@ -0,0 +1,183 @@
+import fcntl
+import json
+import os
+import shutil
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+from anyio import to_thread
+from fastapi import Request, HTTPException, status
+from worker.utils import media_store
+from worker.utils.diskcache import file_sha256
+from .paths import sanitize_filename
+
+# Wznawialne uploady (w stylu tus): sesja = SHARED_DIR/.uploads/<upload_id>/ z meta.json,
+# prealokowanym plikiem data i listą odebranych zakresów [start, end) pod flockiem.
+# Chunki mogą przychodzić równolegle i w dowolnej kolejności (pwrite pod offset).
+# Po complete plik data jest wpięty do media store; upload_id służy potem jako media_id w /generate/media.
+
+WRITE_BATCH = 1024 * 1024
+
+def _reject(code: int, error: str, **extra) -> HTTPException:
+    return HTTPException(status_code=code, detail={"ok": False, "error": error, **extra})
+
+def uploads_root(shared_dir: str) -> Path:
+    return Path(shared_dir) / ".uploads"
+
+def _dir(shared_dir: str, upload_id: str) -> Path:
+    if not upload_id.isalnum(): raise _reject(status.HTTP_404_NOT_FOUND, "upload_not_found")
+    d = uploads_root(shared_dir) / upload_id
+    if not (d / "meta.json").exists(): raise _reject(status.HTTP_404_NOT_FOUND, "upload_not_found")
+    return d
+
+@contextmanager
+def _locked(d: Path):
+    with open(d / ".lock", "a") as lf:
+        fcntl.flock(lf, fcntl.LOCK_EX)
+        try: yield
+        finally: fcntl.flock(lf, fcntl.LOCK_UN)
+
+def _write_json(path: Path, data: dict) -> None:
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(data), encoding="utf-8"); os.replace(tmp, path)
+
+def merge_ranges(ranges: List[List[int]]) -> List[List[int]]:
+    out: List[List[int]] = []
+    for s, e in sorted(ranges):
+        if out and s <= out[-1][1]: out[-1][1] = max(out[-1][1], e)
+        else: out.append([s, e])
+    return out
+
+def load(shared_dir: str, upload_id: str) -> dict:
+    d = _dir(shared_dir, upload_id)
+    meta = json.loads((d / "meta.json").read_text(encoding="utf-8"))
+    meta["dir"] = str(d)
+    return meta
+
+def status_of(meta: dict) -> dict:
+    ranges = meta["ranges"]; size = meta["size"]
+    prefix = ranges[0][1] if ranges and ranges[0][0] == 0 else 0
+    missing, pos = [], 0
+    for s, e in ranges:
+        if s > pos: missing.append([pos, s])
+        pos = e
+    if pos < size: missing.append([pos, size])
+    return {"upload_id": meta["upload_id"], "kind": meta["kind"], "filename": meta["filename"],
+            "size": size, "offset": prefix, "received": sum(e - s for s, e in ranges),
+            "missing": missing[:100], "complete": meta.get("sha256") is not None}
+
+def create(shared_dir: str, kind: str, filename: str, content_type: str, size: int,
+           sha256: Optional[str] = None) -> dict:
+    upload_id = uuid.uuid4().hex
+    d = uploads_root(shared_dir) / upload_id
+    d.mkdir(parents=True)
+    with open(d / "data", "wb") as f: f.truncate(size)  # rzadki plik – chunki lądują pod offsetami
+    meta = {"upload_id": upload_id, "kind": kind, "filename": sanitize_filename(filename),
+            "content_type": content_type, "size": size, "expected_sha256": sha256,
+            "created_at": time.time(), "ranges": [], "sha256": None}
+    _write_json(d / "meta.json", meta)
+    return meta
+
+def parse_content_range(header: Optional[str], length: Optional[int]) -> tuple[int, int, Optional[int]]:
+    """'bytes a-b/total' -> (a, b+1, total); bez nagłówka wymagany Upload-Offset (patrz write_chunk)."""
+    if not header or not header.startswith("bytes "):
+        raise _reject(status.HTTP_400_BAD_REQUEST, "content_range_required")
+    rng, _, total = header[6:].partition("/")
+    a, _, b = rng.partition("-")
+    try:
+        start, end = int(a), int(b) + 1
+        tot = None if total in ("", "*") else int(total)
+    except ValueError:
+        raise _reject(status.HTTP_400_BAD_REQUEST, "bad_content_range")
+    if end <= start or (length is not None and length != end - start):
+        raise _reject(status.HTTP_400_BAD_REQUEST, "bad_content_range")
+    return start, end, tot
+
+async def write_chunk(request: Request, shared_dir: str, upload_id: str, chunk_max: int) -> dict:
+    meta = load(shared_dir, upload_id)
+    if meta.get("sha256"): raise _reject(status.HTTP_409_CONFLICT, "upload_already_complete")
+    length = int(request.headers["content-length"]) if "content-length" in request.headers else None
+    if "upload-offset" in request.headers and "content-range" not in request.headers:
+        if length is None: raise _reject(status.HTTP_411_LENGTH_REQUIRED, "content_length_required")
+        try: start = int(request.headers["upload-offset"])
+        except ValueError: raise _reject(status.HTTP_400_BAD_REQUEST, "bad_upload_offset")
+        end = start + length; total = None
+    else:
+        start, end, total = parse_content_range(request.headers.get("content-range"), length)
+    if total is not None and total != meta["size"]:
+        raise _reject(status.HTTP_400_BAD_REQUEST, "size_mismatch", size=meta["size"])
+    if end > meta["size"]:
+        raise _reject(status.HTTP_416_RANGE_NOT_SATISFIABLE, "chunk_out_of_bounds", size=meta["size"])
+    if end - start > chunk_max:
+        raise _reject(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, "chunk_too_large", limit_bytes=chunk_max)
+
+    d = Path(meta["dir"])
+    fd = await to_thread.run_sync(os.open, str(d / "data"), os.O_WRONLY)
+    pos, buf = start, bytearray()
+    try:
+        async for part in request.stream():
+            if pos + len(buf) + len(part) > end:
+                raise _reject(status.HTTP_400_BAD_REQUEST, "chunk_longer_than_range")
+            buf += part
+            if len(buf) >= WRITE_BATCH:
+                data, buf = bytes(buf), bytearray()
+                pos += await to_thread.run_sync(os.pwrite, fd, data, pos)
+        if buf: pos += await to_thread.run_sync(os.pwrite, fd, bytes(buf), pos)
+    finally:
+        await to_thread.run_sync(os.close, fd)
+    if pos != end:
+        raise _reject(status.HTTP_400_BAD_REQUEST, "chunk_incomplete", received=pos - start)
+
+    def _record() -> dict:
+        with _locked(d):
+            m = json.loads((d / "meta.json").read_text(encoding="utf-8"))
+            m["ranges"] = merge_ranges(m["ranges"] + [[start, end]])
+            _write_json(d / "meta.json", m)
+        m["dir"] = str(d)
+        return m
+    return status_of(await to_thread.run_sync(_record))
+
+def complete(shared_dir: str, upload_id: str, store_dir: Optional[str]) -> dict:
+    d = _dir(shared_dir, upload_id)
+    with _locked(d):
+        meta = json.loads((d / "meta.json").read_text(encoding="utf-8"))
+        if meta.get("sha256") is None:
+            meta["dir"] = str(d)
+            st = status_of(meta)
+            if st["missing"]: raise _reject(status.HTTP_409_CONFLICT, "upload_incomplete", missing=st["missing"])
+            sha = file_sha256(str(d / "data"))
+            if meta.get("expected_sha256") and meta["expected_sha256"].lower() != sha:
+                raise _reject(status.HTTP_422_UNPROCESSABLE_ENTITY, "checksum_mismatch", sha256=sha)
+            meta["sha256"] = sha
+            meta["deduplicated"] = media_store.adopt(str(d / "data"), sha, store_dir) if store_dir and meta["size"] else False
+            meta.pop("dir", None)
+            _write_json(d / "meta.json", meta)
+    return {"ok": True, "media_id": upload_id, "sha256": meta["sha256"], "size": meta["size"],
+            "deduplicated": meta.get("deduplicated", False)}
+
+def delete(shared_dir: str, upload_id: str, store_dir: Optional[str]) -> None:
+    media_store.release_dir(str(_dir(shared_dir, upload_id)), store_dir)
+
+def link_into(meta: dict, dst: Path) -> None:
+    """Media z zakończonego uploadu -> katalog joba (hardlink; kopia gdy inny FS)."""
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    src = Path(meta["dir"]) / "data"
+    try: os.link(src, dst)
+    except OSError: shutil.copyfile(src, dst)
+
+def expire(shared_dir: str, ttl_s: float, store_dir: Optional[str]) -> int:
+    root = uploads_root(shared_dir); now = time.time(); removed = 0
+    if not root.exists(): return 0
+    for d in root.iterdir():
+        try: age = now - (d / "meta.json").stat().st_mtime
+        except FileNotFoundError: continue
+        if age > ttl_s:
+            media_store.release_dir(str(d), store_dir); removed += 1
+    return removed
+
+def manifest_entry(meta: dict, saved: Path) -> Dict:
+    return {"field": "audio" if meta["kind"] == "audio" else "videos", "filename": meta["filename"],
+            "content_type": meta["content_type"], "saved": str(saved), "size": meta["size"],
+            "sha256": meta["sha256"], "deduplicated": meta.get("deduplicated", False), "media_id": meta["upload_id"]}
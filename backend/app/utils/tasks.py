@@ -1,17 +1,129 @@
-import os
-from typing import List
-from celery import Celery
-from ..config import get_settings
-
-_settings = get_settings()
-celery_app = Celery("vrillsy",
-    broker=_settings.CELERY_BROKER_URL,
-    backend=_settings.CELERY_BACKEND_URL,
-)
-
-def enqueue_render_job(job_id: str, audio_path: str, video_paths: List[str], out_dir: str | None = None) -> str:
+import json, logging, os, time, uuid
+from pathlib import Path
+import redis
+from worker.config import LANES
+from worker.utils import estimator, fairshare, render_cache
+from .. import config as config_mod
+from ..celery_client import get_celery
+
+log = logging.getLogger(__name__)
+
+TASK_NAME = "vrillsy.render_job"
+# parametry renderu wchodzące do odcisku (domyślne = domyślne taska)
+RENDER_PARAMS = {"target_duration_s": 10.0, "attention_min_s": 0.25, "attention_max_s": 0.30, "shuffle": False}
+
+def load_manifest(job_id: str) -> dict:
+    path = Path(config_mod.get_settings().SHARED_DIR) / job_id / "manifest.json"
+    return json.loads(path.read_text(encoding="utf-8"))
+
+def target_s(man: dict) -> float:
+    params = {**RENDER_PARAMS, **(man.get("params") or {})}
+    try: return float(params["target_duration_s"])
+    except (TypeError, ValueError): return RENDER_PARAMS["target_duration_s"]
+
+def estimate_cost(man: dict, pipeline: str = TASK_NAME) -> tuple[float, dict]:
+    """(przewidywany czas renderu w s pracy workera, cechy) – model estymatora pipeline'u z metadanych wejść.
+    Bez ffprobe w API (do MAX_VIDEOS procesów na żądanie, poza budżetem CPU): rozmiary plików z clip_meta."""
+    feats = estimator.job_features([v["saved"] for v in man["files"]["videos"]], target_s(man), man.get("mode", "final"),
+                                   probe_inputs=False, pipeline=pipeline)
+    return estimator.predict(pipeline, feats), feats
+
+def lane_for(man: dict, cost_s: float) -> str:
+    if man.get("mode") == "preview": return "preview"
+    return "long" if cost_s >= config_mod.get_settings().ROUTE_LONG_COST_S else "short"
+
+def _headers(man: dict, lane: str, cost: float, feats: dict) -> dict:
+    headers = {"enqueued_at": time.time(), "vrs_lane": lane, "vrs_cost_s": round(cost, 1), "vrs_features": feats}
+    if man.get("user_id"): headers["vrs_user"] = str(man["user_id"])
+    return headers
+
+def render_payload(job_id: str, out_dir: str | None = None, task_id: str | None = None,
+                   fingerprint: str | None = None) -> dict:
+    """Argumenty send_task dla vrillsy.render_job z manifest.json zapisanego przez /generate."""
+    man = load_manifest(job_id)
     out = out_dir or os.getenv("OUTPUT_DIR", "/outputs")
-    res = celery_app.send_task("vrillsy.render_job",
-                               args=[job_id, audio_path, video_paths, out],
-                               queue="vrillsy")
-    return res.id
+    kwargs = {"mode": man.get("mode", "final")}
+    if fingerprint: kwargs["fingerprint"] = fingerprint
+    cost, feats = estimate_cost(man); lane = lane_for(man, cost)
+    return {"name": TASK_NAME,
+            "args": [job_id, man["files"]["audio"]["saved"], [v["saved"] for v in man["files"]["videos"]], out],
+            "kwargs": kwargs, "queue": LANES[lane], "task_id": task_id or uuid.uuid4().hex,
+            "headers": _headers(man, lane, cost, feats)}
+
+def _send(payload: dict) -> str:
+    return get_celery().send_task(**payload).id
+
+def _submit(payload: dict) -> str:
+    """Render użytkownika ponad USER_MAX_CONCURRENT czeka w fairshare (task_id jest znany od razu,
+    /status pokazuje PENDING do czasu wysłania); bez user_id albo bez Redis – wysyłka od razu."""
+    estimator.remember(payload["task_id"], payload["headers"]["vrs_cost_s"])
+    user = payload["headers"].get("vrs_user")
+    if not user: return _send(payload)
+    try:
+        fairshare.submit(user, payload, _send)
+    except redis.RedisError as e:
+        log.warning("fair share unavailable, sending directly: %s", e)
+        return _send(payload)
+    return payload["task_id"]
+
+def enqueue_render_job(job_id: str, out_dir: str | None = None, task_id: str | None = None,
+                       fingerprint: str | None = None) -> str:
+    """Wysyła render do lane'u wg kosztu, przez fair share użytkownika."""
+    return _submit(render_payload(job_id, out_dir, task_id, fingerprint))
+
+def enqueue_render_batch(job_id: str) -> str:
+    """render_batch (worker.tasks.render_job) – warianty z manifestu, wyniki w OUTPUTS_DIR workera.
+    Koszt ~ liczba wariantów × render pojedynczy (wspólne ingest/analiza – górne oszacowanie do wyboru lane'u)."""
+    man = load_manifest(job_id)
+    cost, feats = estimate_cost(man, "render_job")
+    cost *= max(1, len(man["variants"])); lane = lane_for(man, cost)
+    return _submit({"name": "render_batch", "args": [job_id, man["variants"]], "kwargs": {"mode": man.get("mode", "final")},
+                    "queue": LANES[lane], "task_id": uuid.uuid4().hex, "headers": _headers(man, lane, cost, feats)})
+
+def enqueue_plan_render(job_id: str, mode: str) -> str:
+    """render_job (worker.tasks.render_job) dla istniejącego joba: zapisuje plan montażu przy pierwszym renderze,
+    kolejny (final po podglądzie) tnie z tego samego planu. Lease per (job, tryb) – final może biec obok podglądu."""
+    man = dict(load_manifest(job_id), mode=mode)
+    cost, feats = estimate_cost(man, "render_job"); lane = lane_for(man, cost)
+    return _submit({"name": "render_job", "args": [job_id, target_s(man)], "kwargs": {"mode": mode},
+                    "queue": LANES[lane], "task_id": uuid.uuid4().hex, "headers": _headers(man, lane, cost, feats)})
+
+def render_fingerprint(man: dict) -> str:
+    files = man["files"]
+    return render_cache.fingerprint(files["audio"]["sha256"], [v["sha256"] for v in files["videos"]],
+                                    man.get("mode", "final"), {**RENDER_PARAMS, **(man.get("params") or {})}, TASK_NAME)
+
+def _alive(task_id: str) -> bool:
+    return get_celery().AsyncResult(task_id).state not in ("FAILURE", "REVOKED")
+
+def submit_render_job(job_id: str) -> dict:
+    """Jak enqueue_render_job, ale identyczne zlecenie (ten sam odcisk) nie renderuje się drugi raz:
+    cache "hit" = gotowy plik, "inflight" = dołączenie do biegnącego taska, "miss" = nowy task."""
+    fp = None
+    if config_mod.get_settings().RENDER_CACHE:
+        task_id = uuid.uuid4().hex
+        fp = render_fingerprint(load_manifest(job_id))
+        try:
+            cur = render_cache.claim(fp, task_id, job_id, alive=_alive)
+        except redis.RedisError as e:
+            log.warning("render cache unavailable: %s", e); fp = None
+        else:
+            if cur is not None:
+                if cur["state"] == "done":
+                    return {"task_id": cur["task_id"], "job_id": cur["job_id"], "cache": "hit", "out": cur.get("out"),
+                            "estimate_s": 0.0}
+                return {"task_id": cur["task_id"], "job_id": cur["job_id"], "cache": "inflight",
+                        **_estimate(cur["task_id"])}
+    if fp is None:
+        task_id = enqueue_render_job(job_id)
+    else:
+        try:
+            task_id = enqueue_render_job(job_id, task_id=task_id, fingerprint=fp)
+        except BaseException:
+            render_cache.release(fp, task_id)
+            raise
+    return {"task_id": task_id, "job_id": job_id, "cache": "miss", **_estimate(task_id)}
+
+def _estimate(task_id: str) -> dict:
+    est = estimator.recall(task_id)
+    return {"estimate_s": est["estimate_s"]} if est else {}
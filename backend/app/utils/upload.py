@@ -1,35 +1,181 @@
+import hashlib
 import json
-from typing import Dict, Iterable, List, Tuple
-from fastapi import UploadFile, HTTPException, status
-from .paths import sanitize_filename
-from .. import config as config_mod
-
-# Strumieniowy zapis z liczeniem bajtów i limitowaniem łącznego rozmiaru
-def save_streaming(
-    upload: UploadFile,
-    dst_path: str,
-    total_counter: Dict[str, int],
-) -> Tuple[int, str]:
-    CHUNK = 1024 * 1024  # 1 MiB
-    size = 0
-    with open(dst_path, "wb") as f:
-        while True:
-            chunk = upload.file.read(CHUNK)
-            if not chunk:
-                break
-            size += len(chunk)
-            total_counter["bytes"] += len(chunk)
-            settings = config_mod.get_settings()
-            if total_counter["bytes"] > settings.MAX_TOTAL_UPLOAD_MB * 1024 * 1024:
-                # przerwij zapis i zgłoś 413
-                f.flush()
-                raise HTTPException(
-                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-                    detail={"ok": False, "error": "payload_too_large", "limit_mb": settings.MAX_TOTAL_UPLOAD_MB},
-                )
-            f.write(chunk)
-    return size, sanitize_filename(upload.filename or "file")
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+from anyio import to_thread
+from fastapi import Request, HTTPException, status
+from python_multipart.exceptions import MultipartParseError
+from python_multipart.multipart import MultipartParser, parse_options_header
+from worker.utils import media_store
+from .paths import sanitize_filename, ensure_dir
+
+# Strumieniowy odbiór multipart/form-data prosto do katalogu joba:
+# bez spoolowania Starlette (jeden zapis na bajt), zapis i SHA-256 w wątku (nie blokuje pętli zdarzeń),
+# limit łącznego rozmiaru liczony przyrostowo, MIME i liczba plików sprawdzane już na nagłówkach części.
+# Po zamknięciu pliku (hash znany) identyczna treść jest podmieniana na hardlink do bloba w media store.
+
+FLUSH_BYTES = 1024 * 1024      # tyle danych zbieramy w pamięci przed zrzutem na dysk w wątku
+MAX_FIELD_BYTES = 64 * 1024    # pola tekstowe (user_id, params, ...)
+MAX_FIELDS = 32
+
+def _reject(code: int, error: str, **extra) -> HTTPException:
+    return HTTPException(status_code=code, detail={"ok": False, "error": error, **extra})
+
+@dataclass
+class FileRule:
+    subdir: str
+    allowed_mime: List[str]
+    max_count: int
+
+@dataclass
+class SavedFile:
+    field: str
+    filename: str
+    content_type: str
+    saved: str
+    size: int = 0
+    sha256: str = ""
+    deduplicated: bool = False
+    _f: Optional[object] = field(default=None, repr=False)
+    _h: Optional[object] = field(default=None, repr=False)
+
+    def write(self, data: bytes) -> None:  # wątek roboczy
+        if self._f is None:
+            self._f = open(self.saved, "wb"); self._h = hashlib.sha256()
+        self._f.write(data); self._h.update(data); self.size += len(data)
+
+    def close(self, store_dir: Optional[str] = None) -> None:  # wątek roboczy
+        if self._f is None:
+            self._f = open(self.saved, "wb"); self._h = hashlib.sha256()
+        self._f.close(); self.sha256 = self._h.hexdigest()
+        if store_dir and self.size:
+            self.deduplicated = media_store.adopt(self.saved, self.sha256, store_dir)
+
+    def abort(self) -> None:
+        if self._f is not None and not self._f.closed: self._f.close()
+
+    def to_manifest(self) -> dict:
+        return {"field": self.field, "filename": self.filename, "content_type": self.content_type,
+                "saved": self.saved, "size": self.size, "sha256": self.sha256, "deduplicated": self.deduplicated}
+
+@dataclass
+class MultipartResult:
+    fields: Dict[str, str]
+    files: Dict[str, List[SavedFile]]
+
+class _Receiver:
+    def __init__(self, job_dir: Path, rules: Dict[str, FileRule], max_total_bytes: int, store_dir: Optional[str]):
+        self.job_dir = job_dir; self.rules = rules; self.max_total = max_total_bytes; self.store_dir = store_dir
+        self.total = 0
+        self.fields: Dict[str, str] = {}
+        self.files: Dict[str, List[SavedFile]] = {name: [] for name in rules}
+        self.pending: list = []  # (SavedFile, bytes | None=zamknij)
+        self.pending_bytes = 0
+        self._headers: Dict[bytes, bytes] = {}
+        self._hname = b""; self._hval = b""
+        self._file: Optional[SavedFile] = None
+        self._field: Optional[str] = None
+        self._buf = bytearray()
+
+    # --- callbacki parsera (pętla zdarzeń, bez I/O) ---
+    def on_part_begin(self) -> None:
+        self._headers = {}; self._file = None; self._field = None; self._buf = bytearray()
+
+    def on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._hname += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._hval += data[start:end]
+
+    def on_header_end(self) -> None:
+        self._headers[self._hname.lower()] = self._hval; self._hname = b""; self._hval = b""
+
+    def on_headers_finished(self) -> None:
+        _, opts = parse_options_header(self._headers.get(b"content-disposition", b""))
+        name = opts.get(b"name", b"").decode("utf-8", "replace")
+        filename = opts.get(b"filename")
+        if filename is None:
+            if len(self.fields) >= MAX_FIELDS: raise _reject(status.HTTP_400_BAD_REQUEST, "too_many_fields")
+            self._field = name
+            return
+        rule = self.rules.get(name)
+        if rule is None:
+            raise _reject(status.HTTP_400_BAD_REQUEST, "unexpected_file_field", field=name)
+        saved = self.files[name]
+        if len(saved) >= rule.max_count:
+            raise _reject(status.HTTP_400_BAD_REQUEST, "too_many_files", field=name, limit=rule.max_count)
+        ctype = self._headers.get(b"content-type", b"application/octet-stream").decode("latin-1").split(";")[0].strip().lower()
+        if ctype not in rule.allowed_mime:
+            raise _reject(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, "mime_not_allowed", field=name, mime=ctype)
+        fname = sanitize_filename(filename.decode("utf-8", "replace"))
+        dst = self.job_dir / rule.subdir / f"{len(saved):03d}_{fname}"
+        self._file = SavedFile(field=name, filename=fname, content_type=ctype, saved=str(dst))
+        saved.append(self._file)
+
+    def on_part_data(self, data: bytes, start: int, end: int) -> None:
+        n = end - start
+        if self._file is None:
+            if len(self._buf) + n > MAX_FIELD_BYTES: raise _reject(status.HTTP_400_BAD_REQUEST, "field_too_large", field=self._field)
+            self._buf += data[start:end]
+            return
+        self.total += n
+        if self.total > self.max_total:
+            raise _reject(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, "payload_too_large",
+                          limit_mb=self.max_total // (1024 * 1024))
+        self.pending.append((self._file, bytes(data[start:end]))); self.pending_bytes += n
+
+    def on_part_end(self) -> None:
+        if self._file is None:
+            if self._field: self.fields[self._field] = self._buf.decode("utf-8", "replace")
+            return
+        self.pending.append((self._file, None))
+
+    # --- zrzut na dysk (wątek) ---
+    def flush(self) -> None:
+        batch, self.pending, self.pending_bytes = self.pending, [], 0
+        for f, data in batch:
+            if data is None: f.close(self.store_dir)
+            else: f.write(data)
+
+    def abort(self) -> None:
+        for lst in self.files.values():
+            for f in lst: f.abort()
+
+async def receive_multipart(request: Request, job_dir: Path, rules: Dict[str, FileRule],
+                            max_total_bytes: int, store_dir: Optional[str] = None) -> MultipartResult:
+    """Parsuje body żądania w locie; pliki trafiają do job_dir/<rule.subdir>/. Przy błędzie rzuca HTTPException
+    (sprzątanie katalogu joba należy do wołającego)."""
+    ctype, opts = parse_options_header(request.headers.get("content-type", ""))
+    if ctype != b"multipart/form-data" or b"boundary" not in opts:
+        raise _reject(status.HTTP_400_BAD_REQUEST, "multipart_required")
+    for rule in rules.values(): ensure_dir(job_dir / rule.subdir)
+
+    rx = _Receiver(job_dir, rules, max_total_bytes, store_dir)
+    parser = MultipartParser(opts[b"boundary"], {
+        "on_part_begin": rx.on_part_begin, "on_header_field": rx.on_header_field,
+        "on_header_value": rx.on_header_value, "on_header_end": rx.on_header_end,
+        "on_headers_finished": rx.on_headers_finished, "on_part_data": rx.on_part_data,
+        "on_part_end": rx.on_part_end,
+    })
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            if rx.pending_bytes >= FLUSH_BYTES or (rx.pending and rx.pending[-1][1] is None):
+                await to_thread.run_sync(rx.flush)
+        parser.finalize()
+        await to_thread.run_sync(rx.flush)
+    except MultipartParseError as e:
+        rx.abort()
+        raise _reject(status.HTTP_400_BAD_REQUEST, "malformed_multipart", msg=str(e)) from e
+    except BaseException:
+        rx.abort()
+        raise
+    return MultipartResult(fields=rx.fields, files=rx.files)
 
 def serialize_manifest(manifest: dict, manifest_path: str) -> None:
-    with open(manifest_path, "w", encoding="utf-8") as f:
+    tmp = manifest_path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
         json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, manifest_path)  # worker nigdy nie zobaczy połowy manifestu
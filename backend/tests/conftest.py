@@ -0,0 +1,10 @@
+import os, sys
+from pathlib import Path
+
+# API importuje wspólne moduły z worker/ (metryki) – korzeń repo musi być na ścieżce
+ROOT = Path(__file__).resolve().parents[2]
+for p in (str(ROOT / "backend"), str(ROOT)):
+    if p not in sys.path: sys.path.insert(0, p)
+
+os.environ.setdefault("VRS_DISABLE_AUTH", "1")
+os.environ.setdefault("REDIS_URL", "redis://127.0.0.1:6379/0")
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from worker.tasks import render_job as rj
+from worker.utils import analysis
+
+SR = 11025
+
+def _clicks(period_s=0.5, dur_s=8.0):
+    x = np.zeros(int(SR * dur_s), dtype=np.float32)
+    for t in np.arange(0.25, dur_s, period_s):
+        i = int(t * SR); x[i:i + 200] = np.hanning(200) * np.sin(np.arange(200) * 0.9)
+    return x
+
+def _blocks(x, n):
+    return (x[i:i + n] for i in range(0, len(x), n))
+
+def test_native_engine_finds_click_grid_independent_of_block_size():
+    x = _clicks()
+    a = analysis.analyze_blocks(_blocks(x, SR), sr=SR)
+    b = analysis.analyze_blocks(_blocks(x, 4096 + 7), sr=SR)  # granice bloków nie zmieniają wyniku
+    assert a.onsets == b.onsets and len(a.onsets) == 16
+    assert np.max(np.abs(np.array(a.onsets) - np.arange(0.25, 8.0, 0.5))) < 0.05
+    assert a.tempo == pytest.approx(120, abs=3) and a.duration_s == pytest.approx(8.0)
+
+@pytest.mark.parametrize("backend", ["legacy", "native"])
+def test_analyze_audio_picks_engine_from_config(monkeypatch, backend):
+    monkeypatch.setattr(rj, "ANALYSIS_BACKEND", backend)
+    monkeypatch.setattr(rj, "aubio_onsets", lambda p: [1.0])
+    monkeypatch.setattr(rj.analysis, "analyze", lambda p: analysis.analyze_blocks(_blocks(_clicks(), SR), sr=SR))
+    res = rj.analyze_audio("track.wav")
+    if backend == "legacy": assert res == {"onsets": [1.0]}
+    else: assert len(res["onsets"]) == 16 and {"beats", "tempo", "rms", "env_rate"} <= res.keys()
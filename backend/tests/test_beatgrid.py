@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+
+from worker.utils.beatgrid import BeatGrid
+
+def test_nearest_matches_linear_scan_with_ties_to_earlier_beat():
+    times = [2.0, 0.5, 1.0, 1.0, 3.5]  # nieposortowane, z duplikatem
+    g = BeatGrid(times)
+    qs = [-1.0, 0.5, 0.75, 1.5, 2.75, 2.76, 9.0]  # 0.75 / 1.5 / 2.75 = remisy
+    expected = [min(sorted(times), key=lambda b: abs(b - q)) for q in qs]  # min() bierze pierwszy, czyli wcześniejszy
+    assert [g.nearest(q) for q in qs] == expected == [0.5, 0.5, 0.5, 1.0, 2.0, 3.5, 3.5]
+    assert g.nearest_many(qs).tolist() == expected
+
+def test_window_counts_and_sync_stats():
+    g = BeatGrid([0.0, 1.0, 1.0, 2.0])
+    assert g.count_between(1.0, 2.0) == 3  # obustronnie domknięte, duplikaty liczone
+    assert g.density(1.0).tolist() == [1, 2, 2, 1]
+    assert g.snap(1.04, 0.05) == 1.0 and g.snap(1.2, 0.05) == 1.2
+    assert g.sync_ratio([0.02, 1.5]) == 0.5 and g.mae([0.02, 1.5]) == pytest.approx(0.26)
+
+def test_empty_and_single_beat_grids():
+    empty, one = BeatGrid([]), BeatGrid([4.0])
+    assert not empty and empty.nearest(1.5) == 1.5 and empty.sync_ratio([1.0]) is None
+    assert np.array_equal(empty.nearest_many([1.0, 2.0]), [1.0, 2.0])
+    assert one.nearest(0.0) == 4.0 and one.nearest_many([9.0]).tolist() == [4.0]
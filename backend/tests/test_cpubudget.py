@@ -0,0 +1,42 @@
+import threading
+import time
+import pytest
+
+from worker.utils import cpubudget
+
+@pytest.fixture
+def budget(tmp_path, monkeypatch):
+    monkeypatch.setattr(cpubudget, "CPU_BUDGET_FILE", str(tmp_path / "budget.json"))
+    monkeypatch.setattr(cpubudget, "CPU_BUDGET", 8)
+    monkeypatch.setattr(cpubudget, "CPU_MIN_THREADS", 2)
+    monkeypatch.setattr(cpubudget, "_report", lambda st: None)
+    monkeypatch.setattr(cpubudget.metrics, "observe", lambda *a, **k: None)
+    monkeypatch.setattr(cpubudget.metrics, "inc", lambda *a, **k: None)
+
+def test_threads_injected_into_ffmpeg_commands():
+    s = cpubudget.with_threads('ffmpeg -y -i "a b.mp4" -c:v libx264 -threads 8 "out.mp4"', 3)
+    assert s == ('ffmpeg -filter_threads 3 -filter_complex_threads 3 -y -threads 3 -i "a b.mp4" '
+                 '-c:v libx264 -threads 3 "out.mp4"')
+    assert cpubudget.with_threads(s, 5) == s.replace("3", "5")  # idempotentne: bez drugiej kopii
+    assert cpubudget.with_threads('ffmpeg -y -i a -c:v libx264 "o.mp4"', 2) == \
+        'ffmpeg -filter_threads 2 -filter_complex_threads 2 -y -threads 2 -i a -c:v libx264 -threads 2 "o.mp4"'
+    assert cpubudget.with_threads(["ffmpeg", "-i", "a", "-threads", "9", "o"], 2) == \
+        ["ffmpeg", "-filter_threads", "2", "-filter_complex_threads", "2", "-threads", "2", "-i", "a",
+         "-threads", "2", "o"]
+    assert cpubudget.with_threads(["aubioonset", "-i", "x"], 2) == ["aubioonset", "-i", "x"]
+    assert cpubudget.wanted('ffmpeg -i a -threads 6 "o"') == 6
+    assert cpubudget.wanted('ffmpeg -f concat -i l -c copy "o"') == 1
+
+def test_slots_shrink_then_queue_until_tokens_return(budget):
+    order = []
+    with cpubudget.slot(6) as a:
+        with cpubudget.slot(6) as b:  # zostały 2 tokeny: przydział zmniejszony do minimum
+            assert (a.threads, b.threads) == (6, 2)
+            def late():
+                with cpubudget.slot(4) as c: order.append(("late", c.threads))
+            t = threading.Thread(target=late); t.start()
+            time.sleep(0.1)
+            assert order == [] and cpubudget.stats()["waiting"] == 1
+        t.join(5)
+    assert order == [("late", 2)]  # wolne 2 tokeny po b – nie czeka na a
+    assert cpubudget.stats()["used"] == 0
@@ -0,0 +1,53 @@
+from pathlib import Path
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from app.utils.http_range import file_response
+
+DATA = bytes(range(256)) * 40  # 10240 B
+
+@pytest.fixture
+def client(tmp_path):
+    f = tmp_path / "out.mp4"
+    f.write_bytes(DATA)
+    app = FastAPI()
+
+    @app.api_route("/f", methods=["GET", "HEAD"])
+    def get_file(request: Request):
+        return file_response(request, Path(f), "video/mp4", filename="out.mp4")
+
+    return TestClient(app)
+
+def test_full_get_has_validators(client):
+    r = client.get("/f")
+    assert r.status_code == 200
+    assert r.content == DATA
+    assert r.headers["accept-ranges"] == "bytes"
+    assert r.headers["etag"].startswith('"')
+    assert "last-modified" in r.headers
+
+def test_range_requests(client):
+    r = client.get("/f", headers={"Range": "bytes=100-199"})
+    assert r.status_code == 206
+    assert r.content == DATA[100:200]
+    assert r.headers["content-range"] == f"bytes 100-199/{len(DATA)}"
+    r = client.get("/f", headers={"Range": "bytes=-10"})
+    assert r.status_code == 206 and r.content == DATA[-10:]
+    r = client.get("/f", headers={"Range": "bytes=10000-"})
+    assert r.status_code == 206 and r.content == DATA[10000:]
+    r = client.get("/f", headers={"Range": f"bytes={len(DATA)}-"})
+    assert r.status_code == 416
+    assert r.headers["content-range"] == f"bytes */{len(DATA)}"
+
+def test_conditional_and_head(client):
+    etag = client.head("/f").headers["etag"]
+    r = client.get("/f", headers={"If-None-Match": etag})
+    assert r.status_code == 304 and r.content == b""
+    lm = client.head("/f").headers["last-modified"]
+    assert client.get("/f", headers={"If-Modified-Since": lm}).status_code == 304
+    # If-Range z nieaktualnym ETagiem -> cały plik
+    r = client.get("/f", headers={"Range": "bytes=0-9", "If-Range": '"stale"'})
+    assert r.status_code == 200 and len(r.content) == len(DATA)
+    h = client.head("/f", headers={"Range": "bytes=0-9"})
+    assert h.status_code == 206 and h.headers["content-length"] == "10" and h.content == b""
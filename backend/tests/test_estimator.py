@@ -0,0 +1,44 @@
+import random
+
+from worker.utils import estimator
+
+def _samples(n, weights):
+    rng = random.Random(7); out = []
+    for _ in range(n):
+        clips = [{"w": rng.choice((1280, 1920, 3840)), "h": rng.choice((720, 1080, 2160)), "dur": rng.uniform(3, 60),
+                  "codec": rng.choice(("h264", "hevc"))} for _ in range(rng.randint(1, 12))]
+        f = estimator.features(clips, rng.uniform(5, 90), rng.choice(("final", "preview")))
+        out.append({"f": f, "y": sum(weights[k] * f[k] for k in estimator.FEATURES) * rng.uniform(0.95, 1.05)})
+    return out
+
+def test_fit_learns_cost_from_samples():
+    true = {"bias": 4.0, "target_s": 0.1, "clips": 2.5, "in_mpxs": 0.03, "in_hard_mpxs": 0.05, "out_mpxs": 0.4, "cuts": 0.02}
+    m = estimator.fit(_samples(1000, true))
+    assert m["n"] == 1000 and m["mape"] < 0.1
+    errs = [abs(estimator._dot(m["weights"], s["f"]) - s["y"]) / s["y"] for s in _samples(50, true)]
+    assert sum(errs) / len(errs) < 0.1
+
+def test_few_samples_move_from_prior_towards_data():
+    assert estimator.fit([])["weights"] == {k: estimator.PRIOR[k] for k in estimator.FEATURES}
+    slow = {k: 3 * v for k, v in estimator.PRIOR.items()}
+    m = estimator.fit(_samples(3, slow))
+    err = lambda w: sum(abs(estimator._dot(w, s["f"]) - s["y"]) / s["y"] for s in _samples(30, slow)) / 30
+    assert err(m["weights"]) < err(estimator.PRIOR) / 2
+
+def test_api_features_never_spawn_ffprobe(tmp_path, monkeypatch):
+    v = tmp_path / "v.mp4"; v.write_bytes(b"\0" * 1_000_000)  # ~1 s przy 8 Mb/s
+    monkeypatch.setattr(estimator.probe, "_ffprobe", lambda p: (_ for _ in ()).throw(AssertionError("ffprobe in API")))
+    f = estimator.job_features([str(v)], 10.0, probe_inputs=False)
+    assert f["clips"] == 1 and f["in_mpxs"] == round(1920 * 1080 * 1.0 / 1e6, 3)
+    monkeypatch.setattr(estimator.probe, "_ffprobe", lambda p: {"streams": [
+        {"codec_type": "video", "width": 640, "height": 360, "codec_name": "hevc"}], "format": {"duration": "2"}})
+    estimator.probe.probe(str(v))  # sonda workera w tym procesie – API bierze ją z pamięci
+    assert estimator.job_features([str(v)], 10.0, probe_inputs=False)["in_hard_mpxs"] == round(640 * 360 * 2 / 1e6, 3)
+
+def test_features_follow_the_estimated_pipeline():
+    clips = [{"w": 1920, "h": 1080, "dur": 30.0, "codec": "h264"}] * 5
+    full, quick = estimator.features(clips, 10.0), estimator.features(clips, 10.0, pipeline="vrillsy.render_job")
+    assert (full["clips"], full["out_mpxs"]) == (5, round(1080 * 1920 * 10 / 1e6, 3))
+    # vrillsy.render_job: 3 klipy po 3.33 s, wyjście 720x1080, cięcia = styki klipów
+    assert (quick["clips"], quick["cuts"], quick["out_mpxs"]) == (3, 2, round(720 * 1080 * 9.99 / 1e6, 3))
+    assert quick["in_mpxs"] == round(3 * 1920 * 1080 * 3.33 / 1e6, 3)
@@ -0,0 +1,104 @@
+import asyncio
+import json
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.config import Settings
+import app.routers.events as events_mod
+from app.utils.progress_hub import ProgressHub
+
+class FakeHub:
+    """Snapshot z hasha + zdarzenia, które 'przyjdą' z pub/sub po subskrypcji."""
+    def __init__(self, snap, events):
+        self.snap = snap; self.events = events; self.active = 0
+    def subscribe(self, job_id):
+        q = asyncio.Queue(); self.active += 1
+        for ev in self.events: q.put_nowait(ev)
+        return q
+    def unsubscribe(self, job_id, q):
+        self.active -= 1
+    async def ready(self):
+        pass
+    async def snapshot(self, job_id):
+        return self.snap
+
+def _events(body: str):
+    return [json.loads(line[6:]) for line in body.splitlines() if line.startswith("data: ")]
+
+@pytest.fixture
+def hub(monkeypatch):
+    h = FakeHub({"job_id": "j1", "stage": "normalize", "progress": 15},
+                [{"job_id": "j1", "stage": "plan", "progress": 50},
+                 {"job_id": "j1", "stage": "done", "progress": 100},
+                 {"job_id": "j1", "stage": "never_sent"}])
+    monkeypatch.setattr(events_mod, "get_hub", lambda: h)
+    return h
+
+def test_sse_streams_snapshot_then_events_until_done(hub):
+    with TestClient(app) as client:
+        r = client.get("/jobs/j1/events")
+    assert r.status_code == 200 and r.headers["content-type"].startswith("text/event-stream")
+    assert [e["stage"] for e in _events(r.text)] == ["normalize", "plan", "done"]
+    assert hub.active == 0
+
+def test_sse_terminal_snapshot_closes_immediately(hub):
+    hub.snap = {"job_id": "j1", "stage": "error", "error": "boom"}
+    r = TestClient(app).get("/jobs/j1/events")
+    assert [e["stage"] for e in _events(r.text)] == ["error"]
+
+def test_websocket_events(hub):
+    with TestClient(app).websocket_connect("/ws/jobs/j1") as ws:
+        assert [ws.receive_json()["stage"] for _ in range(3)] == ["normalize", "plan", "done"]
+    assert hub.active == 0
+
+def test_unknown_job_is_404_unless_job_dir_exists(hub, tmp_path, monkeypatch):
+    s = Settings(SHARED_DIR=str(tmp_path))
+    monkeypatch.setattr(events_mod.config_mod, "get_settings", lambda: s)
+    hub.snap, hub.events = {}, [{"job_id": "j1", "stage": "done"}]
+    client = TestClient(app)
+    r = client.get("/jobs/j1/events")
+    assert r.status_code == 404 and r.json()["detail"]["error"] == "job_not_found" and hub.active == 0
+    with client.websocket_connect("/ws/jobs/j1") as ws:
+        assert ws.receive_json()["error"] == "job_not_found"
+        assert ws.receive()["code"] == 4404
+    (tmp_path / "j1").mkdir()  # wgrany, worker jeszcze nie ruszył
+    assert [e["stage"] for e in _events(client.get("/jobs/j1/events").text)] == ["done"]
+
+def test_hub_fanout_drops_oldest_for_slow_client():
+    async def go():
+        hub = ProgressHub("redis://127.0.0.1:1/0")
+        hub._task = asyncio.get_running_loop().create_future()  # bez prawdziwego listenera
+        a, b = hub.subscribe("j1"), hub.subscribe("j1")
+        other = hub.subscribe("j2")
+        for i in range(70):
+            hub.dispatch("job:j1:events", json.dumps({"stage": "segments", "progress": i}))
+        hub.unsubscribe("j1", b)
+        hub.dispatch("job:j1:events", json.dumps({"stage": "done"}))
+        return a, b, other, hub.subscribers()
+    a, b, other, n = asyncio.run(go())
+    assert a.qsize() == 64 and a.get_nowait()["progress"] == 7
+    assert b.qsize() == 64 and other.empty() and n == 2
+
+def test_hub_ready_only_after_psubscribe_is_confirmed():
+    class FakePubSub:
+        def __init__(self): self.confirm = asyncio.Event()
+        async def psubscribe(self, pattern): pass
+        async def listen(self):
+            await self.confirm.wait()
+            yield {"type": "psubscribe", "channel": "job:*:events", "data": 1}
+            yield {"type": "pmessage", "channel": "job:j1:events", "data": json.dumps({"stage": "done"})}
+            await asyncio.Event().wait()
+        async def aclose(self): pass
+    async def go():
+        hub = ProgressHub("redis://127.0.0.1:1/0")
+        ps = FakePubSub(); hub._redis.pubsub = lambda **kw: ps
+        q = hub.subscribe("j1")
+        with pytest.raises(asyncio.TimeoutError):
+            await hub.ready(0.05)  # PSUBSCRIBE wysłane, Redis jeszcze nie potwierdził
+        ps.confirm.set()
+        await hub.ready(1)
+        ev = await asyncio.wait_for(q.get(), 1)
+        hub._task.cancel()
+        return ev
+    assert asyncio.run(go()) == {"stage": "done"}
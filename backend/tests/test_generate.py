@@ -23,13 +23,14 @@ def override_settings(tmp_path, monkeypatch):
         ALLOWED_AUDIO_MIME=["audio/mpeg"],
         CELERY_BROKER_URL="memory://",
         CELERY_BACKEND_URL="rpc://",
+        RENDER_CACHE=False,  # bez Redis z otoczenia testu; test łączenia zleceń włącza go z claim w pamięci
     )
     monkeypatch.setattr(config_mod, "get_settings", lambda: s)
     yield
 
 @pytest.fixture(autouse=True)
 def stub_enqueue(monkeypatch):
-    monkeypatch.setattr(tasks_mod, "enqueue_render_job", lambda job_id: "task_dummy_123")
+    monkeypatch.setattr(tasks_mod, "enqueue_render_job", lambda job_id, **kw: "task_dummy_123")
     yield
 
 client = TestClient(app)
@@ -95,3 +96,85 @@ def test_mime_not_allowed(tmp_path):
     assert r.status_code == 415
     body = r.json()
     assert body["detail"]["error"] == "mime_not_allowed"
+
+def test_files_streamed_into_job_dir_with_hash(tmp_path):
+    import hashlib
+    payload = b"\x01\x02" * 40_000
+    files = [
+        ("audio", ("a.mp3", _fake_mp3(), "audio/mpeg")),
+        ("videos", ("my clip.mp4", io.BytesIO(payload), "video/mp4")),
+    ]
+    r = client.post("/generate", data={"user_id": "u1", "mode": "preview"}, files=files)
+    assert r.status_code == 200, r.text
+    job_dir = Path(config_mod.get_settings().SHARED_DIR) / r.json()["job_id"]
+    man = json.loads((job_dir / "manifest.json").read_text())
+    v = man["files"]["videos"][0]
+    assert Path(v["saved"]).parent == job_dir / "video"
+    assert Path(v["saved"]).read_bytes() == payload
+    assert v["size"] == len(payload) and v["sha256"] == hashlib.sha256(payload).hexdigest()
+    assert man["mode"] == "preview"
+    # żadnych plików tymczasowych obok
+    assert sorted(p.name for p in job_dir.iterdir()) == ["audio", "manifest.json", "video"]
+
+def test_rejected_upload_cleans_job_dir(tmp_path):
+    files = [("audio", ("a.mp3", _fake_mp3(), "audio/mpeg")),
+             ("videos", ("bad.txt", io.BytesIO(b"abc"), "text/plain"))]
+    r = client.post("/generate", data={"user_id": "u1"}, files=files)
+    assert r.status_code == 415
+    assert [p for p in Path(config_mod.get_settings().SHARED_DIR).iterdir() if not p.name.startswith(".")] == []
+
+def test_identical_uploads_share_one_blob(tmp_path):
+    payload = b"\x07" * 120_000
+    ids = []
+    for _ in range(2):
+        files = [("audio", ("a.mp3", _fake_mp3(), "audio/mpeg")),
+                 ("videos", ("v.mp4", io.BytesIO(payload), "video/mp4"))]
+        r = client.post("/generate", data={"user_id": "u1"}, files=files)
+        assert r.status_code == 200, r.text
+        ids.append(r.json()["job_id"])
+    shared = Path(config_mod.get_settings().SHARED_DIR)
+    mans = [json.loads((shared / j / "manifest.json").read_text()) for j in ids]
+    v1, v2 = (m["files"]["videos"][0] for m in mans)
+    assert not v1["deduplicated"] and v2["deduplicated"]
+    st1, st2 = os.stat(v1["saved"]), os.stat(v2["saved"])
+    assert st1.st_ino == st2.st_ino and st1.st_nlink == 3  # 2 joby + blob
+
+def test_identical_request_joins_inflight_render(tmp_path, monkeypatch):
+    entries, sent = {}, []
+    def claim(fp, task_id, job_id, alive=None):  # render:fp:* w pamięci zamiast Redis
+        if fp in entries: return entries[fp]
+        entries[fp] = {"state": "running", "task_id": task_id, "job_id": job_id}
+    s = config_mod.get_settings().model_copy(update={"RENDER_CACHE": True})
+    monkeypatch.setattr(config_mod, "get_settings", lambda: s)
+    monkeypatch.setattr(tasks_mod.render_cache, "claim", claim)
+    monkeypatch.setattr(tasks_mod, "enqueue_render_job", lambda job_id, **kw: sent.append(kw) or kw["task_id"])
+
+    def post(mode="final"):
+        files = [("audio", ("a.mp3", _fake_mp3(), "audio/mpeg")), ("videos", ("v.mp4", _fake_mp4(), "video/mp4"))]
+        r = client.post("/generate", data={"user_id": "u1", "mode": mode}, files=files)
+        assert r.status_code == 200, r.text
+        return r.json()
+    first, second, preview = post(), post(), post("preview")
+    assert first["cache"] == "miss" and second["cache"] == "inflight" and preview["cache"] == "miss"
+    assert second["task_id"] == first["task_id"] and second["job_id"] == first["job_id"]
+    assert len(sent) == 2 and sent[0]["fingerprint"] != sent[1]["fingerprint"]
+    shared = Path(config_mod.get_settings().SHARED_DIR)
+    assert sorted(p.name for p in shared.iterdir() if not p.name.startswith(".")) == sorted([first["job_id"], preview["job_id"]])
+
+def test_render_existing_job_through_plan_task(tmp_path, monkeypatch):
+    sent = []
+    class FakeCelery:
+        def send_task(self, name, **kw):
+            sent.append((name, kw)); return type("R", (), {"id": f"t{len(sent)}"})()
+    monkeypatch.setattr(tasks_mod, "get_celery", lambda: FakeCelery())
+    files = [("audio", ("a.mp3", _fake_mp3(), "audio/mpeg")), ("videos", ("v.mp4", _fake_mp4(), "video/mp4"))]
+    job_id = client.post("/generate", data={"mode": "preview", "params": json.dumps({"target_duration_s": 7})},
+                         files=files).json()["job_id"]
+    assert client.post(f"/jobs/{job_id}/render", json={"mode": "preview"}).json()["task_id"] == "t1"
+    r = client.post(f"/jobs/{job_id}/render")
+    assert r.status_code == 200 and r.json()["mode"] == "final"
+    assert [(n, kw["args"], kw["kwargs"], kw["queue"]) for n, kw in sent] == [
+        ("render_job", [job_id, 7.0], {"mode": "preview"}, "vrillsy.preview"),
+        ("render_job", [job_id, 7.0], {"mode": "final"}, "vrillsy")]
+    assert client.post(f"/jobs/{'0' * 32}/render").status_code == 404
+    assert client.post(f"/jobs/{job_id}/render", json={"mode": "hd"}).status_code == 400
@@ -0,0 +1,62 @@
+import pytest
+
+from worker.utils import locks
+
+class FakeLease(locks.Lease):
+    """Lease bez Redis: held()/renew() zwracają stan ustawiony w teście."""
+    alive = True
+    def renew(self): return self.alive
+    def held(self): return self.alive
+
+def test_publish_rejects_stale_fence(tmp_path):
+    dst = tmp_path / "j1.mp4"
+    new, old = FakeLease("j1", "b", 2, 30), FakeLease("j1", "a", 1, 30)
+    (tmp_path / "new.part").write_text("new"); new.publish(str(tmp_path / "new.part"), str(dst))
+    (tmp_path / "old.part").write_text("old")
+    with pytest.raises(locks.LeaseLost):
+        old.publish(str(tmp_path / "old.part"), str(dst))  # wygasły posiadacz kończy po przejęciu
+    assert dst.read_text() == "new" and not (tmp_path / "old.part").exists()
+    assert (tmp_path / ".fence" / "j1.mp4").read_text() == "2"
+
+def test_heartbeat_marks_lease_lost():
+    lease = FakeLease("j1", "a", 1, 0.06).start()
+    lease.check()
+    lease.alive = False
+    assert lease.lost.wait(2)
+    with pytest.raises(locks.LeaseLost):
+        lease.check()
+    lease.stop()
+
+def test_enter_reclaims_expired_lease_nobody_took(monkeypatch):
+    lease = FakeLease("j1", "a", 1, 30); lease.alive = False
+    monkeypatch.setattr(FakeLease, "reclaim", lambda self: True)  # TTL minął w kolejce, fence bez zmian
+    with lease: lease.check()
+    monkeypatch.setattr(FakeLease, "reclaim", lambda self: False)
+    with pytest.raises(locks.LeaseLost):
+        with lease: pass
+
+@pytest.mark.parametrize("superseded", [False, True])
+def test_dag_failed_cleans_up_unless_job_was_taken_over(tmp_path, monkeypatch, superseded):
+    from worker.tasks import render_job as rj
+    monkeypatch.setattr(rj, "SHARED_DIR", str(tmp_path))
+    monkeypatch.setattr(locks.Lease, "superseded", lambda self: superseded)
+    monkeypatch.setattr(locks.Lease, "release", lambda self: None)
+    events = []
+    monkeypatch.setattr(rj, "_progress", lambda job_id, stage, *a: events.append(stage))
+    wd = tmp_path / "j1" / ".work" / "final"; wd.mkdir(parents=True)
+    lease = {"job_id": "j1:final", "token": "a", "fence": 1, "ttl_s": 600}
+    rj.dag_failed.run(None, locks.LeaseLost("lease j1:final taken over"), None, job_id="j1", mode="final", lease=lease)
+    assert (events, wd.exists()) == (([], True) if superseded else (["error"], False))
+
+def test_preview_and_final_leases_of_one_job_are_tracked_separately(monkeypatch):
+    from worker.tasks import render_job as rj
+    released = []
+    monkeypatch.setattr(rj, "acquire_lease", lambda name, task_id: FakeLease(name, task_id, 1, 30))
+    monkeypatch.setattr(FakeLease, "start", lambda self: self)
+    monkeypatch.setattr(FakeLease, "release", lambda self: released.append(self.job_id))
+    task = type("T", (), {"request": type("R", (), {"id": "t1"})})
+    final, preview = rj._lease("j1", "final", task), rj._lease("j1", "preview", task)
+    rj._unlease("j1", "preview")  # podgląd skończył – final dalej trzyma swój lease
+    assert released == ["j1:preview"] and rj._leases[("j1", "final")] is final
+    rj._unlease("j1", "final")
+    assert released == ["j1:preview", "j1:final"] and not rj._leases
@@ -0,0 +1,33 @@
+from worker.utils import metrics
+
+class FakePipe:
+    def __init__(self, store, fail): self.store, self.fail, self.ops = store, fail, []
+    def hincrby(self, k, f, v): self.ops.append((k, f, v))
+    hincrbyfloat = hincrby
+    def execute(self):
+        if self.fail: raise ConnectionError("redis down")
+        for k, f, v in self.ops: self.store[(k, f)] = self.store.get((k, f), 0) + v
+
+def test_buffered_latency_survives_redis_outage(monkeypatch):
+    store, down = {}, [True]
+    monkeypatch.setattr(metrics._r, "pipeline", lambda **kw: FakePipe(store, down[0]))
+    monkeypatch.setattr(metrics, "_buf", {})
+    for v in (0.003, 0.2):
+        metrics.observe_buffered("vrs_http_request_duration_seconds", v, (0.01, 1), route="/health")
+    assert metrics.flush() == 0 and store == {}  # Redis niedostępny: przyrosty zostają w buforze
+    down[0] = False
+    metrics.flush()
+    key = metrics.PREFIX + "vrs_http_request_duration_seconds"
+    assert store[(key, 'route="/health"|0.01')] == 1 and store[(key, 'route="/health"|+Inf')] == 2
+    assert abs(store[(key, 'route="/health"|sum')] - 0.203) < 1e-9 and metrics.flush() == 0
+
+def test_render_without_redis_emits_local_series(monkeypatch):
+    class DownPipe:
+        def hgetall(self, k): pass
+        def execute(self): raise metrics.redis.ConnectionError("redis down")
+    monkeypatch.setattr(metrics._r, "pipeline", lambda **kw: DownPipe())
+    monkeypatch.setattr(metrics, "_buf", {})
+    metrics.observe_buffered("vrs_http_request_duration_seconds", 0.2, (0.01, 1), route="/health")
+    text = metrics.render()
+    assert 'vrs_http_request_duration_seconds_count{route="/health"} 1' in text
+    assert text.rstrip().endswith("vrs_metrics_store_up 0")
@@ -0,0 +1,25 @@
+import os
+
+from worker.utils import normcache
+
+def test_get_or_build_publishes_once_and_evicts_lru(tmp_path, monkeypatch):
+    cache = tmp_path / "cache"
+    monkeypatch.setattr(normcache, "NORM_CACHE_DIR", str(cache))
+    monkeypatch.setattr(normcache, "_stats", normcache.CacheStats("test:normcache"))
+    built = []
+    def build(key):
+        def write(tmp):
+            built.append(key); open(tmp, "wb").write(b"x" * 1000)
+        return write
+    keys = ["aa" + "1" * 62, "aa" + "2" * 62]
+    assert normcache.get_or_build(keys[0], str(tmp_path / "a.mp4"), build(0)) is False
+    assert normcache.get_or_build(keys[0], str(tmp_path / "b.mp4"), build(0)) is True  # trafienie: bez budowy
+    assert built == [0] and (tmp_path / "b.mp4").read_bytes() == b"x" * 1000
+    assert sorted(os.listdir(cache / "aa")) == [".lock", f"{keys[0]}.mp4"]  # bez tmp i locka per wpis
+
+    normcache.get_or_build(keys[1], str(tmp_path / "c.mp4"), build(1))
+    os.utime(cache / "aa" / f"{keys[0]}.mp4", (1, 1))  # najdawniej użyty
+    assert normcache.evict(1500) == 1
+    assert sorted(os.listdir(cache / "aa")) == [".lock", f"{keys[1]}.mp4"]
+    assert (tmp_path / "a.mp4").exists()  # hardlink joba przeżywa eviction wpisu
+    assert normcache.stats()["hits"] == 1 and normcache.stats()["evicted"] == 1
@@ -0,0 +1,17 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+
+def test_worker_celery_app_imports_like_the_container():
+    # worker/Dockerfile: cwd=/opt/vrillsy, PYTHONPATH=/opt/vrillsy:/opt/vrillsy/worker; celery -A wstawia cwd na sys.path[0]
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([str(ROOT), str(ROOT / "worker")]),
+               REDIS_URL="redis://127.0.0.1:1/0")
+    code = ("import os, sys; sys.path.insert(0, os.getcwd()); import app.celery_app, worker.config; "
+            "app_mod = sys.modules['app.celery_app']; app_mod.celery_app.loader.import_default_modules(); assert {'vrillsy.render_job', 'render_job', 'render_batch'} <= set(app_mod.celery_app.tasks); "
+            "print(worker.config.__file__)")
+    p = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, capture_output=True, text=True)
+    assert p.returncode == 0, p.stderr[-2000:]
+    assert p.stdout.strip().endswith(os.path.join("worker", "config.py"))
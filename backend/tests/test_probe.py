@@ -0,0 +1,38 @@
+import json, os
+import pytest
+
+from worker.utils import cpubudget, metrics, probe
+
+@pytest.fixture
+def ffprobe(tmp_path, monkeypatch):
+    """Udawany ffprobe w PATH: zapisuje wywołania, zwraca stały JSON."""
+    calls = tmp_path / "calls"
+    out = {"streams": [{"codec_type": "video", "width": 640, "height": 360}], "format": {"duration": "2.5"}}
+    exe = tmp_path / "bin" / "ffprobe"; exe.parent.mkdir()
+    exe.write_text(f"#!/bin/sh\necho \"$@\" >> {calls}\necho '{json.dumps(out)}'\n"); exe.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{exe.parent}:/usr/bin:/bin")
+    monkeypatch.setattr(cpubudget, "CPU_BUDGET_FILE", str(tmp_path / "budget.json"))
+    monkeypatch.setattr(cpubudget, "_report", lambda st: None)
+    monkeypatch.setattr(cpubudget.metrics, "observe", lambda *a, **k: None)
+    monkeypatch.setattr(cpubudget.metrics, "inc", lambda *a, **k: None)
+    monkeypatch.setattr(probe, "_cache", probe.OrderedDict())
+    return lambda: calls.read_text().splitlines() if calls.exists() else []
+
+def test_ffprobe_runs_under_cpu_budget_and_job_counters(ffprobe, tmp_path):
+    clip = tmp_path / "a.mp4"; clip.write_bytes(b"x")
+    with metrics.job_counters() as c:
+        res = probe.probe_many([str(clip), str(clip)])
+    assert res[str(clip)]["format"]["duration"] == "2.5"
+    assert c.ffmpeg == 1 and len(ffprobe()) == 1  # vrs_ffmpeg_processes_total liczy też ffprobe
+
+def test_probe_is_memoized_on_path_size_and_mtime(ffprobe, tmp_path):
+    clip = tmp_path / "a.mp4"; clip.write_bytes(b"x")
+    assert probe.peek(str(clip)) is None  # peek nigdy nie uruchamia ffprobe
+    assert probe.duration(str(clip)) == 2.5 and probe.stream(str(clip))["width"] == 640
+    assert len(ffprobe()) == 1 and probe.peek(str(clip)) is not None
+    clip.write_bytes(b"xy")  # nadpisany plik: inny rozmiar
+    probe.probe(str(clip)); probe.probe(str(clip))
+    st = clip.stat(); os.utime(clip, ns=(st.st_atime_ns, st.st_mtime_ns + 1))  # ten sam rozmiar, nowszy mtime
+    assert probe.peek(str(clip)) is None
+    probe.probe(str(clip))
+    assert len(ffprobe()) == 3
@@ -0,0 +1,81 @@
+import pytest
+
+from worker.tasks import render_job as rj
+
+@pytest.mark.parametrize("cores,workers_env,n_clips,expected", [
+    (16, 0, 10, (4, 4)),   # auto: rdzenie / NORMALIZE_MIN_THREADS
+    (16, 0, 2, (2, 8)),    # mniej klipów niż slotów – wolne rdzenie idą w -threads
+    (2, 0, 10, (1, 2)),    # mało rdzeni: jeden proces, nie zero
+    (8, 20, 10, (8, 1)),   # jawne NORMALIZE_WORKERS przycięte do rdzeni
+])
+def test_normalize_pool_shape(monkeypatch, cores, workers_env, n_clips, expected):
+    monkeypatch.setattr(rj, "_cpu_count", lambda: cores)
+    monkeypatch.setattr(rj, "NORMALIZE_WORKERS", workers_env)
+    monkeypatch.setattr(rj, "NORMALIZE_MIN_THREADS", 4)
+    assert rj.normalize_pool_shape(n_clips) == expected
+
+def test_graph_command_trims_reversed_shot_to_wanted_length():
+    shots = [{"src": "/c/a.mp4", "s0": 1.0, "s1": 1.5, "want": 0.5, "rev": False},
+             {"src": "/c/b.mp4", "s0": 0.0, "s1": 0.4, "want": 0.7, "rev": True}]  # za krótki: ping-pong
+    cmd = rj.build_graph_command(shots, "/t/audio.wav", "/o/out.mp4", 1.2)
+    assert cmd.count(" -i ") == 3 and '-ss 0.000000 -t 0.400000 -i "/c/b.mp4"' in cmd
+    assert "[0:v]setpts=PTS-STARTPTS[v0]" in cmd
+    assert ("[1:v]setpts=PTS-STARTPTS,split[f1][b1];[b1]reverse[r1];"
+            "[f1][r1]concat=n=2:v=1:a=0,trim=duration=0.700000,setpts=PTS-STARTPTS[v1]") in cmd
+    assert "[v0][v1]concat=n=2:v=1:a=0" in cmd and "[2:a]atrim=0:1.200000" in cmd
+
+def test_assembly_mode_falls_back_to_segments(monkeypatch):
+    monkeypatch.setattr(rj, "ASSEMBLY_MODE", "graph"); monkeypatch.setattr(rj, "GRAPH_MAX_INPUTS", 4)
+    assert [rj.assembly_mode(n) for n in (4, 5)] == ["graph", "segments"]
+    monkeypatch.setattr(rj, "ASSEMBLY_MODE", "segments")
+    assert rj.assembly_mode(1) == "segments"
+
+@pytest.mark.parametrize("mode,args,snapped", [
+    ("off", "", 1.6),                                                    # tylko do ramki
+    ("intra", "-g 1 -keyint_min 1 -sc_threshold 0 -bf 0", 1.6),
+    ("gop", "-g 15 -keyint_min 15 -sc_threshold 0 -bf 0 -flags +cgop", 1.5),  # w dół do granicy GOP
+])
+def test_mezzanine_args_and_snap(monkeypatch, mode, args, snapped):
+    monkeypatch.setattr(rj, "MEZZANINE_MODE", mode); monkeypatch.setattr(rj, "MEZZANINE_GOP", 15)
+    assert rj.mezzanine_args() == args
+    assert rj.mezzanine_snap(1.59) == pytest.approx(snapped)  # 1.59 s ≈ 48 ramek przy 30 fps
+    assert rj.mezzanine() is (mode != "off")
+
+LOUDNORM_STDERR = """[Parsed_loudnorm_2 @ 0x55] 
+{
+	"input_i" : "-20.31",
+	"input_tp" : "-3.10",
+	"input_lra" : "5.20",
+	"input_thresh" : "-30.52",
+	"output_i" : "-14.02",
+	"target_offset" : "0.02"
+}
+"""
+
+def test_parse_loudnorm_keeps_measured_values():
+    assert rj.parse_loudnorm(LOUDNORM_STDERR) == {"input_i": "-20.31", "input_tp": "-3.10", "input_lra": "5.20",
+                                                   "input_thresh": "-30.52", "target_offset": "0.02"}
+    assert rj.parse_loudnorm("no json here") is None and rj.parse_loudnorm("{broken") is None
+
+def test_prepare_audio_is_always_linear_with_a_measurement(monkeypatch, tmp_path):
+    cmds = []
+    monkeypatch.setattr(rj, "run", lambda cmd, capture_stderr=False: cmds.append(cmd) or LOUDNORM_STDERR)
+    out, measured = rj.prepare_audio("in.wav", str(tmp_path), 10.0)  # bez cache: pomiar -f null, potem render
+    assert len(cmds) == 2 and "-f null" in cmds[0] and measured["input_i"] == "-20.31"
+    assert "loudnorm=I=-14:TP=-1.5:LRA=11:linear=true:measured_I=-20.31" in cmds[1]
+    cmds.clear()
+    assert rj.prepare_audio("in.wav", str(tmp_path), 10.0, measured=measured)[1] == measured
+    assert len(cmds) == 1 and cmds[0].count("measured_I=-20.31") == 1  # pomiar z cache/planu: jeden przebieg
+
+def test_saved_plan_is_reused_only_when_it_still_matches(tmp_path, monkeypatch):
+    monkeypatch.setattr(rj, "MEZZANINE_MODE", "off")
+    path = str(tmp_path / "j1.plan.json")
+    plan = {"target": 12.0, "clips": 3, "worker_version": rj.WORKER_VERSION, "mezzanine": "off", "shots": []}
+    assert rj.load_plan(path, 12.0, 3) is None
+    rj.save_plan(path, plan)
+    assert rj.load_plan(path, 12.0, 3) == plan and not (tmp_path / "j1.plan.json.tmp").exists()
+    assert rj.load_plan(path, 15.0, 3) is None and rj.load_plan(path, 12.0, 4) is None  # inny target / klipy
+    monkeypatch.setattr(rj, "MEZZANINE_MODE", "gop")
+    assert rj.load_plan(path, 12.0, 3) is None  # plan cięty pod inny mezzanine
+    (tmp_path / "j1.plan.json").write_text("{")
+    assert rj.load_plan(path, 12.0, 3) is None
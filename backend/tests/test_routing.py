@@ -0,0 +1,72 @@
+import json
+import pytest
+
+from app.config import Settings
+import app.config as config_mod
+import app.utils.tasks as tasks_mod
+
+class FakeCelery:
+    def __init__(self): self.sent = []
+    def send_task(self, **kw):
+        self.sent.append(kw)
+        return type("R", (), {"id": kw["task_id"]})()
+
+@pytest.fixture
+def env(tmp_path, monkeypatch):
+    s = Settings(SHARED_DIR=str(tmp_path), ROUTE_LONG_COST_S=60, CELERY_BROKER_URL="memory://", CELERY_BACKEND_URL="rpc://")
+    monkeypatch.setattr(config_mod, "get_settings", lambda: s)
+    cel = FakeCelery()
+    monkeypatch.setattr(tasks_mod, "get_celery", lambda: cel)
+    deferred = []
+    def submit(user, payload, send):  # fairshare bez Redis: pierwszy render użytkownika idzie, kolejne czekają
+        if any(p["headers"]["vrs_user"] == user for p in cel.sent): deferred.append(payload); return "deferred"
+        send(payload); return "sent"
+    monkeypatch.setattr(tasks_mod.fairshare, "submit", submit)
+    return tmp_path, cel, deferred
+
+def _job(root, job_id, mode="final", target=None, user=None, clips=2):
+    man = {"job_id": job_id, "user_id": user, "mode": mode, "params": {"target_duration_s": target} if target else {},
+           "files": {"audio": {"saved": "/a.mp3"}, "videos": [{"saved": f"/v{i}.mp4", "size": 1 << 20} for i in range(clips)]}}
+    (root / job_id).mkdir()
+    (root / job_id / "manifest.json").write_text(json.dumps(man))
+    return job_id
+
+def test_lanes_by_cost_and_mode(env, monkeypatch):
+    root, cel, _ = env
+    # vrillsy.render_job z priorem nigdy nie przekracza progu (3 krótkie segmenty) – koszt z nauczonego modelu
+    monkeypatch.setattr(tasks_mod.estimator, "predict", lambda pipeline, f: f["target_s"])
+    for job, mode, target in (("short", "final", None), ("long", "final", 120), ("prev", "preview", 120)):
+        tasks_mod.enqueue_render_job(_job(root, job, mode, target))
+    assert [(p["args"][0], p["queue"]) for p in cel.sent] == \
+        [("short", "vrillsy"), ("long", "vrillsy.long"), ("prev", "vrillsy.preview")]
+    assert cel.sent[1]["headers"]["vrs_lane"] == "long" and "vrs_user" not in cel.sent[1]["headers"]
+
+def test_user_renders_go_through_fair_share(env):
+    root, cel, deferred = env
+    ids = [tasks_mod.enqueue_render_job(_job(root, f"j{i}", user="u1")) for i in range(3)]
+    tasks_mod.enqueue_render_job(_job(root, "other", user="u2"))
+    assert [p["args"][0] for p in cel.sent] == ["j0", "other"]
+    assert [p["task_id"] for p in deferred] == ids[1:]  # task_id znany od razu, wysyłka po zwolnieniu slotu
+
+def test_batch_and_plan_renders_use_lanes_and_fair_share(env):
+    root, cel, deferred = env
+    job = _job(root, "b1", user="u1", target=30)
+    man = json.loads((root / job / "manifest.json").read_text())
+    (root / job / "manifest.json").write_text(json.dumps(dict(man, variants=[{}] * 4)))
+    tasks_mod.enqueue_render_batch(job)              # 4 warianty x ~24 s pracy > ROUTE_LONG_COST_S
+    tasks_mod.enqueue_plan_render(job, "preview")    # slot u1 zajęty – czeka w fair share
+    assert [(p["name"], p["queue"], p["headers"]["vrs_user"]) for p in cel.sent] == [("render_batch", "vrillsy.long", "u1")]
+    assert [(p["name"], p["queue"], p["kwargs"]) for p in deferred] == [("render_job", "vrillsy.preview", {"mode": "preview"})]
+
+def test_pump_restamps_enqueued_at_and_reports_fair_share_wait(monkeypatch):
+    from worker.utils import fairshare
+    raw = json.dumps({"task_id": "t1", "queue": "vrillsy",
+                      "headers": {"enqueued_at": 100.0, "vrs_deferred_at": 100.0, "vrs_user": "u1"}})
+    monkeypatch.setattr(fairshare._r, "zrange", lambda *a: ["u1"])
+    monkeypatch.setattr(fairshare, "_POP", lambda keys, args: raw)  # slot wolny, w kolejce jeden render
+    seen, sent = [], []
+    monkeypatch.setattr(fairshare.metrics, "observe", lambda name, v, buckets, **labels: seen.append((name, v)))
+    assert fairshare.pump(sent.append) == 1
+    h = sent[0]["headers"]
+    assert h["enqueued_at"] > 100.0 and "vrs_deferred_at" not in h  # czas w brokerze od wysłania
+    assert seen == [("vrs_fairshare_wait_seconds", pytest.approx(h["enqueued_at"] - 100.0))]
@@ -0,0 +1,106 @@
+import hashlib
+import json
+from pathlib import Path
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.config import Settings
+import app.config as config_mod
+import app.utils.tasks as tasks_mod
+
+@pytest.fixture(autouse=True)
+def override_settings(tmp_path, monkeypatch):
+    test_shared = tmp_path / "shared"
+    test_shared.mkdir(parents=True, exist_ok=True)
+    s = Settings(
+        SHARED_DIR=str(test_shared),
+        MAX_VIDEOS=2,
+        MAX_TOTAL_UPLOAD_MB=1,
+        UPLOAD_CHUNK_MAX_MB=1,
+        ALLOWED_VIDEO_MIME=["video/mp4"],
+        ALLOWED_AUDIO_MIME=["audio/mpeg"],
+        CELERY_BROKER_URL="memory://",
+        CELERY_BACKEND_URL="rpc://",
+    )
+    monkeypatch.setattr(config_mod, "get_settings", lambda: s)
+    monkeypatch.setattr(tasks_mod, "enqueue_render_job", lambda job_id: "task_dummy_123")
+    yield
+
+client = TestClient(app)
+
+def _upload(kind, data, content_type, chunk=100_000, sha=True):
+    body = {"kind": kind, "filename": f"{kind} file.bin", "content_type": content_type, "size": len(data)}
+    if sha: body["sha256"] = hashlib.sha256(data).hexdigest()
+    r = client.post("/uploads", json=body)
+    assert r.status_code == 201, r.text
+    uid = r.json()["upload_id"]
+    # chunki od końca – kolejność nie ma znaczenia
+    for start in reversed(range(0, len(data), chunk)):
+        part = data[start:start + chunk]
+        r = client.put(f"/uploads/{uid}", content=part,
+                       headers={"Content-Range": f"bytes {start}-{start + len(part) - 1}/{len(data)}"})
+        assert r.status_code == 204, r.text
+    return uid
+
+def test_chunked_upload_resume_and_complete():
+    data = bytes(range(256)) * 1000
+    r = client.post("/uploads", json={"kind": "video", "filename": "v.mp4", "content_type": "video/mp4", "size": len(data)})
+    uid = r.json()["upload_id"]
+    r = client.patch(f"/uploads/{uid}", content=data[:50_000], headers={"Upload-Offset": "0"})
+    assert r.status_code == 204 and r.headers["upload-offset"] == "50000"
+    # przerwane połączenie: klient pyta o offset i kontynuuje
+    assert client.head(f"/uploads/{uid}").headers["upload-offset"] == "50000"
+    assert client.post(f"/uploads/{uid}/complete").status_code == 409
+    r = client.patch(f"/uploads/{uid}", content=data[50_000:], headers={"Upload-Offset": "50000"})
+    assert r.headers["upload-offset"] == str(len(data))
+    r = client.post(f"/uploads/{uid}/complete")
+    assert r.status_code == 200 and r.json()["sha256"] == hashlib.sha256(data).hexdigest()
+
+def test_upload_limits():
+    r = client.post("/uploads", json={"kind": "video", "filename": "x.txt", "content_type": "text/plain", "size": 10})
+    assert r.status_code == 415
+    r = client.post("/uploads", json={"kind": "video", "filename": "v.mp4", "content_type": "video/mp4", "size": 2 * 1024 * 1024})
+    assert r.status_code == 413
+    uid = client.post("/uploads", json={"kind": "video", "filename": "v.mp4", "content_type": "video/mp4", "size": 10}).json()["upload_id"]
+    r = client.put(f"/uploads/{uid}", content=b"x" * 5, headers={"Content-Range": "bytes 0-3/10"})
+    assert r.status_code == 400  # Content-Length != zakres
+    r = client.put(f"/uploads/{uid}", content=b"x" * 5, headers={"Content-Range": "bytes 8-12/10"})
+    assert r.status_code == 416
+
+def test_generate_from_uploaded_media():
+    audio = b"\x01" * 150_000
+    video = b"\x02" * 250_000
+    a_id = _upload("audio", audio, "audio/mpeg")
+    v_id = _upload("video", video, "video/mp4")
+    for uid in (a_id, v_id):
+        assert client.post(f"/uploads/{uid}/complete").status_code == 200
+    r = client.post("/generate/media", json={"audio": a_id, "videos": [v_id, v_id, v_id], "user_id": "u1"})
+    assert r.status_code == 400 and r.json()["detail"]["error"] == "too_many_files"
+    r = client.post("/generate/media", json={"audio": v_id, "videos": [v_id]})
+    assert r.status_code == 400 and r.json()["detail"]["error"] == "wrong_media_kind"
+    r = client.post("/generate/media", json={"audio": a_id, "videos": [v_id], "user_id": "u1", "mode": "preview"})
+    assert r.status_code == 200, r.text
+    shared = Path(config_mod.get_settings().SHARED_DIR)
+    man = json.loads((shared / r.json()["job_id"] / "manifest.json").read_text())
+    assert man["user_id"] == "u1" and man["mode"] == "preview"
+    saved = Path(man["files"]["videos"][0]["saved"])
+    assert saved.read_bytes() == video and man["files"]["videos"][0]["media_id"] == v_id
+
+def test_generate_batch_from_uploaded_media(monkeypatch):
+    monkeypatch.setattr(tasks_mod, "enqueue_render_batch", lambda job_id: "task_batch_1")
+    a_id = _upload("audio", b"\x03" * 1000, "audio/mpeg")
+    v_id = _upload("video", b"\x04" * 2000, "video/mp4")
+    for uid in (a_id, v_id):
+        assert client.post(f"/uploads/{uid}/complete").status_code == 200
+    r = client.post("/generate/batch", json={"audio": a_id, "videos": [v_id], "variants": [{}] * 11})
+    assert r.status_code == 400 and r.json()["detail"]["error"] == "too_many_variants"
+    r = client.post("/generate/batch", json={"audio": a_id, "videos": [v_id], "variants": [{"target_duration_s": -1}]})
+    assert r.status_code == 422
+    variants = [{"name": "short", "target_duration_s": 6, "seed": 1}, {"shuffle": False}]
+    r = client.post("/generate/batch", json={"audio": a_id, "videos": [v_id], "variants": variants})
+    assert r.status_code == 200, r.text
+    assert r.json()["task_id"] == "task_batch_1" and r.json()["variants"] == 2
+    shared = Path(config_mod.get_settings().SHARED_DIR)
+    man = json.loads((shared / r.json()["job_id"] / "manifest.json").read_text())
+    assert man["variants"] == [{"name": "short", "seed": 1, "target_duration_s": 6.0, "shuffle": True}, {"shuffle": False}]
@@ -0,0 +1,273 @@
+"""Benchmark end-to-end punktów wejścia renderu (bez brokera – zadania wołane w procesie).
+
+Każdy przypadek (entry × źródło × liczba klipów × długość) idzie w osobnym procesie potomnym:
+worker/app i backend/app to oba pakiety `app`, a osobny proces daje czysty peak RSS.
+ffmpeg/ffprobe są liczone przez wrappery w PATH, więc łapiemy też wywołania z shell=True.
+
+    python bench/render_bench.py --entries render_job,d41 --clips 2,5,20 --targets 10,30,60 --save out.json
+    python bench/render_bench.py --baseline out.json --tolerance 0.15   # exit 1 przy regresji
+
+render_job wymaga Redis (lock joba, REDIS_URL). Każdy przypadek pisze tylko do swojego katalogu roboczego:
+katalogi jobów, wyniki i cache są przestawiane (env + stałe zaimportowanych modułów), także gdy są ustawione w env.
+Przy --repeat porównanie z baseline idzie po medianie powtórzeń.
+dag = render_job_dag w trybie eager (subtaski po kolei w jednym procesie) – mierzy narzut DAG-u, nie zysk z wielu nodów.
+"""
+import argparse, json, os, shutil, subprocess, sys, tempfile, time, resource, statistics, uuid
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+SAMPLES = ROOT / "sample_source"
+ENTRIES = ("render_job", "d41", "pro", "graph", "dag")
+METRICS = ("wall_s", "cpu_s", "ffmpeg_cpu_s", "peak_rss_mb", "ffmpeg_peak_rss_mb", "ffmpeg_calls", "output_bytes")
+SYNTH_SIZES = ("1920x1080", "1280x720", "1080x1920", "720x1280", "640x360")
+
+# --- media ------------------------------------------------------------------
+
+def _ff(*args: str) -> None:
+    subprocess.run(["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", *args], check=True)
+
+def synth_media(media_dir: Path, clips: int, target_s: float) -> tuple[Path, list[Path]]:
+    """Klipy lavfi w rotacji rozdzielczości + ścieżka klików 120 BPM; generowane raz i trzymane w media_dir."""
+    media_dir.mkdir(parents=True, exist_ok=True)
+    clip_s = max(3.0, round(target_s / max(1, clips) * 2, 1))
+    audio = media_dir / f"click_{int(target_s)}s.wav"
+    if not audio.exists():
+        _ff("-f", "lavfi", "-i", f"aevalsrc='0.8*sin(2*PI*1000*t)*lt(mod(t,0.5),0.02)+0.1*sin(2*PI*110*t)':s=44100:d={target_s + 2}",
+            "-ac", "2", str(audio))
+    vids = []
+    for i in range(clips):
+        size = SYNTH_SIZES[i % len(SYNTH_SIZES)]
+        v = media_dir / f"clip_{size}_{clip_s}s_{i % len(SYNTH_SIZES)}.mp4"
+        if not v.exists():
+            _ff("-f", "lavfi", "-i", f"testsrc2=size={size}:rate=30:duration={clip_s}",
+                "-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p", str(v))
+        vids.append(v)
+    return audio, vids
+
+def sample_media(clips: int | None) -> tuple[Path, list[Path]]:
+    audio = sorted((SAMPLES / "audio").iterdir())[0]
+    vids = sorted((SAMPLES / "video").glob("*.mp4"))
+    return audio, vids[:clips] if clips else vids
+
+def ff_wrappers(bin_dir: Path, counter: Path) -> None:
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    for tool in ("ffmpeg", "ffprobe"):
+        real = shutil.which(tool)
+        if not real: continue
+        w = bin_dir / tool
+        w.write_text(f'#!/bin/sh\necho {tool} >> "{counter}"\nexec "{real}" "$@"\n')
+        w.chmod(0o755)
+
+# --- przypadki (proces potomny) ---------------------------------------------
+
+def _link_into(dst_dir: Path, files: list[Path]) -> list[Path]:
+    dst_dir.mkdir(parents=True, exist_ok=True)
+    out = []
+    for i, f in enumerate(files):
+        d = dst_dir / f"{i:03d}_{f.name}"
+        if not d.exists(): os.symlink(f, d)
+        out.append(d)
+    return out
+
+def _dirs(ws: Path) -> dict[str, str]:
+    shared = ws / "shared"
+    return {"SHARED_DIR": str(shared), "OUTPUTS_DIR": str(ws / "outputs"), "NORM_CACHE_DIR": str(shared / ".normcache"),
+            "ANALYSIS_CACHE_DIR": str(shared / ".analysiscache"), "MEDIA_STORE_DIR": str(shared / ".media")}
+
+def _isolate(ws: Path) -> None:
+    """Katalogi robocze przypadku w env (przed importem worker.config) i w stałych już zaimportowanych modułów
+    worker.* (from worker.config import ... kopiuje wartość) – niezależnie od SHARED_DIR/OUTPUTS_DIR hosta."""
+    dirs = _dirs(ws)
+    os.environ.update(dirs)
+    for name, mod in list(sys.modules.items()):
+        if name == "worker" or name.startswith("worker."):
+            for k, v in dirs.items():
+                if hasattr(mod, k): setattr(mod, k, v)
+
+def _job_layout(case: dict, ws: Path) -> str:
+    sys.path.insert(0, str(ROOT))
+    _isolate(ws)
+    job = case["job_id"]; jd = ws / "shared" / job
+    _link_into(jd / "audio", [Path(case["audio"])]); _link_into(jd / "video", [Path(v) for v in case["videos"]])
+    return job
+
+def _run_render_job(case: dict, ws: Path) -> dict:
+    job = _job_layout(case, ws)
+    from worker.tasks.render_job import render_job
+    _isolate(ws)
+    res = render_job.run(job, case["target_s"], mode=case.get("mode", "final"))
+    if res.get("status") != "ok": raise RuntimeError(f"render_job: {res}")
+    qa = json.loads(Path(res["qa"]).read_text())
+    return {"out": res["out"], "stages": {k: v["wall_s"] for k, v in qa.get("stages", {}).items()}}
+
+def _run_d41(case: dict, ws: Path) -> dict:
+    sys.path.insert(0, str(ROOT)); sys.path.append(str(ROOT / "worker"))  # worker/worker.py nie może przesłonić pakietu worker
+    _isolate(ws)
+    from app.tasks_d41 import render_job
+    _isolate(ws)
+    out = str(ws / "outputs" / f"{case['job_id']}.mp4"); os.makedirs(os.path.dirname(out), exist_ok=True)
+    res = render_job.run(case["job_id"], case["audio"], case["videos"], out, target_duration_s=case["target_s"])
+    if not res.get("ok"): raise RuntimeError(f"d41: {res.get('code')} {res.get('msg')}")
+    return {"out": out, "stages": {}}
+
+def _run_pro(case: dict, ws: Path) -> dict:
+    sys.path.insert(0, str(ROOT)); sys.path.insert(0, str(ROOT / "backend"))
+    _isolate(ws)
+    from app.tasks import pro_render
+    from app.tasks.pro_render import render_job_pro
+    _isolate(ws)
+    pro_render.PRO_SHARED_DIR, pro_render.OUTPUT_DIR = str(ws / "shared"), str(ws / "outputs")
+    root = ws / "shared" / case["job_id"]
+    _link_into(root / "audio", [Path(case["audio"])]); _link_into(root / "video", [Path(v) for v in case["videos"]])
+    res = render_job_pro.run(case["job_id"], 0.25, 0.30, target_duration_s=case["target_s"])
+    return {"out": res["output"], "stages": {}}
+
+def _run_graph(case: dict, ws: Path) -> dict:
+    os.environ["VRS_SHARED_DIR"] = str(ws / "shared")
+    sys.path.insert(0, str(ROOT / "backend"))  # backend/worker przesłania worker/ z korzenia
+    from worker.tasks.render_job import render_job
+    jd = ws / "shared" / case["job_id"]; jd.mkdir(parents=True, exist_ok=True)
+    man = {"job_id": case["job_id"], "files": {"audio": {"saved": case["audio"]},
+                                               "videos": [{"saved": v} for v in case["videos"]]}}
+    (jd / "manifest.json").write_text(json.dumps(man))
+    res = render_job.run(case["job_id"])
+    return {"out": res["output"], "stages": {}}
+
+def _run_dag(case: dict, ws: Path) -> dict:
+    from celery import current_app
+    current_app.conf.update(task_always_eager=True, task_eager_propagates=True, result_backend="cache+memory://")
+    job = _job_layout(case, ws)
+    from worker.tasks.render_job import render_job_dag
+    _isolate(ws)
+    res = render_job_dag.apply(args=(job, case["target_s"]), kwargs={"mode": case.get("mode", "final")}).get()
+    if res.get("status") != "ok": raise RuntimeError(f"render_job_dag: {res}")
+    qa = json.loads(Path(res["qa"]).read_text())
+    return {"out": res["out"], "stages": {"clips_s": max(c["s"] for c in qa["dag"]["clips"]), "audio_s": qa["dag"]["audio"]["s"]}}
+
+RUNNERS = {"render_job": _run_render_job, "d41": _run_d41, "pro": _run_pro, "graph": _run_graph, "dag": _run_dag}
+
+def run_case_child(case: dict) -> dict:
+    ws = Path(case["workspace"])
+    t0 = time.perf_counter(); s0 = resource.getrusage(resource.RUSAGE_SELF); c0 = resource.getrusage(resource.RUSAGE_CHILDREN)
+    r = {"ok": True}
+    try: r.update(RUNNERS[case["entry"]](case, ws))
+    except Exception as e: r = {"ok": False, "error": f"{type(e).__name__}: {e}"[:500]}
+    s1 = resource.getrusage(resource.RUSAGE_SELF); c1 = resource.getrusage(resource.RUSAGE_CHILDREN)
+    r.update({
+        "wall_s": round(time.perf_counter() - t0, 3),
+        "cpu_s": round((s1.ru_utime + s1.ru_stime) - (s0.ru_utime + s0.ru_stime), 3),
+        "ffmpeg_cpu_s": round((c1.ru_utime + c1.ru_stime) - (c0.ru_utime + c0.ru_stime), 3),
+        "peak_rss_mb": round(s1.ru_maxrss / 1024, 1),        # Linux: KiB
+        "ffmpeg_peak_rss_mb": round(c1.ru_maxrss / 1024, 1),  # największy pojedynczy potomek
+    })
+    if r.get("out") and os.path.exists(r["out"]): r["output_bytes"] = os.path.getsize(r["out"])
+    return r
+
+# --- orkiestracja -----------------------------------------------------------
+
+def case_key(c: dict) -> str:
+    return f'{c["entry"]}|{c["source"]}|{c["clips"]}|{c["target_s"]:g}'
+
+def run_case(case: dict, keep: bool) -> dict:
+    ws = Path(tempfile.mkdtemp(prefix=f"bench_{case['entry']}_"))
+    counter = ws / "ffcalls.txt"; counter.touch()
+    ff_wrappers(ws / "bin", counter)
+    env = dict(os.environ, PATH=f"{ws / 'bin'}{os.pathsep}{os.environ.get('PATH', '')}")
+    case = dict(case, workspace=str(ws), job_id=f"bench{uuid.uuid4().hex[:12]}")
+    p = subprocess.run([sys.executable, __file__, "--_case", json.dumps(case)], env=env, cwd=str(ws),
+                       stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    try: r = json.loads(p.stdout.strip().splitlines()[-1])
+    except (IndexError, ValueError): r = {"ok": False, "error": (p.stderr or "no output")[-500:]}
+    r["ffmpeg_calls"] = sum(1 for _ in counter.open())
+    r.pop("out", None)
+    if not keep: shutil.rmtree(ws, ignore_errors=True)
+    return {"key": case_key(case), **{k: case[k] for k in ("entry", "source", "clips", "target_s")}, **r}
+
+def build_cases(a) -> list[dict]:
+    cases = []
+    media = Path(a.media_dir)
+    for entry in a.entries:
+        if a.samples:
+            audio, vids = sample_media(None)
+            cases.append({"entry": entry, "source": "samples", "clips": len(vids), "target_s": 10.0,
+                          "audio": str(audio), "videos": [str(v) for v in vids]})
+        for n in a.clips:
+            for t in a.targets:
+                audio, vids = synth_media(media, n, t)
+                cases.append({"entry": entry, "source": "synthetic", "clips": n, "target_s": float(t),
+                              "audio": str(audio), "videos": [str(v) for v in vids]})
+    return cases
+
+def medians(results: list[dict]) -> list[dict]:
+    """Jeden wiersz na przypadek: mediana metryk z udanych powtórzeń (ok=False tylko, gdy żadne się nie udało)."""
+    by_key: dict[str, list[dict]] = {}
+    for r in results: by_key.setdefault(r["key"], []).append(r)
+    rows = []
+    for key, rs in by_key.items():
+        good = [r for r in rs if r.get("ok")]
+        if not good: rows.append(rs[-1]); continue
+        row = {"key": key, "ok": True, "repeats": len(good)}
+        for m in METRICS:
+            vals = [r[m] for r in good if m in r]
+            if vals: row[m] = round(statistics.median(vals), 3)
+        rows.append(row)
+    return rows
+
+def compare(results: list[dict], baseline: dict, tolerance: float) -> list[dict]:
+    base = {r["key"]: r for r in medians(baseline.get("results", []))}
+    rows = []
+    for r in medians(results):
+        b = base.get(r["key"])
+        if not b or not (r.get("ok") and b.get("ok")): continue
+        row = {"key": r["key"], "regressions": []}
+        for m in METRICS:
+            if m not in r or not b.get(m): continue
+            ratio = r[m] / b[m]
+            row[m] = {"base": b[m], "now": r[m], "ratio": round(ratio, 3)}
+            if m in ("wall_s", "cpu_s", "peak_rss_mb", "ffmpeg_calls") and ratio > 1 + tolerance:
+                row["regressions"].append(m)
+        rows.append(row)
+    return rows
+
+def _csv(conv):
+    return lambda s: [conv(x) for x in s.split(",") if x]
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--entries", type=_csv(str), default=list(ENTRIES))
+    ap.add_argument("--clips", type=_csv(int), default=[2, 5, 20])
+    ap.add_argument("--targets", type=_csv(float), default=[10.0, 30.0, 60.0])
+    ap.add_argument("--no-samples", dest="samples", action="store_false", help="pomiń sample_source/")
+    ap.add_argument("--repeat", type=int, default=1, help="powtórzenia każdego przypadku (rozrzut pomiaru)")
+    ap.add_argument("--media-dir", default=os.path.join(tempfile.gettempdir(), "vrs-bench-media"))
+    ap.add_argument("--save", help="zapisz wyniki JSON (np. jako baseline)")
+    ap.add_argument("--baseline", help="porównaj z zapisanym JSON")
+    ap.add_argument("--tolerance", type=float, default=0.10)
+    ap.add_argument("--keep", action="store_true", help="nie usuwaj katalogów roboczych")
+    ap.add_argument("--_case", help=argparse.SUPPRESS)
+    a = ap.parse_args(argv)
+
+    if a._case:
+        print(json.dumps(run_case_child(json.loads(a._case)))); return 0
+    bad = [e for e in a.entries if e not in ENTRIES]
+    if bad: ap.error(f"nieznane entry: {bad} (dostępne: {', '.join(ENTRIES)})")
+
+    results = []
+    for case in build_cases(a):
+        for rep in range(a.repeat):
+            r = dict(run_case(case, a.keep), repeat=rep)
+            results.append(r)
+            status = f'{r["wall_s"]:.2f}s ff={r["ffmpeg_calls"]}' if r.get("ok") else f'FAIL {r.get("error", "")[:120]}'
+            print(f'{r["key"]:<40} {status}', file=sys.stderr, flush=True)
+
+    report = {"created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()), "cpus": os.cpu_count(), "results": results}
+    rc = 0
+    if a.baseline:
+        report["compare"] = compare(results, json.loads(Path(a.baseline).read_text()), a.tolerance)
+        if any(row["regressions"] for row in report["compare"]): rc = 1
+    if a.save: Path(a.save).write_text(json.dumps(report, indent=2))
+    print(json.dumps(report, indent=2))
+    return rc
+
+if __name__ == "__main__":
+    sys.exit(main())
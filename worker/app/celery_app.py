@@ -1,6 +1,6 @@
 import os
 from celery import Celery
-from kombu import Queue
+from worker.utils import lanes
 
 BROKER = os.getenv("CELERY_BROKER_URL", "redis://redis:6379/0")
 BACKEND = os.getenv("CELERY_RESULT_BACKEND", BROKER)
@@ -9,13 +9,13 @@ celery_app = Celery(
     "vrillsy",
     broker=BROKER,
     backend=BACKEND,
-    include=["app.vrillsy"],  # załaduj nasz task
+    # vrillsy.render_job + render_job/render_batch/render_job_dag – API wysyła wszystkie do tych samych lane'ów
+    include=["app.vrillsy", "worker.tasks.render_job"],
 )
 
+# lane'y, acks_late, prefetch i sygnały (czas w kolejce, estymator, fair share) – wspólne z backend/app/celeryapp
+lanes.configure(celery_app)
 celery_app.conf.update(
-    task_queues=[Queue("vrillsy")],
-    task_default_queue="vrillsy",
-    task_routes={"vrillsy.render_job": {"queue": "vrillsy"}},
     timezone="UTC",
     task_ignore_result=False,
     result_expires=3600,
@@ -2,9 +2,10 @@ from __future__ import annotations
 import os, tempfile, subprocess, shlex
 from typing import List, Dict
 from app.celery_app import celery_app
+from worker.utils import cpubudget
 
 def _run(cmd: list[str]) -> None:
-    p = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    p = cpubudget.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
     if p.returncode != 0:
         raise RuntimeError(f"ffmpeg failed ({p.returncode}):\n{p.stdout}")
 
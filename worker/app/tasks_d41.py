@@ -2,17 +2,18 @@ import os, json, time, subprocess
 from datetime import datetime, timezone
 from celery.utils.log import get_task_logger
 from app.celery_app import celery_app as _celery
+from worker.utils import cpubudget, probe, analysis_cache, progress, render_cache
+from worker.utils.beatgrid import BeatGrid
+from worker.utils.analysis import analyze
+from worker.config import ANALYSIS_BACKEND, RENDER_MODES, OUTPUTS_DIR
 
 log = get_task_logger(__name__)
 
 def _run(cmd):
-    return subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    return cpubudget.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
 
 def _ffprobe_dur(path):
-    p = _run(["ffprobe","-v","error","-show_entries","format=duration","-of","default=nw=1:nk=1", path])
-    if p.returncode!=0 or not p.stdout.strip(): return None
-    try: return float(p.stdout.strip())
-    except: return None
+    return probe.duration(path)
 
 def _beats_from_astats(audio_path, target_s, attention_end_s, min_gap=0.2):
     p = _run(["ffmpeg","-hide_banner","-nostats","-i",audio_path,
@@ -32,7 +33,10 @@ def _beats_from_astats(audio_path, target_s, attention_end_s, min_gap=0.2):
         return []
     thr = sorted(levels)[int(0.8*len(levels))]
     cand = [times[i] for i,v in enumerate(levels) if v >= thr]
-    cand.sort()
+    return _prune_beats(cand, target_s, attention_end_s, min_gap)
+
+def _prune_beats(cand, target_s, attention_end_s, min_gap=0.2):
+    cand = sorted(cand)
     beats, last = [], -1e9
     for t in cand:
         if t <= attention_end_s or t >= target_s: continue
@@ -79,18 +83,26 @@ def plan_timeline_d41(target_s, attention_min=0.25, attention_max=0.30,
 
 def _sync_ratio(cuts, beats, win=0.05):
     if not beats or not cuts: return None
-    ok = 0
-    for t in cuts:
-        nb = min(beats, key=lambda b: abs(b - t))
-        if abs(nb - t) <= win: ok += 1
-    return ok/len(cuts)
+    return BeatGrid(beats).sync_ratio(cuts, win)
 
 @_celery.task(name="vrillsy.render_job")
 def render_job(job_id, audio, videos, out,
                target_duration_s=10.0,
                attention_min_s=0.25, attention_max_s=0.30,
-               shuffle=False):
+               shuffle=False, mode="final", fingerprint=None):
+    progress.publish(job_id, "ingest", 3, {"version": "d41", "mode": mode})
+    res = _render(job_id, audio, videos, out, target_duration_s, attention_min_s, attention_max_s, mode)
+    render_cache.finish(fingerprint, render_job.request.id, out, ok=bool(res.get("ok")))
+    # zdarzenie końcowe zamyka strumienie SSE/WebSocket klientów
+    if res.get("ok"): progress.publish(job_id, "done", 100, {"out": out})
+    else: progress.publish(job_id, "error", None, {"code": res.get("code"), "error": res.get("msg")})
+    return res
+
+def _render(job_id, audio, videos, out, target_duration_s, attention_min_s, attention_max_s, mode):
     T0 = time.time()
+    if mode not in RENDER_MODES:
+        return {"ok": False, "job_id": job_id, "code":"VR-E005","msg":f"INVALID_PAYLOAD mode={mode}"}
+    prof, enc = RENDER_MODES[mode]
 
     # walidacje
     if not isinstance(videos, (list,tuple)) or len(videos) < 2:
@@ -105,18 +117,32 @@ def render_job(job_id, audio, videos, out,
     if missing:
         return {"ok": False, "job_id": job_id, "code":"VR-E002","msg":"VIDEO_NOT_FOUND","missing_count": len(missing), "missing_sample": missing[:3]}
 
-    qa_path = out.replace(".mp4",".json") if out.startswith("/outputs/") else f"/outputs/{job_id}.json"
+    qa_path = out.replace(".mp4",".json") if out.startswith(OUTPUTS_DIR + "/") else os.path.join(OUTPUTS_DIR, f"{job_id}.json")
     try:
         # 1) TRIM audio
-        a_trim = f"/outputs/{job_id}_trim.wav"
+        a_trim = os.path.join(OUTPUTS_DIR, f"{job_id}_trim.wav")
         p = _run(["ffmpeg","-hide_banner","-y","-i",audio,"-t",f"{target_duration_s:.3f}",
                   "-ac","2","-ar","48000","-c:a","pcm_s16le", a_trim])
         if p.returncode!=0:
             return {"ok": False, "job_id": job_id, "code":"VR-E007","msg":"RENDER_FAIL audio trim","ffmpeg_tail": p.stderr.splitlines()[-30:]}
 
+        progress.publish(job_id, "normalize_audio", 10)
+
         # 2) beats
         attention_cap = min(1.5, target_duration_s)
-        beats = _beats_from_astats(a_trim, target_duration_s, attention_cap, min_gap=0.2)
+        akey = analysis_cache.cache_key(audio, pipeline="d41", backend=ANALYSIS_BACKEND,
+                                        trim_s=round(target_duration_s, 3), attention_end_s=attention_cap, min_gap=0.2)
+        cached = analysis_cache.load(akey)
+        if cached:
+            beats = cached["beats"]
+        elif ANALYSIS_BACKEND == "native":
+            beats = _prune_beats(analyze(a_trim, max_duration_s=target_duration_s).onsets,
+                                 target_duration_s, attention_cap, min_gap=0.2)
+        else:
+            beats = _beats_from_astats(a_trim, target_duration_s, attention_cap, min_gap=0.2)
+        if not cached: analysis_cache.store(akey, beats=beats)
+
+        progress.publish(job_id, "detect_beats", 25, {"beats": len(beats)})
 
         # 3) plan
         att, cuts, used_beats, fallback_used, attention_end = plan_timeline_d41(
@@ -136,40 +162,39 @@ def render_job(job_id, audio, videos, out,
             d = cut_pts[i+1]-cut_pts[i]
             if d > 1e-3: segs.append(d)
 
-        # 5) render (1080x1920@30, SAR=1)
-        tmpd = f"/outputs/{job_id}_tmp"; os.makedirs(tmpd, exist_ok=True)
+        # 5) render (1080x1920@30 albo podgląd 360x640, SAR=1)
+        tmpd = os.path.join(OUTPUTS_DIR, f"{job_id}_tmp"); os.makedirs(tmpd, exist_ok=True)
         seg_files, vi = [], 0
-        vf = "scale=1080:1920:force_original_aspect_ratio=decrease,pad=1080:1920:(1080-iw)/2:(1920-ih)/2,fps=30,setsar=1"
+        W, H = prof.width, prof.height
+        vf = f"scale={W}:{H}:force_original_aspect_ratio=decrease,pad={W}:{H}:({W}-iw)/2:({H}-ih)/2,fps={prof.fps},setsar=1"
         for idx, dur in enumerate(segs):
             vpath = videos[vi % len(videos)]; vi += 1
             seg_out = os.path.join(tmpd, f"seg_{idx:03d}.mp4")
             p = _run(["ffmpeg","-hide_banner","-y","-ss","0","-t",f"{dur:.3f}","-i",vpath,"-an","-vf",vf,
-                      "-c:v","libx264","-preset","veryfast","-crf","18", seg_out])
+                      "-c:v","libx264","-preset",enc.preset,"-crf",str(enc.crf), seg_out])
             if p.returncode!=0:
                 return {"ok": False, "job_id": job_id, "code":"VR-E004","msg":f"VIDEO_BROKEN {vpath}","ffmpeg_tail": p.stderr.splitlines()[-30:]}
             seg_files.append(seg_out)
+            progress.publish(job_id, "segments", 30 + 55 * (idx + 1) // len(segs), {"done": idx + 1, "total": len(segs)})
 
         # 6) concat + audio + cap
         list_path = os.path.join(tmpd, "list.txt")
         with open(list_path,"w") as f:
             for pth in seg_files: f.write(f"file '{pth}'\n")
         p = _run(["ffmpeg","-hide_banner","-y","-f","concat","-safe","0","-i",list_path,"-i",a_trim,
-                  "-r","30","-pix_fmt","yuv420p","-vf","setsar=1",
-                  "-c:v","libx264","-preset","veryfast","-crf","18","-c:a","aac",
+                  "-r",str(prof.fps),"-pix_fmt","yuv420p","-vf","setsar=1",
+                  "-c:v","libx264","-preset",enc.preset,"-crf",str(enc.crf),"-c:a","aac",
                   "-shortest","-to",f"{target_duration_s:.3f}", out])
         if p.returncode!=0:
             return {"ok": False, "job_id": job_id, "code":"VR-E007","msg":"RENDER_FAIL final mux","ffmpeg_tail": p.stderr.splitlines()[-30:]}
 
+        progress.publish(job_id, "mux", 95)
         dur_out = _ffprobe_dur(out) or 0.0
 
         # 7) QA
         mae = None
         if used_beats:
-            errs = []
-            for t in cuts:
-                nb = min(beats, key=lambda b: abs(b - t))
-                errs.append(abs(nb - t))
-            mae = (sum(errs)/len(errs)) if errs else None
+            mae = BeatGrid(beats).mae(cuts)
         sync = _sync_ratio(cuts, beats)
 
         qa = {
@@ -186,8 +211,10 @@ def render_job(job_id, audio, videos, out,
           "fallback_used": bool(fallback_used),
           "mean_abs_err_s": (None if mae is None else float(f"{mae:.3f}")),
           "sync_ratio_005": (None if sync is None else float(f"{sync:.3f}")),
-          "profile": "1080x1920@30",
+          "profile": f"{prof.width}x{prof.height}@{prof.fps}",
+          "mode": mode,
           "pre_time_s": 0.0,
+          "analysis_cache": "hit" if cached else "miss",
           "worker_version": "d41",
           "timestamp_utc": datetime.now(timezone.utc).isoformat(),
           "elapsed_s": float(f"{time.time()-T0:.3f}")
@@ -1,30 +1,43 @@
 from app.celery_app import celery_app
 import os, subprocess
 from typing import List
+from worker.config import VRILLSY_MODES, VRILLSY_MAX_CLIPS, VRILLSY_SEG_S, OUTPUT_MOVFLAGS
+from worker.utils import cpubudget, metrics, progress, render_cache
 
 def run(cmd: list[str]) -> None:
-    p = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    p = cpubudget.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
     if p.returncode != 0:
         raise RuntimeError("ffmpeg failed:\n" + p.stderr)
 
 @celery_app.task(name="vrillsy.render_job", queue="vrillsy", bind=True)
-def render_job(self, job_id: str, audio_path: str, video_paths: List[str], out_dir: str = "/outputs"):
+def render_job(self, job_id: str, audio_path: str, video_paths: List[str], out_dir: str = "/outputs",
+               mode: str = "final", fingerprint: str | None = None):
+    with metrics.job_counters():  # ffmpeg, CPU i I/O procesów potomnych tylko tego joba
+        return _render(self, job_id, audio_path, video_paths, out_dir, mode, fingerprint)
+
+def _render(self, job_id: str, audio_path: str, video_paths: List[str], out_dir: str, mode: str,
+            fingerprint: str | None) -> dict:
+    clock = metrics.StageClock()
     os.makedirs(out_dir, exist_ok=True)
-    vids = [v for v in video_paths if v][:3]
+    vids = [v for v in video_paths if v][:VRILLSY_MAX_CLIPS]
     if not vids:
         raise ValueError("video_paths is empty")
-    out = os.path.join(out_dir, f"{job_id}_final.mp4")
+    if mode not in VRILLSY_MODES:
+        raise ValueError(f"unknown mode: {mode}")
+    out = os.path.join(out_dir, f"{job_id}_{mode}.mp4")
+    prof, enc = VRILLSY_MODES[mode]  # te same wartości idą do odcisku render_cache
+    W, H, fps = prof.width, prof.height, prof.fps
 
-    # ~3.33 s z każdego klipu, wyśrodkowane do 720x1080, 30 fps
-    seg = 3.33
+    # ~3.33 s z każdego klipu, wyśrodkowane do WxH (720x1080, podgląd 360x640)
+    seg = VRILLSY_SEG_S
     inputs, trims = [], []
     for i, vp in enumerate(vids):
         inputs += ["-i", vp]
         trims.append(
             f"[{i}:v]trim=0:{seg},setpts=PTS-STARTPTS,"
-            f"scale=720:1080:force_original_aspect_ratio=decrease,"
-            f"pad=720:1080:(ow-iw)/2:(oh-ih)/2,"
-            f"fps=30[v{i}]"
+            f"scale={W}:{H}:force_original_aspect_ratio=decrease,"
+            f"pad={W}:{H}:(ow-iw)/2:(oh-ih)/2,"
+            f"fps={fps}[v{i}]"
         )
 
     vlist = "".join(f"[v{i}]" for i in range(len(vids)))
@@ -37,11 +50,21 @@ def render_job(self, job_id: str, audio_path: str, video_paths: List[str], out_d
         "-filter_complex", vf,
         "-map","[vout]","-map", f"{a_idx}:a:0",
         "-shortest",
-        "-r","30","-pix_fmt","yuv420p",
-        "-c:v","libx264","-preset","veryfast","-crf","23",
+        "-r",str(fps),"-pix_fmt",prof.pix_fmt,
+        "-c:v","libx264","-preset",enc.preset,"-crf",str(enc.crf),
         "-c:a","aac","-b:a","192k",
-        "-movflags","+faststart",
+        "-movflags",OUTPUT_MOVFLAGS,
         out,
     ]
-    run(cmd)
-    return {"ok": True, "out": out}
+    clock.mark("ingest")
+    progress.publish(job_id, "render", 10, {"mode": mode, "clips": len(vids)})
+    try: run(cmd)
+    except Exception as e:
+        clock.mark("render")
+        render_cache.finish(fingerprint, self.request.id, None, ok=False)
+        progress.publish(job_id, "error", None, {"error": str(e)[-500:]})
+        raise
+    clock.mark("render")
+    render_cache.finish(fingerprint, self.request.id, out, ok=True)
+    progress.publish(job_id, "done", 100, {"out": out, "stages": clock.summary()})
+    return {"ok": True, "out": out, "stages": clock.summary()}
@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-import os
+import os, tempfile
 
 @dataclass(frozen=True)
 class VideoProfile:
@@ -9,22 +9,119 @@ class VideoProfile:
     pix_fmt: str = "yuv420p"
     sar: int = 1
 
+@dataclass(frozen=True)
+class EncodeSettings:
+    preset: str = "veryfast"
+    crf: int = 18
+
+    @property
+    def args(self) -> str: return f"-preset {self.preset} -crf {self.crf}"
+
 PROFILE = VideoProfile()
+FINAL_ENCODE = EncodeSettings()
+
+# Podgląd: ten sam plan (seed z job_id), mniejszy profil i szybszy enkoder
+PREVIEW_PROFILE = VideoProfile(width=int(os.getenv("PREVIEW_WIDTH", "360")), height=int(os.getenv("PREVIEW_HEIGHT", "640")))
+PREVIEW_ENCODE = EncodeSettings(preset=os.getenv("PREVIEW_PRESET", "ultrafast"), crf=int(os.getenv("PREVIEW_CRF", "30")))
+RENDER_MODES = {"final": (PROFILE, FINAL_ENCODE), "preview": (PREVIEW_PROFILE, PREVIEW_ENCODE)}
+# vrillsy.render_job (szybki montaż ~3 klipów, task wysyłany przez API) ma własny final: 720x1080, crf 23.
+# Odcisk cache renderu bierze profil z tej samej tabeli co task (PIPELINE_MODES po nazwie taska).
+VRILLSY_MODES = {"final": (VideoProfile(width=720, height=1080), EncodeSettings(crf=23)),
+                 "preview": (PREVIEW_PROFILE, PREVIEW_ENCODE)}
+PIPELINE_MODES = {"vrillsy.render_job": VRILLSY_MODES}
+VRILLSY_MAX_CLIPS = 3    # vrillsy.render_job: tyle pierwszych klipów...
+VRILLSY_SEG_S = 3.33     # ...po tyle sekund, sklejone po kolei (bez planu cięć)
 
 TARGET_DEFAULT_S = float(os.getenv("TARGET_DURATION_S", "10.0"))
 MIN_CUT_GAP_S = float(os.getenv("MIN_CUT_GAP_S", "0.20"))
 FALLBACK_INTERVAL_S = float(os.getenv("FALLBACK_INTERVAL_S", "0.50"))
 
-LOCK_TTL_S = 600
+# Równoległa normalizacja klipów: 0 = auto (rdzenie / NORMALIZE_MIN_THREADS)
+NORMALIZE_WORKERS = int(os.getenv("NORMALIZE_WORKERS", "0"))
+NORMALIZE_MIN_THREADS = int(os.getenv("NORMALIZE_MIN_THREADS", "4"))
+
+# Budżet CPU węzła dla wszystkich procesów ffmpeg (wszystkie dzieci Celery i warianty batcha): tokeny = wątki;
+# 0 = rdzenie procesu. Plik stanu musi być wspólny dla procesów węzła (/dev/shm, ten sam kontener/volumen).
+CPU_BUDGET = int(os.getenv("CPU_BUDGET", "0"))
+CPU_BUDGET_FILE = os.getenv("CPU_BUDGET_FILE", "/dev/shm/vrs-cpu-budget.json" if os.path.isdir("/dev/shm")
+                            else os.path.join(tempfile.gettempdir(), "vrs-cpu-budget.json"))
+CPU_FFMPEG_THREADS = int(os.getenv("CPU_FFMPEG_THREADS", "4"))  # domyślne życzenie ffmpeg bez własnego -threads
+CPU_MIN_THREADS = int(os.getenv("CPU_MIN_THREADS", "2"))        # mniej wolnych tokenów = czekanie w kolejce
+CPU_AFFINITY = os.getenv("CPU_AFFINITY", "0") == "1"           # przypinanie ffmpeg do przydzielonych rdzeni
+
+# Rozproszony DAG renderu (render_job_dag): normalizacja per klip na wielu workerach (chord);
+# render_job przełącza się na DAG od tylu klipów (0 = nigdy)
+RENDER_DAG_MIN_CLIPS = int(os.getenv("RENDER_DAG_MIN_CLIPS", "0"))
+
+# Batch wariantów (render_batch): wspólne ingest/analiza, warianty składane równolegle; 0 = auto (rdzenie / 4)
+BATCH_MAX_VARIANTS = int(os.getenv("BATCH_MAX_VARIANTS", "10"))
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "0"))
+
+# Składanie timeline'u: "segments" (cięcie + concat + mux) lub "graph" (jeden filter_complex).
+# Domyślnie segments, dopóki graph nie przejdzie benchmarku (bench/render_bench.py) – jak MEZZANINE_MODE.
+ASSEMBLY_MODE = os.getenv("ASSEMBLY_MODE", "segments")
+GRAPH_MAX_INPUTS = int(os.getenv("GRAPH_MAX_INPUTS", "96"))  # powyżej: fallback na segments
+
+# Mezzanine dla znormalizowanych klipów: "off" (long-GOP), "intra" (same I-ramki)
+# lub "gop" (stały, zamknięty GOP bez B-ramek). Przy intra/gop cięcie i concat idą przez -c copy.
+MEZZANINE_MODE = os.getenv("MEZZANINE_MODE", "off")
+MEZZANINE_GOP = int(os.getenv("MEZZANINE_GOP", str(PROFILE.fps)))
+
+LOCK_TTL_S = 600  # lease DAG-u: odnawiany przez kolejne kroki, musi przetrwać kolejkę między nimi
+# lease pojedynczego renderu: heartbeat co LEASE_TTL_S/3, po padnięciu workera job wolny najpóźniej po tylu s
+LEASE_TTL_S = float(os.getenv("LEASE_TTL_S", "30"))
 WORKER_VERSION = os.getenv("WORKER_VERSION", "vrillsy-D5.0-2025-08-16")
 
 AUBIO_METHOD = os.getenv("AUBIO_METHOD", "complex")
 AUBIO_THRESHOLD = os.getenv("AUBIO_THRESHOLD", "0.35")
 
+# Analiza audio: "legacy" (aubioonset / astats / librosa per pipeline) lub "native"
+# (worker.utils.analysis – jeden dekod do mono float32, przetwarzanie blokami w NumPy)
+ANALYSIS_BACKEND = os.getenv("ANALYSIS_BACKEND", "legacy")
+ANALYSIS_SR = int(os.getenv("ANALYSIS_SR", "11025"))
+ANALYSIS_FRAME = int(os.getenv("ANALYSIS_FRAME", "1024"))
+ANALYSIS_HOP = int(os.getenv("ANALYSIS_HOP", "256"))
+ANALYSIS_BLOCK_S = float(os.getenv("ANALYSIS_BLOCK_S", "2.0"))
+
 SHARED_DIR = os.getenv("SHARED_DIR", "/shared")
 OUTPUTS_DIR = os.getenv("OUTPUTS_DIR", "/outputs")
 
+# Cache znormalizowanych klipów (content-addressed, współdzielony przez workery)
+NORM_CACHE_DIR = os.getenv("NORM_CACHE_DIR", os.path.join(SHARED_DIR, ".normcache"))
+NORM_CACHE_MAX_MB = int(os.getenv("NORM_CACHE_MAX_MB", "20480"))  # 0 = cache wyłączony
+# podbij przy każdej zmianie filtra/enkodera w normalize_clip
+NORM_FILTER_VERSION = os.getenv("NORM_FILTER_VERSION", "blurpad-v1-x264-veryfast-crf18")
+
+# Cache analizy audio (onsety, beaty, tempo, RMS, pomiar loudnorm) per hash utworu
+ANALYSIS_CACHE_DIR = os.getenv("ANALYSIS_CACHE_DIR", os.path.join(SHARED_DIR, ".analysiscache"))
+ANALYSIS_CACHE_MAX_MB = int(os.getenv("ANALYSIS_CACHE_MAX_MB", "512"))  # 0 = cache wyłączony
+
+# content-addressed store uploadów (hardlinki z katalogów jobów); musi leżeć na tym samym FS co SHARED_DIR
+MEDIA_STORE_DIR = os.getenv("MEDIA_STORE_DIR", os.path.join(SHARED_DIR, ".media"))
+
 REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
 
+# Kolejki renderu (lane'y): producent wybiera po szacowanym koszcie, podgląd ma własną. Kolejność = priorytet
+# konsumpcji na workerach słuchających kilku kolejek; "vrillsy" zostaje krótką kolejką (zgodność ze starymi workerami).
+LANES = {"preview": "vrillsy.preview", "short": "vrillsy", "long": "vrillsy.long"}
+WORKER_PREFETCH = int(os.getenv("WORKER_PREFETCH", "1"))  # długie taski nie czekają w prefetchu zajętego workera
+
+# Fair share: ile renderów jednego użytkownika naraz jest w brokerze/na workerach (0 = bez limitu);
+# nadmiar czeka w Redis i jest wysyłany po zwolnieniu slotu (round-robin między użytkownikami)
+USER_MAX_CONCURRENT = int(os.getenv("USER_MAX_CONCURRENT", "2"))
+FAIR_RUNNING_TTL_S = int(os.getenv("FAIR_RUNNING_TTL_S", "3600"))  # slot martwego workera wygasa
+FAIR_PUMP_S = float(os.getenv("FAIR_PUMP_S", "30"))  # cykliczne pump() w workerach (wygasłe sloty); 0 = wyłączone
+
+# Cache wyników renderu po odcisku (hashe wejść + parametry + profil + wersja) i łączenie identycznych zleceń w locie
+RENDER_CACHE_TTL_S = int(os.getenv("RENDER_CACHE_TTL_S", str(24 * 3600)))   # gotowy wynik
+RENDER_INFLIGHT_TTL_S = int(os.getenv("RENDER_INFLIGHT_TTL_S", "3600"))      # render w toku (worker mógł paść)
+
 HOOK_MODE = os.getenv("HOOK_MODE", "A")
 CROSSFADES = os.getenv("CROSSFADES", "0") == "1"
+
+# fragmented MP4 (pusty moov na początku, fragmenty od keyframe'ów) – zmienia tylko układ kontenera: mux bez
+# drugiego przebiegu +faststart, a odtwarzacz startuje po pierwszym fragmencie pobranego pliku. Render nadal
+# publikuje wynik atomowo (tmp + rename pod lease), więc pliku w trakcie zapisu nikt nie serwuje.
+# Domyślnie klasyczny +faststart (drugi przebieg przenoszący moov)
+OUTPUT_FRAGMENTED = os.getenv("OUTPUT_FRAGMENTED", "0") == "1"
+OUTPUT_MOVFLAGS = "+frag_keyframe+empty_moov+default_base_moof" if OUTPUT_FRAGMENTED else "+faststart"
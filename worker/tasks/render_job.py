@@ -1,46 +1,50 @@
-import os, json, subprocess, time, tempfile, pathlib, datetime, random, hashlib
+import os, json, subprocess, time, tempfile, pathlib, datetime, random, hashlib, threading, shutil, socket, contextlib
+from concurrent.futures import as_completed
 from typing import List
-from celery import shared_task
-import redis
+from contextvars import ContextVar
+from celery import shared_task, chord, chain, group
 
 from worker.config import (
-    PROFILE, TARGET_DEFAULT_S, MIN_CUT_GAP_S, FALLBACK_INTERVAL_S,
-    SHARED_DIR, OUTPUTS_DIR, WORKER_VERSION, AUBIO_METHOD, AUBIO_THRESHOLD,
-    REDIS_URL
+    PROFILE, VideoProfile, EncodeSettings, FINAL_ENCODE, RENDER_MODES, TARGET_DEFAULT_S, MIN_CUT_GAP_S, FALLBACK_INTERVAL_S,
+    SHARED_DIR, OUTPUTS_DIR, WORKER_VERSION, BATCH_MAX_VARIANTS, BATCH_WORKERS,
+    RENDER_DAG_MIN_CLIPS, LOCK_TTL_S, AUBIO_METHOD, AUBIO_THRESHOLD,
+    NORMALIZE_WORKERS, NORMALIZE_MIN_THREADS, ASSEMBLY_MODE, GRAPH_MAX_INPUTS,
+    MEZZANINE_MODE, MEZZANINE_GOP, ANALYSIS_BACKEND, OUTPUT_FRAGMENTED, OUTPUT_MOVFLAGS
 )
-from worker.utils.locks import acquire_job_lock, release_job_lock
-
-_r = redis.from_url(REDIS_URL, decode_responses=True)
-
-def _hk(job_id: str) -> str: return f"job:{job_id}"
-def _progress(job_id: str, stage: str, pct: int, extra: dict | None = None) -> None:
-    d = {"stage": stage, "progress": str(int(pct))}
-    if extra: d.update({str(k): str(v) for k, v in extra.items()})
-    try: _r.hset(_hk(job_id), mapping=d)
-    except Exception: pass
-
-def run(cmd: str) -> None:
+from worker.utils.locks import Lease, LeaseLost, acquire_lease
+from worker.utils import normcache, probe, analysis, analysis_cache
+from worker.utils.beatgrid import BeatGrid
+from worker.utils import metrics, progress, estimator, cpubudget
+
+# stan renderów w tym procesie per (job, tryb) – jak lease_name; podgląd i final tego joba mogą biec obok siebie
+_clocks: dict[tuple[str, str], metrics.StageClock] = {}
+_leases: dict[tuple[str, str], Lease] = {}
+_mode: ContextVar[str | None] = ContextVar("vrs_render_mode", default=None)  # tryb renderu bieżącego taska
+
+def _progress(job_id: str, stage: str, pct: int | None, extra: dict | None = None) -> None:
+    key = (job_id, _mode.get())
+    lease = _leases.get(key)
+    if lease and stage != "error": lease.check()  # lease przejęty przez inny render – przerwij na granicy etapu
+    clock = _clocks.get(key)
+    if clock: clock.mark(stage)  # _progress raportuje zakończenie etapu
+    progress.publish(job_id, stage, pct, extra)
+
+# procesy potomne (liczba ffmpeg, kodowania libx264, CPU, I/O) liczy cpubudget.run do metrics.job_counters() joba
+def run(cmd: str, capture_stderr: bool = False) -> str:
     print("[CMD]", cmd, flush=True)
-    r = subprocess.run(cmd, shell=True)
+    r = cpubudget.run(cmd, shell=True, stderr=subprocess.PIPE if capture_stderr else None, text=capture_stderr)
     if r.returncode != 0: raise RuntimeError(f"[FFMPEG_FAIL] code={r.returncode}")
+    return r.stderr or ""
 
 def popen_stdout(cmd: list[str]) -> str:
-    r = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    r = cpubudget.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
     return r.stdout
 
 def ffprobe_json(path: str) -> dict:
-    raw = subprocess.check_output(
-        f'ffprobe -v error -print_format json -show_streams -show_format "{path}"', shell=True
-    ).decode()
-    import json as _j; return _j.loads(raw)
+    return probe.probe(path)
 
 def ffprobe_duration(path: str) -> float:
-    out = subprocess.check_output(
-        f'ffprobe -v error -show_entries format=duration -of default=noprint_wrappers=1:nokey=1 "{path}"',
-        shell=True
-    ).decode().strip()
-    try: return float(out)
-    except Exception: return 0.0
+    return probe.duration(path) or 0.0
 
 def seconds_to_frames(s: float) -> int: return max(0, int(round(s * PROFILE.fps)))
 def frames_to_seconds(fr: int) -> float: return fr / PROFILE.fps
@@ -49,33 +53,115 @@ def job_seed(job_id: str) -> int:
     h = hashlib.sha256(job_id.encode()).hexdigest()[:8]
     return int(h, 16)
 
-def normalize_inputs(job_dir: str, tmpdir: str) -> tuple[list[str], float]:
+def _cpu_count() -> int:
+    try: return len(os.sched_getaffinity(0))
+    except AttributeError: return os.cpu_count() or 1
+
+# (procesy ffmpeg, -threads na proces) – rdzenie dzielone między równoległe normalizacje
+def normalize_pool_shape(n_clips: int) -> tuple[int, int]:
+    cores=_cpu_count()
+    workers=NORMALIZE_WORKERS or max(1, cores // max(1, NORMALIZE_MIN_THREADS))
+    workers=max(1, min(workers, n_clips, cores))
+    return workers, max(1, cores // workers)
+
+def mezzanine() -> bool: return MEZZANINE_MODE in ("intra", "gop")
+
+# parametry x264 dla znormalizowanych klipów pośrednich
+def mezzanine_args() -> str:
+    if MEZZANINE_MODE == "intra": return "-g 1 -keyint_min 1 -sc_threshold 0 -bf 0"
+    if MEZZANINE_MODE == "gop": return f"-g {MEZZANINE_GOP} -keyint_min {MEZZANINE_GOP} -sc_threshold 0 -bf 0 -flags +cgop"
+    return ""
+
+# początek ujęcia cięty przez -c copy (segments + gop) musi wypaść na granicy GOP, inaczej kopia zacznie od złej
+# ramki; graph dekoduje i tnie co do ramki, więc plan trzyma nieprzyciągnięte s0
+def mezzanine_snap(t0: float) -> float:
+    if MEZZANINE_MODE != "gop": return frames_to_seconds(seconds_to_frames(t0))
+    return frames_to_seconds((seconds_to_frames(t0) // MEZZANINE_GOP) * MEZZANINE_GOP)
+
+def normalize_clip(src: str, dst: str, threads: int, prof: VideoProfile = PROFILE, enc: EncodeSettings = FINAL_ENCODE) -> float:
+    t0=time.time()
+    vf = (
+      f'[0:v]scale={prof.width}:{prof.height}:force_original_aspect_ratio=increase,'
+      f'boxblur=20:1,crop={prof.width}:{prof.height}[bg];'
+      f'[0:v]scale={prof.width}:{prof.height}:force_original_aspect_ratio=decrease[fg];'
+      f'[bg][fg]overlay=(W-w)/2:(H-h)/2,setsar={prof.sar},fps={prof.fps},format={prof.pix_fmt}'
+    )
+    run(f'ffmpeg -y -i "{src}" -an -filter_complex "{vf}" -c:v libx264 {enc.args} {mezzanine_args()} -threads {threads} "{dst}"')
+    return time.time()-t0
+
+def input_videos(job_dir: str) -> list[str]:
     vids_in = sorted([str(p) for p in pathlib.Path(job_dir, "video").glob("*") if p.is_file()])
     if not vids_in: raise RuntimeError("Brak plików wejściowych w /video")
-    outs=[]; t0=time.time()
-    for i, src in enumerate(vids_in):
-        dst = os.path.join(tmpdir, f"norm_{i:02d}.mp4")
-        vf = (
-          f'[0:v]scale={PROFILE.width}:{PROFILE.height}:force_original_aspect_ratio=increase,'
-          f'boxblur=20:1,crop={PROFILE.width}:{PROFILE.height}[bg];'
-          f'[0:v]scale={PROFILE.width}:{PROFILE.height}:force_original_aspect_ratio=decrease[fg];'
-          f'[bg][fg]overlay=(W-w)/2:(H-h)/2,setsar={PROFILE.sar},fps={PROFILE.fps},format={PROFILE.pix_fmt}'
-        )
-        run(f'ffmpeg -y -i "{src}" -an -filter_complex "{vf}" -c:v libx264 -preset veryfast -crf 18 "{dst}"')
-        outs.append(dst)
-    return outs, (time.time()-t0)
-
-def prepare_audio(audio_in: str, tmpdir: str, target_s: float) -> str:
+    return vids_in
+
+# True = klip wzięty z normcache
+def normalize_one(src: str, dst: str, threads: int, prof: VideoProfile = PROFILE, enc: EncodeSettings = FINAL_ENCODE) -> bool:
+    if not normcache.enabled():
+        normalize_clip(src, dst, threads, prof, enc); return False
+    key=normcache.cache_key(src, profile=prof, variant=f"mezz={MEZZANINE_MODE}:{MEZZANINE_GOP};enc={enc.preset}/{enc.crf}")
+    return normcache.get_or_build(key, dst, lambda tmp: normalize_clip(src, tmp, threads, prof, enc))
+
+def normalize_inputs(job_dir: str, tmpdir: str, prof: VideoProfile = PROFILE, enc: EncodeSettings = FINAL_ENCODE) -> tuple[list[str], float, dict]:
+    vids_in = input_videos(job_dir)
+    outs=[os.path.join(tmpdir, f"norm_{i:02d}.mp4") for i in range(len(vids_in))]
+    workers, threads = normalize_pool_shape(len(vids_in))
+    t0=time.time()
+    hits=[False]*len(vids_in)
+
+    def one(i: int) -> float:
+        c0=time.time()
+        hits[i]=normalize_one(vids_in[i], outs[i], threads, prof, enc)
+        return time.time()-c0
+
+    # każdy wątek tylko czeka na własny proces ffmpeg – równoległość daje pula procesów ffmpeg
+    with metrics.Executor(max_workers=workers) as ex:
+        clip_s=list(ex.map(one, range(len(vids_in))))
+    stats={"workers": workers, "threads": threads, "clips_s": [round(x,3) for x in clip_s],
+           "cache_hits": sum(hits), "cache_misses": len(hits)-sum(hits)}
+    return outs, (time.time()-t0), stats
+
+LOUDNORM_KEYS=("input_i","input_tp","input_lra","input_thresh","target_offset")
+
+def parse_loudnorm(stderr: str) -> dict | None:
+    i=stderr.rfind("{"); j=stderr.rfind("}")
+    if i < 0 or j < i: return None
+    try: d=json.loads(stderr[i:j+1])
+    except ValueError: return None
+    return {k: d[k] for k in LOUDNORM_KEYS if k in d} or None
+
+LOUDNORM="loudnorm=I=-14:TP=-1.5:LRA=11"
+
+# przebieg pomiarowy (-f null, bez zapisu) na tym samym przyciętym wejściu co prepare_audio
+def measure_loudness(audio_in: str, target_s: float) -> dict | None:
+    safe_len = target_s + 0.2
+    err = run(f'ffmpeg -y -i "{audio_in}" -af "atrim=0:{safe_len},asetpts=N/SR/TB,{LOUDNORM}:print_format=json" -f null -',
+              capture_stderr=True)
+    return parse_loudnorm(err)
+
+# zawsze liniowy loudnorm z pomiarem: measured z cache/planu albo świeży pomiar – ten sam utwór daje to samo audio
+# niezależnie od stanu cache (i onsety z cache pasują do audio, na którym je liczono)
+def prepare_audio(audio_in: str, tmpdir: str, target_s: float, measured: dict | None = None) -> tuple[str, dict | None]:
     out = os.path.join(tmpdir, "audio_proc.wav")
     safe_len = target_s + 0.2
+    measured = measured or measure_loudness(audio_in, target_s)
+    ln = f"{LOUDNORM}:linear=true"
+    if measured:
+        ln += (f":measured_I={measured['input_i']}:measured_TP={measured['input_tp']}"
+               f":measured_LRA={measured['input_lra']}:measured_thresh={measured['input_thresh']}"
+               f":offset={measured['target_offset']}")
     af = (
         f"atrim=0:{safe_len},asetpts=N/SR/TB,"
-        f"loudnorm=I=-14:TP=-1.5:LRA=11:linear=true:print_format=summary,"
+        f"{ln},"
         f"acompressor=threshold=-1.5dB:ratio=4:attack=5:release=50:makeup=0,"
         f"afade=t=in:st=0:d=0.02,afade=t=out:st={safe_len-0.06}:d=0.06"
     )
     run(f'ffmpeg -y -i "{audio_in}" -filter_complex "{af}" -ar 48000 -ac 2 -c:a pcm_s16le "{out}"')
-    return out
+    return out, measured
+
+# klucz analysis_cache dla audio przyciętego do target; loudnorm = wersja przygotowania audio (onsety liczone na nim)
+def analysis_key(audio_in: str, target: float) -> str:
+    return analysis_cache.cache_key(audio_in, trim_s=round(target,3), backend=ANALYSIS_BACKEND, method=AUBIO_METHOD,
+                                    threshold=AUBIO_THRESHOLD, min_gap=MIN_CUT_GAP_S, loudnorm="measured-linear")
 
 def aubio_onsets(audio_path: str) -> list[float]:
     stdout = popen_stdout(["aubioonset","-i",audio_path,"-O",AUBIO_METHOD,"-t",AUBIO_THRESHOLD])
@@ -88,26 +174,33 @@ def aubio_onsets(audio_path: str) -> list[float]:
         except ValueError: pass
     return on
 
+# artefakty analizy w kształcie wpisu analysis_cache
+def analyze_audio(audio_path: str) -> dict:
+    if ANALYSIS_BACKEND == "native":
+        a=analysis.analyze(audio_path)
+        return {"onsets": a.onsets, "beats": a.beats, "tempo": a.tempo, "rms": a.rms, "env_rate": a.env_rate}
+    return {"onsets": aubio_onsets(audio_path)}
+
+def detect_onsets(audio_path: str) -> list[float]:
+    return analyze_audio(audio_path)["onsets"]
+
 def fallback_beats(audio_len: float, start_offset: float, interval: float) -> list[float]:
     t=start_offset; out=[]
     while t < audio_len: out.append(round(t,6)); t += interval
     return out
 
 def energy_density(times: list[float], window: float = 0.25) -> list[tuple[float,int]]:
-    out=[]; 
-    for t in times:
-        c=sum(1 for x in times if abs(x-t) <= window/2)
-        out.append((t,c))
-    return out
+    g=BeatGrid(times)
+    return list(zip(g.t.tolist(), g.density(window).tolist()))
 
 def choose_hook(onsets: list[float], rng: random.Random, max_len_s: float = 1.5) -> tuple[float,float]:
     if not onsets: return 0.0, min(1.5, TARGET_DEFAULT_S)
     tmax = max(onsets[-1], TARGET_DEFAULT_S)
     cutoff = 0.4 * tmax
     cand = [t for t in onsets if t <= cutoff] or onsets
-    dens = energy_density(cand, window=0.25)
-    dens.sort(key=lambda x: (x[1], -x[0]), reverse=True)
-    start=float(dens[0][0]); hook_len=rng.uniform(0.6, max_len_s)
+    g = BeatGrid(cand)
+    # najgęstsze okno, przy remisie najwcześniejsze (argmax zwraca pierwszy indeks)
+    start=float(g.t[int(g.density(0.25).argmax())]); hook_len=rng.uniform(0.6, max_len_s)
     return max(0.0,start), start+hook_len
 
 def lengths_distribution(rng: random.Random) -> int:
@@ -122,7 +215,8 @@ def build_cut_times(audio_len: float, beats: list[float], start_at: float, targe
     if times[-1] < target_total: times.append(target_total)
     return sorted(set([round(t,6) for t in times if 0 <= t <= target_total]))
 
-def assign_shots(vids: list[str], rng: random.Random, n: int) -> List[int]:
+def assign_shots(vids: list[str], rng: random.Random, n: int, shuffle: bool = True) -> List[int]:
+    if not shuffle: return [i % len(vids) for i in range(n)]  # klipy po kolei, w kolejności uploadu
     order=[]; last=-1
     for _ in range(n):
         choices=list(range(len(vids)))
@@ -136,140 +230,571 @@ def smart_span_adjust(src_len: float, want_s: float, rng: random.Random) -> tupl
         return t0, t0+want_s, False
     return 0.0, min(src_len, want_s), True
 
-def nearest_beat(t: float, beats: list[float]) -> float:
-    return min(beats, key=lambda b: abs(b-t)) if beats else t
+def nearest_beat(t: float, beats: list[float] | BeatGrid) -> float:
+    return (beats if isinstance(beats, BeatGrid) else BeatGrid(beats)).nearest(t)
 
 def cut_log_line(i: int, t0: float, t1: float, beat_ref: float) -> str:
     fr0=seconds_to_frames(t0); fr1=seconds_to_frames(t1); frb=seconds_to_frames(beat_ref)
     d=min(abs(fr0-frb), abs(fr1-frb))
     return f"{i:03d} | {t0:7.3f}–{t1:7.3f} s | near_beat={beat_ref:7.3f} s | Δframes={d}"
 
-def cut_segment(src: str, t0: float, t1: float, out_path: str) -> None:
+def cut_segment(src: str, t0: float, t1: float, out_path: str, prof: VideoProfile = PROFILE, enc: EncodeSettings = FINAL_ENCODE) -> None:
     dur=max(0.001, t1-t0)
-    vf=f"fps={PROFILE.fps},format={PROFILE.pix_fmt},setsar={PROFILE.sar}"
-    run(f'ffmpeg -y -ss {t0:.6f} -i "{src}" -t {dur:.6f} -an -vf "{vf}" -c:v libx264 -preset veryfast -crf 18 "{out_path}"')
-
-def concat_segments(list_path: str, out_path: str) -> None:
-    run(f'ffmpeg -y -f concat -safe 0 -i "{list_path}" -c:v libx264 -preset veryfast -crf 18 -pix_fmt {PROFILE.pix_fmt} -r {PROFILE.fps} "{out_path}"')
-
-def mux_with_audio(video_in: str, audio_in: str, out_path: str, target_s: float) -> None:
+    if mezzanine():
+        # klatki pośrednie są niezależne od granicy cięcia -> kopia strumienia co do ramki
+        t0=mezzanine_snap(t0)
+        run(f'ffmpeg -y -ss {t0 + 0.25/prof.fps:.6f} -i "{src}" -frames:v {max(1, seconds_to_frames(dur))} -an -c copy -avoid_negative_ts make_zero "{out_path}"')
+        return
+    vf=f"fps={prof.fps},format={prof.pix_fmt},setsar={prof.sar}"
+    run(f'ffmpeg -y -ss {t0:.6f} -i "{src}" -t {dur:.6f} -an -vf "{vf}" -c:v libx264 {enc.args} "{out_path}"')
+
+def concat_segments(list_path: str, out_path: str, prof: VideoProfile = PROFILE, enc: EncodeSettings = FINAL_ENCODE) -> None:
+    if mezzanine():
+        run(f'ffmpeg -y -f concat -safe 0 -i "{list_path}" -c copy "{out_path}"'); return
+    run(f'ffmpeg -y -f concat -safe 0 -i "{list_path}" -c:v libx264 {enc.args} -pix_fmt {prof.pix_fmt} -r {prof.fps} "{out_path}"')
+
+def mux_with_audio(video_in: str, audio_in: str, out_path: str, target_s: float, prof: VideoProfile = PROFILE, enc: EncodeSettings = FINAL_ENCODE) -> None:
     run(('ffmpeg -y -i "{vin}" -i "{ain}" '
          '-filter_complex "[0:v]fps={fps},format={pix},tpad=stop_mode=clone:stop_duration=0.02[v];'
          '[1:a]atrim=0:{T:.6f},asetpts=N/SR/TB[a]" '
-         '-map "[v]" -map "[a]" -t {T:.6f} -pix_fmt {pix} -r {fps} -c:v libx264 -preset veryfast -crf 18 -movflags +faststart "{out}"'
-         ).format(vin=video_in, ain=audio_in, T=target_s, pix=PROFILE.pix_fmt, fps=PROFILE.fps, out=out_path))
+         '-map "[v]" -map "[a]" -t {T:.6f} -pix_fmt {pix} -r {fps} -c:v libx264 {enc} -movflags {mov} "{out}"'
+         ).format(vin=video_in, ain=audio_in, T=target_s, pix=prof.pix_fmt, fps=prof.fps, enc=enc.args, mov=OUTPUT_MOVFLAGS, out=out_path))
+
+def cut_shot(shot: dict, tmpdir: str, idx: int, prof: VideoProfile = PROFILE, enc: EncodeSettings = FINAL_ENCODE) -> str:
+    seg_path=os.path.join(tmpdir, f"seg_{idx:03d}.mp4")
+    cut_segment(shot["src"], shot["s0"], shot["s1"], seg_path, prof, enc)
+    if shot["rev"]:
+        seg_fwd=os.path.join(tmpdir, f"seg_{idx:03d}_f.mp4")
+        seg_rev=os.path.join(tmpdir, f"seg_{idx:03d}_r.mp4")
+        os.replace(seg_path, seg_fwd)
+        run(f'ffmpeg -y -i "{seg_fwd}" -vf "reverse,fps={prof.fps},format={prof.pix_fmt}" -an -c:v libx264 {enc.args} {mezzanine_args()} "{seg_rev}"')
+        lst=os.path.join(tmpdir, f"seg_{idx:03d}.lst")
+        with open(lst,"w") as f:
+            f.write(f"file '{seg_fwd}'\n"); f.write(f"file '{seg_rev}'\n")
+        concat_segments(lst, seg_path, prof, enc)
+    return seg_path
+
+# graph = cały timeline w jednym -filter_complex (jedno kodowanie); segments = fallback per-cięcie
+def assembly_mode(n_shots: int) -> str:
+    if ASSEMBLY_MODE == "graph" and n_shots <= GRAPH_MAX_INPUTS: return "graph"
+    return "segments"
+
+def build_graph_command(shots: list[dict], audio_in: str, out_path: str, target_s: float,
+                        prof: VideoProfile = PROFILE, enc: EncodeSettings = FINAL_ENCODE) -> str:
+    # każde ujęcie = osobne wejście z -ss/-t, więc concat czyta je po kolei bez buforowania split
+    inputs=[]; parts=[]; labels=""
+    for k, sh in enumerate(shots):
+        dur=max(0.001, sh["s1"]-sh["s0"])
+        inputs.append(f'-ss {sh["s0"]:.6f} -t {dur:.6f} -i "{sh["src"]}"')
+        if sh["rev"]:
+            parts.append(f'[{k}:v]setpts=PTS-STARTPTS,split[f{k}][b{k}];[b{k}]reverse[r{k}];'
+                         f'[f{k}][r{k}]concat=n=2:v=1:a=0,trim=duration={sh["want"]:.6f},setpts=PTS-STARTPTS[v{k}]')
+        else:
+            parts.append(f'[{k}:v]setpts=PTS-STARTPTS[v{k}]')
+        labels += f'[v{k}]'
+    a=len(shots)
+    parts.append(f'{labels}concat=n={len(shots)}:v=1:a=0,fps={prof.fps},format={prof.pix_fmt},'
+                 f'setsar={prof.sar},tpad=stop_mode=clone:stop_duration=0.02[v]')
+    parts.append(f'[{a}:a]atrim=0:{target_s:.6f},asetpts=N/SR/TB[a]')
+    return (f'ffmpeg -y {" ".join(inputs)} -i "{audio_in}" -filter_complex "{";".join(parts)}" '
+            f'-map "[v]" -map "[a]" -t {target_s:.6f} -pix_fmt {prof.pix_fmt} -r {prof.fps} '
+            f'-c:v libx264 {enc.args} -movflags {OUTPUT_MOVFLAGS} "{out_path}"')
+
+def assemble_graph(shots: list[dict], audio_in: str, out_path: str, target_s: float,
+                   prof: VideoProfile = PROFILE, enc: EncodeSettings = FINAL_ENCODE) -> None:
+    run(build_graph_command(shots, audio_in, out_path, target_s, prof, enc))
+
+def plan_timeline(onsets: list[float], target: float, src_lens: list[float], rng: random.Random,
+                  shuffle: bool = True) -> dict:
+    hook_start, hook_end = choose_hook(onsets, rng, max_len_s=1.5)
+    hook_end=min(hook_end, target)
+    beats_after=[t for t in onsets if t > hook_end + 1/PROFILE.fps]
+    if len(beats_after) < 4:
+        beats_after=fallback_beats(audio_len=target, start_offset=hook_end, interval=FALLBACK_INTERVAL_S)
+
+    cut_times=[0.0, hook_end]
+    cut_times += [t for t in beats_after if t <= target]
+    if cut_times[-1] < target - 1e-3: cut_times.append(target)
+    cut_times=sorted(set([round(t,6) for t in cut_times if 0 <= t <= target]))
+
+    cut_grid=BeatGrid(cut_times[1:]); onset_grid=BeatGrid(onsets)
+    refined=[cut_times[0]]; i=1
+    while i < len(cut_times):
+        last=refined[-1]
+        want_s = (lambda fr: fr/PROFILE.fps)(lengths_distribution(rng))
+        desired_end=last + want_s
+        nb=cut_grid.nearest(desired_end)
+        if nb <= last + (2/PROFILE.fps):
+            j=i
+            while j < len(cut_times) and cut_times[j] <= last + (2/PROFILE.fps): j+=1
+            if j >= len(cut_times): break
+            refined.append(cut_times[j]); i=j+1
+        else:
+            refined.append(nb)
+            while i < len(cut_times) and cut_times[i] <= nb + 1e-6: i+=1
+
+    if refined[-1] < target - 1e-3: refined.append(target)
+
+    order=assign_shots(src_lens, rng, n=max(1, len(refined)-1), shuffle=shuffle)
+
+    shots=[]; cutlog=[]
+    for idx in range(len(refined)-1):
+        t0=refined[idx]; t1=refined[idx+1]
+        clip=order[idx]
+        want=max(1/PROFILE.fps, t1-t0)
+        s0,s1,need_rev=smart_span_adjust(src_lens[clip], want, rng)
+        shots.append({"clip": clip, "s0": s0, "s1": s1, "want": want,
+                      "rev": need_rev and (s1-s0) < want - (1/PROFILE.fps)})
+        beat_ref = onset_grid.nearest(t1)
+        cutlog.append(cut_log_line(idx, t0, t1, beat_ref))
+
+    return {"target": target, "hook": [hook_start, hook_end], "cuts": refined, "shots": shots,
+            "cutlog": cutlog, "onsets": len(onsets)}
+
+# plan zapisany przez poprzedni render (np. preview) – final używa go bez ponownej analizy i planowania
+def load_plan(path: str, target: float, n_clips: int) -> dict | None:
+    try:
+        with open(path) as f: plan=json.load(f)
+    except (FileNotFoundError, ValueError): return None
+    ok=(abs(plan.get("target", -1) - target) < 1e-6 and plan.get("clips") == n_clips
+        and plan.get("worker_version") == WORKER_VERSION and plan.get("mezzanine") == MEZZANINE_MODE)
+    return plan if ok else None
+
+def save_plan(path: str, plan: dict) -> None:
+    with open(path + ".tmp", "w") as f: json.dump(plan, f, ensure_ascii=False)
+    os.replace(path + ".tmp", path)
+
+def assemble(shots: list[dict], audio_proc: str, out_mp4: str, target: float, tmpdir: str,
+             prof: VideoProfile, enc: EncodeSettings, job_id: str | None) -> str:
+    # job_id=None: bez zdarzeń postępu (warianty batcha raportują się same)
+    mode=assembly_mode(len(shots))
+    if mode == "graph":
+        assemble_graph(shots, audio_proc, out_mp4, target, prof, enc)
+        if job_id: _progress(job_id, "assemble", 80, {"mode": mode})
+        return mode
+    segments=[cut_shot(shot, tmpdir, idx, prof, enc) for idx, shot in enumerate(shots)]
+    if job_id: _progress(job_id, "cut", 70)
+
+    out_tmpl=os.path.join(tmpdir, "segments.txt"); out_tmpv=os.path.join(tmpdir, "video.mp4")
+    with open(out_tmpl, "w") as f:
+        for p in segments: f.write(f"file '{p}'\n")
+    concat_segments(out_tmpl, out_tmpv, prof, enc)
+    if job_id: _progress(job_id, "mux_prep", 80)
+
+    mux_with_audio(out_tmpv, audio_proc, out_mp4, target, prof, enc)
+    return mode
+
+def output_paths(job_id: str, mode: str) -> tuple[str, str, str, str]:
+    """(mp4, qa json, .done, plan) w OUTPUTS_DIR; plan wspólny dla trybów (preview -> final)."""
+    os.makedirs(OUTPUTS_DIR, exist_ok=True)
+    base=job_id if mode == "final" else f"{job_id}.{mode}"
+    return (os.path.join(OUTPUTS_DIR, f"{base}.mp4"), os.path.join(OUTPUTS_DIR, f"{base}.json"),
+            os.path.join(OUTPUTS_DIR, f"{base}.done"), os.path.join(OUTPUTS_DIR, f"{job_id}.plan.json"))
+
+def qa_report(job_id: str, out_mp4: str, mode: str, prof: VideoProfile, enc: EncodeSettings, plan: dict,
+              reused: bool, assembly: str, t_start: float, **extra) -> dict:
+    qa={
+        "job_id": job_id,
+        "out": out_mp4,
+        "mode": mode,
+        "duration_s": round(ffprobe_duration(out_mp4),3),
+        "profile": f"{prof.width}x{prof.height}@{prof.fps}",
+        "encode": {"preset": enc.preset, "crf": enc.crf},
+        "cuts": len(plan["shots"]),
+        "plan_reused": reused,
+        "assembly": assembly,
+        "mezzanine": MEZZANINE_MODE,
+        "fragmented": OUTPUT_FRAGMENTED,
+        "onsets": plan["onsets"],
+        "analysis_backend": ANALYSIS_BACKEND,
+        "analysis_cache": plan.get("analysis_cache"),
+        "hook": {"start_s": round(plan["hook"][0],3), "end_s": round(plan["hook"][1],3)},
+        "cutlog": plan["cutlog"][:500],
+    }
+    qa.update(extra)
+    qa.update({"elapsed_s": round(time.time()-t_start,3),
+               "timestamp": datetime.datetime.utcnow().isoformat()+"Z",
+               "worker_version": WORKER_VERSION})
+    return qa
+
+def estimate(pipeline: str, vids_in: list[str], target: float, mode: str) -> dict:
+    """Cechy wejść + przewidywany czas renderu; trafia do QA (bootstrap modelu) i do zdarzenia ingest (ETA)."""
+    feats=estimator.job_features(vids_in, target, mode, pipeline=pipeline)
+    return {"pipeline": pipeline, "features": feats, "predicted_s": round(estimator.predict(pipeline, feats),1)}
+
+def learn(qa: dict) -> None:
+    est=qa.get("estimate")
+    if est: estimator.record(est["pipeline"], est["features"], qa["elapsed_s"], est["predicted_s"], qa.get("stages"))
+
+def write_qa(out_json: str, out_done: str, qa: dict) -> None:
+    with open(out_json,"w") as f: json.dump(qa,f,ensure_ascii=False,indent=2)
+    pathlib.Path(out_done).touch()
+
+def job_audio(job_dir: str) -> str:
+    audio_files=sorted([str(p) for p in pathlib.Path(job_dir, "audio").glob("*") if p.is_file()])
+    if not audio_files:
+        audio_files=sorted([str(p) for p in pathlib.Path(job_dir).glob("*") if p.suffix.lower() in (".wav",".mp3",".m4a",".aac",".flac",".ogg")])
+    if not audio_files: raise RuntimeError("Brak plików audio dla joba")
+    return audio_files[0]
+
+# lease per (job, tryb): podgląd i final mają osobne wyjścia, więc final nie czeka na biegnący podgląd
+def lease_name(job_id: str, mode: str) -> str:
+    return f"{job_id}:{mode}"
+
+# lease z heartbeatem na czas renderu w tym procesie; redelivery tego samego taska przejmuje go od razu
+def _lease(job_id: str, mode: str, task) -> Lease | None:
+    lease=acquire_lease(lease_name(job_id, mode), task_id=task.request.id)
+    if lease: _leases[job_id, mode]=lease.start()
+    return lease
+
+def _unlease(job_id: str, mode: str) -> None:
+    lease=_leases.pop((job_id, mode), None)
+    if lease: lease.release()
+
+def _publish(lease: Lease | dict | None, tmp: str, dst: str) -> None:
+    if lease is None: os.replace(tmp, dst); return
+    (lease if isinstance(lease, Lease) else Lease.from_dict(lease)).publish(tmp, dst)
 
 @shared_task(name="render_job")
-def render_job(job_id: str, target_duration_s: float | None = None) -> dict:
+def render_job(job_id: str, target_duration_s: float | None = None, mode: str = "final") -> dict:
+    n_clips=sum(1 for p in pathlib.Path(SHARED_DIR, job_id, "video").glob("*") if p.is_file())
+    if RENDER_DAG_MIN_CLIPS and render_job.request.id and n_clips >= RENDER_DAG_MIN_CLIPS:
+        return render_job.replace(render_job_dag.si(job_id, target_duration_s, mode))  # wynik = wynik DAG-u
+    _mode.set(mode)
+    try:
+        with metrics.job_counters():
+            return _render(job_id, target_duration_s, mode)
+    except LeaseLost:
+        raise  # job należy już do innego renderu – jego zdarzenia, nie nasze "error"
+    except Exception as e:
+        _progress(job_id, "error", None, {"error": f"{type(e).__name__}: {e}"[:500]})
+        raise
+    finally:
+        _clocks.pop((job_id, mode), None)
+        _unlease(job_id, mode)
+
+def _render(job_id: str, target_duration_s: float | None, mode: str) -> dict:
     t_start=time.time()
+    if mode not in RENDER_MODES: raise ValueError(f"Nieznany tryb renderu: {mode}")
+    prof, enc = RENDER_MODES[mode]
     target=float(target_duration_s or TARGET_DEFAULT_S)
     job_dir=os.path.join(SHARED_DIR, job_id)
-    audio_files=sorted([str(p) for p in pathlib.Path(job_dir, "audio").glob("*") if p.is_file()])
-    if not audio_files:
-        audio_files=sorted([str(p) for p in pathlib.Path(job_dir).glob("*") if p.suffix.lower() in (".wav",".mp3",".m4a",".aac",".flac",".ogg")])
-    if not audio_files: raise RuntimeError("Brak plików audio dla joba")
-    audio_in=audio_files[0]
+    audio_in=job_audio(job_dir)
 
-    os.makedirs(OUTPUTS_DIR, exist_ok=True)
-    out_mp4=os.path.join(OUTPUTS_DIR, f"{job_id}.mp4")
-    out_tmpv=out_mp4 + ".vtmp.mp4"
-    out_tmpl=out_mp4 + ".list.txt"
-    out_json=os.path.join(OUTPUTS_DIR, f"{job_id}.json")
-    out_done=os.path.join(OUTPUTS_DIR, f"{job_id}.done")
-
-    if acquire_job_lock(job_id) is None: return {"status":"locked"}
-    _progress(job_id, "ingest", 3, {"version": WORKER_VERSION})
+    out_mp4, out_json, out_done, out_plan = output_paths(job_id, mode)
+
+    if _lease(job_id, mode, render_job) is None: return {"status":"locked"}
+    queue_wait_s=metrics.queue_wait(render_job.request)
+    clock=_clocks[job_id, mode]=metrics.StageClock()
+    est=estimate("render_job", input_videos(job_dir), target, mode)
+    _progress(job_id, "ingest", 3, {"version": WORKER_VERSION, "mode": mode, "estimate_s": est["predicted_s"]})
     rng = random.Random(job_seed(job_id))
 
     with tempfile.TemporaryDirectory(prefix=f"{job_id}_", dir=OUTPUTS_DIR) as tmpdir:
-        vids, pre_time_s = normalize_inputs(job_dir, tmpdir)
-        _progress(job_id, "normalize", 15, {"clips": len(vids)})
-        audio_proc=prepare_audio(audio_in, tmpdir, target)
-        _progress(job_id, "normalize_audio", 25)
-
-        onsets=aubio_onsets(audio_proc)
-        audio_len=ffprobe_duration(audio_proc)
-        _progress(job_id, "detect_beats", 35, {"onsets": len(onsets)})
-
-        hook_start, hook_end = choose_hook(onsets, rng, max_len_s=1.5)
-        hook_end=min(hook_end, target)
-        beats_after=[t for t in onsets if t > hook_end + 1/PROFILE.fps]
-        if len(beats_after) < 4:
-            beats_after=fallback_beats(audio_len=target, start_offset=hook_end, interval=FALLBACK_INTERVAL_S)
-
-        cut_times=[0.0, hook_end]
-        cut_times += [t for t in beats_after if t <= target]
-        if cut_times[-1] < target - 1e-3: cut_times.append(target)
-        cut_times=sorted(set([round(t,6) for t in cut_times if 0 <= t <= target]))
-
-        refined=[cut_times[0]]; i=1
-        while i < len(cut_times):
-            last=refined[-1]
-            want_s = (lambda fr: fr/PROFILE.fps)(lengths_distribution(rng))
-            desired_end=last + want_s
-            nb=min(cut_times[1:], key=lambda b: abs(b - desired_end)) if len(cut_times)>1 else desired_end
-            if nb <= last + (2/PROFILE.fps):
-                j=i
-                while j < len(cut_times) and cut_times[j] <= last + (2/PROFILE.fps): j+=1
-                if j >= len(cut_times): break
-                refined.append(cut_times[j]); i=j+1
+        vids, pre_time_s, norm_stats = normalize_inputs(job_dir, tmpdir, prof, enc)
+        _progress(job_id, "normalize", 15, {"clips": len(vids), "pre_time_s": round(pre_time_s,3)})
+
+        plan=load_plan(out_plan, target, len(vids))
+        reused=plan is not None
+        if reused:
+            audio_proc, _ = prepare_audio(audio_in, tmpdir, target, measured=plan.get("loudnorm"))
+            _progress(job_id, "plan", 50, {"cuts": len(plan["shots"]), "plan": "reused"})
+        else:
+            akey=analysis_key(audio_in, target)
+            cached=analysis_cache.load(akey)
+            audio_proc, loud=prepare_audio(audio_in, tmpdir, target, measured=(cached or {}).get("loudnorm"))
+            _progress(job_id, "normalize_audio", 25, {"analysis_cache": "hit" if cached else "miss"})
+
+            probe.probe_many(vids + [audio_proc])  # jedna równoległa runda ffprobe na wszystkie wejścia
+            if cached: onsets=cached["onsets"]
             else:
-                refined.append(nb)
-                while i < len(cut_times) and cut_times[i] <= nb + 1e-6: i+=1
-
-        if refined[-1] < target - 1e-3: refined.append(target)
-
-        order=assign_shots(vids, rng, n=max(1, len(refined)-1))
-        _progress(job_id, "plan", 50, {"cuts": len(refined)-1})
-
-        segments=[]; cutlog=[]
-        for idx in range(len(refined)-1):
-            t0=refined[idx]; t1=refined[idx+1]
-            src=vids[order[idx]]
-            src_len=ffprobe_duration(src)
-            want=max(1/PROFILE.fps, t1-t0)
-            s0,s1,need_rev=smart_span_adjust(src_len, want, rng)
-            seg_path=os.path.join(tmpdir, f"seg_{idx:03d}.mp4")
-            cut_segment(src, s0, s1, seg_path)
-            if need_rev and (s1-s0) < want - (1/PROFILE.fps):
-                seg_rev=os.path.join(tmpdir, f"seg_{idx:03d}_r.mp4")
-                run(f'ffmpeg -y -i "{seg_path}" -vf "reverse,fps={PROFILE.fps},format={PROFILE.pix_fmt}" -an -c:v libx264 -preset veryfast -crf 18 "{seg_rev}"')
-                lst=os.path.join(tmpdir, f"seg_{idx:03d}.lst")
-                with open(lst,"w") as f:
-                    f.write(f"file '{seg_path}'\n"); f.write(f"file '{seg_rev}'\n")
-                run(f'ffmpeg -y -f concat -safe 0 -i "{lst}" -c:v libx264 -preset veryfast -crf 18 -pix_fmt {PROFILE.pix_fmt} -r {PROFILE.fps} "{seg_path}"')
-
-            segments.append(seg_path)
-            beat_ref = min(onsets, key=lambda b: abs(b - t1)) if onsets else t1
-            cutlog.append(cut_log_line(idx, t0, t1, beat_ref))
-
-        _progress(job_id, "cut", 70)
-
-        with open(out_tmpl, "w") as f:
-            for p in segments: f.write(f"file '{p}'\n")
-        concat_segments(out_tmpl, out_tmpv)
-        _progress(job_id, "mux_prep", 80)
-
-        mux_with_audio(out_tmpv, audio_proc, out_mp4, target)
+                res=analyze_audio(audio_proc); onsets=res["onsets"]
+                analysis_cache.store(akey, loudnorm=loud, **res)
+            _progress(job_id, "detect_beats", 35, {"onsets": len(onsets)})
+
+            plan=plan_timeline(onsets, target, [ffprobe_duration(v) for v in vids], rng)
+            plan.update({"clips": len(vids), "loudnorm": loud, "worker_version": WORKER_VERSION,
+                         "mezzanine": MEZZANINE_MODE, "analysis_cache": "hit" if cached else "miss"})
+            save_plan(out_plan, plan)
+            _progress(job_id, "plan", 50, {"cuts": len(plan["shots"])})
+
+        shots=[dict(sh, src=vids[sh["clip"]]) for sh in plan["shots"]]
+        part=os.path.join(tmpdir, os.path.basename(out_mp4))
+        assembly=assemble(shots, audio_proc, part, target, tmpdir, prof, enc, job_id)
+        _publish(_leases[job_id, mode], part, out_mp4)
         _progress(job_id, "finalize", 95)
 
-        d_out=ffprobe_duration(out_mp4)
-        qa={
+        clock.mark("qa")
+        qa=qa_report(job_id, out_mp4, mode, prof, enc, plan, reused, assembly, t_start,
+                     encodes=clock.counters.encodes, pre_time_s=round(pre_time_s,3), normalize=norm_stats, stages=clock.summary(),
+                     queue_wait_s=None if queue_wait_s is None else round(queue_wait_s,3), estimate=est)
+        write_qa(out_json, out_done, qa)
+        learn(qa)
+
+    _unlease(job_id, mode)
+    _progress(job_id, "done", 100, {"out": out_mp4})
+    return {"status":"ok","job_id":job_id,"mode":mode,"out":out_mp4,"qa":out_json}
+
+# --- batch wariantów: jedno ingest/normalizacja/analiza, N planów i składań (różne seed/target/shuffle) ---
+
+def variant_specs(job_id: str, variants: list[dict]) -> list[dict]:
+    if not variants or len(variants) > BATCH_MAX_VARIANTS:
+        raise ValueError(f"Liczba wariantów poza zakresem 1..{BATCH_MAX_VARIANTS}")
+    specs=[]; names=set()
+    for i, v in enumerate(variants):
+        name="".join(c for c in str(v.get("name") or "") if c.isalnum() or c in "-_")[:40] or f"v{i:02d}"
+        if name in names: name=f"{name}-{i:02d}"
+        names.add(name)
+        target=float(v.get("target_duration_s") or TARGET_DEFAULT_S)
+        if target <= 0: raise ValueError(f"Wariant {name}: target_duration_s <= 0")
+        seed=v.get("seed")
+        specs.append({"name": name, "target": target, "shuffle": bool(v.get("shuffle", True)),
+                      "seed": job_seed(job_id) if seed is None else int(seed)})  # bez seed = plan jak w render_job
+    return specs
+
+def batch_pool_size(n_variants: int) -> int:
+    return max(1, min(n_variants, BATCH_WORKERS or max(1, _cpu_count() // 4)))
+
+@shared_task(name="render_batch")
+def render_batch(job_id: str, variants: list[dict], mode: str = "final") -> dict:
+    _mode.set(mode)
+    try:
+        with metrics.job_counters():
+            return _render_batch(job_id, variants, mode)
+    except LeaseLost:
+        raise
+    except Exception as e:
+        _progress(job_id, "error", None, {"error": f"{type(e).__name__}: {e}"[:500]})
+        raise
+    finally:
+        _clocks.pop((job_id, mode), None)
+        _unlease(job_id, mode)
+
+def _render_batch(job_id: str, variants: list[dict], mode: str) -> dict:
+    t_start=time.time()
+    if mode not in RENDER_MODES: raise ValueError(f"Nieznany tryb renderu: {mode}")
+    prof, enc = RENDER_MODES[mode]
+    specs=variant_specs(job_id, variants)
+    job_dir=os.path.join(SHARED_DIR, job_id)
+    audio_in=job_audio(job_dir)
+
+    os.makedirs(OUTPUTS_DIR, exist_ok=True)
+    base=f"{job_id}.batch" if mode == "final" else f"{job_id}.{mode}.batch"
+    out_json=os.path.join(OUTPUTS_DIR, f"{base}.json")
+    out_done=os.path.join(OUTPUTS_DIR, f"{base}.done")
+
+    lease=_lease(job_id, mode, render_batch)
+    if lease is None: return {"status":"locked"}
+    queue_wait_s=metrics.queue_wait(render_batch.request)
+    clock=_clocks[job_id, mode]=metrics.StageClock()
+    _progress(job_id, "ingest", 3, {"version": WORKER_VERSION, "mode": mode, "variants": len(specs)})
+
+    with tempfile.TemporaryDirectory(prefix=f"{job_id}_", dir=OUTPUTS_DIR) as tmpdir:
+        vids, pre_time_s, norm_stats = normalize_inputs(job_dir, tmpdir, prof, enc)
+        _progress(job_id, "normalize", 15, {"clips": len(vids), "pre_time_s": round(pre_time_s,3)})
+
+        # najdłuższy target: pomiar loudnorm + analiza; krótsze dostają liniowy loudnorm z tym samym pomiarem
+        targets=sorted({sp["target"] for sp in specs}, reverse=True)
+        akey=analysis_key(audio_in, targets[0])
+        cached=analysis_cache.load(akey)
+        adirs={t: os.path.join(tmpdir, f"audio_{k:02d}") for k, t in enumerate(targets)}
+        for d in adirs.values(): os.makedirs(d)
+        audio={}
+        audio[targets[0]], loud = prepare_audio(audio_in, adirs[targets[0]], targets[0], measured=(cached or {}).get("loudnorm"))
+        with metrics.Executor(max_workers=batch_pool_size(len(targets))) as ex:
+            for t, (a, _) in zip(targets[1:], ex.map(lambda t: prepare_audio(audio_in, adirs[t], t, measured=loud), targets[1:])):
+                audio[t]=a
+        _progress(job_id, "normalize_audio", 25, {"analysis_cache": "hit" if cached else "miss", "targets": len(targets)})
+
+        probe.probe_many(vids + list(audio.values()))
+        if cached: onsets=cached["onsets"]
+        else:
+            res=analyze_audio(audio[targets[0]]); onsets=res["onsets"]
+            analysis_cache.store(akey, loudnorm=loud, **res)
+        src_lens=[ffprobe_duration(v) for v in vids]
+        _progress(job_id, "detect_beats", 35, {"onsets": len(onsets)})
+        shared_s=round(time.time()-t_start,3)
+
+        def one(k: int, sp: dict) -> dict:
+            v0=time.time()
+            vbase=f"{job_id}.{sp['name']}" if mode == "final" else f"{job_id}.{mode}.{sp['name']}"
+            out_mp4=os.path.join(OUTPUTS_DIR, f"{vbase}.mp4"); out_qa=os.path.join(OUTPUTS_DIR, f"{vbase}.json")
+            target=sp["target"]
+            # pojedynczy render widzi audio przycięte do target+0.2 – te same onsety
+            plan=plan_timeline([t for t in onsets if t <= target + 0.2], target, src_lens,
+                               random.Random(sp["seed"]), shuffle=sp["shuffle"])
+            vdir=os.path.join(tmpdir, f"variant_{k:02d}"); os.makedirs(vdir)
+            shots=[dict(sh, src=vids[sh["clip"]]) for sh in plan["shots"]]
+            part=os.path.join(vdir, os.path.basename(out_mp4))
+            assembly=assemble(shots, audio[target], part, target, vdir, prof, enc, None)
+            _publish(lease, part, out_mp4)
+            qa=qa_report(job_id, out_mp4, mode, prof, enc, plan, False, assembly, v0, variant=sp["name"],
+                         target_s=target, seed=sp["seed"], shuffle=sp["shuffle"], shared_s=shared_s,
+                         analysis_cache="hit" if cached else "miss")
+            qa["assembly_s"]=qa.pop("elapsed_s")
+            with open(out_qa,"w") as f: json.dump(qa,f,ensure_ascii=False,indent=2)
+            return {"name": sp["name"], "status": "ok", "out": out_mp4, "qa": out_qa, "assembly_s": qa["assembly_s"]}
+
+        results=[None]*len(specs); done=0
+        with metrics.Executor(max_workers=batch_pool_size(len(specs))) as ex:
+            futs={ex.submit(one, k, sp): k for k, sp in enumerate(specs)}
+            for fut in as_completed(futs):
+                k=futs[fut]
+                try: results[k]=fut.result()
+                except Exception as e:  # jeden zepsuty wariant nie przerywa pozostałych
+                    results[k]={"name": specs[k]["name"], "status": "error", "error": f"{type(e).__name__}: {e}"[:500]}
+                done+=1
+                _progress(job_id, "variants", 35 + 60*done//len(specs), {"done": done, "total": len(specs), "variant": specs[k]["name"]})
+
+        clock.mark("qa")
+        ok=sum(r["status"] == "ok" for r in results)
+        summary={
             "job_id": job_id,
-            "out": out_mp4,
-            "duration_s": round(d_out,3),
-            "profile": f"{PROFILE.width}x{PROFILE.height}@{PROFILE.fps}",
-            "cuts": len(refined)-1,
-            "onsets": len(onsets),
-            "hook": {"start_s": round(hook_start,3), "end_s": round(hook_end,3)},
-            "cutlog": cutlog[:500],
+            "mode": mode,
+            "status": "ok" if ok == len(results) else "partial" if ok else "error",
+            "variants": results,
+            "pre_time_s": round(pre_time_s,3),
+            "normalize": norm_stats,
+            "shared_s": shared_s,
+            "stages": clock.summary(),
+            "queue_wait_s": None if queue_wait_s is None else round(queue_wait_s,3),
             "elapsed_s": round(time.time()-t_start,3),
             "timestamp": datetime.datetime.utcnow().isoformat()+"Z",
             "worker_version": WORKER_VERSION
         }
-        with open(out_json,"w") as f: json.dump(qa,f,ensure_ascii=False,indent=2)
+        with open(out_json,"w") as f: json.dump(summary,f,ensure_ascii=False,indent=2)
         pathlib.Path(out_done).touch()
 
-    release_job_lock(job_id)
-    _progress(job_id, "done", 100)
-    return {"status":"ok","job_id":job_id,"out":out_mp4,"qa":out_json}
+    _unlease(job_id, mode)
+    if ok: _progress(job_id, "done", 100, {"variants_ok": ok, "variants": len(results)})
+    else: _progress(job_id, "error", None, {"error": "all variants failed"})
+    return {"status": summary["status"], "job_id": job_id, "mode": mode, "variants": results, "summary": out_json}
+
+# --- rozproszony DAG: chord(normalizacja per klip | audio+analiza) -> plan -> składanie ---
+# Subtaski mogą trafić na różne nody; wyniki przekazywane jako ścieżki na wolumenie współdzielonym
+# (SHARED_DIR/<job>/.work/<mode>/), postęp joba = ukończone jednostki nagłówka z licznika w hashu job:<id>.
+
+def dag_workdir(job_id: str, mode: str) -> str:
+    return os.path.join(SHARED_DIR, job_id, ".work", mode)
+
+def _unit_done(job_id: str, total: int, stage: str, extra: dict) -> None:
+    done=progress.incr(job_id, "units_done")
+    _progress(job_id, stage, 3 + 47*min(done, total)//total, dict(extra, units=f"{done}/{total}"))
+
+# lease DAG-u (TTL LOCK_TTL_S) krąży w argumentach kroków; każdy krok odnawia go na czas swojej pracy,
+# a gdy wygasł w kolejce między krokami i nikt go nie wziął – odzyskuje (Lease.reclaim)
+def _held(lease: dict | None):
+    return Lease.from_dict(lease) if lease else contextlib.nullcontext()
+
+@shared_task(name="render_dag.normalize_clip")
+def dag_normalize_clip(job_id: str, idx: int, src: str, n_clips: int, mode: str, lease: dict | None = None) -> dict:
+    prof, enc = RENDER_MODES[mode]
+    dst=os.path.join(dag_workdir(job_id, mode), f"norm_{idx:02d}.mp4")
+    t0=time.time()
+    with _held(lease):
+        hit=normalize_one(src, dst, normalize_pool_shape(n_clips)[1], prof, enc)
+    _unit_done(job_id, n_clips+1, "normalize", {"clip": idx})
+    return {"idx": idx, "path": dst, "s": round(time.time()-t0,3), "cache_hit": hit, "node": socket.gethostname()}
+
+@shared_task(name="render_dag.audio")
+def dag_audio(job_id: str, target: float, n_clips: int, mode: str, measured: dict | None = None,
+              analyze: bool = True, lease: dict | None = None) -> dict:
+    t0=time.time()
+    wd=os.path.join(dag_workdir(job_id, mode), "audio"); os.makedirs(wd, exist_ok=True)
+    audio_in=job_audio(os.path.join(SHARED_DIR, job_id))
+    akey=analysis_key(audio_in, target)
+    cached=analysis_cache.load(akey) if analyze else None
+    with _held(lease):
+        audio_proc, loud=prepare_audio(audio_in, wd, target, measured=measured or (cached or {}).get("loudnorm"))
+        onsets=None
+        if cached: onsets=cached["onsets"]
+        elif analyze:
+            res=analyze_audio(audio_proc); onsets=res["onsets"]
+            analysis_cache.store(akey, loudnorm=loud, **res)
+    _unit_done(job_id, n_clips+1, "detect_beats", {"onsets": -1 if onsets is None else len(onsets)})
+    return {"audio": audio_proc, "loudnorm": loud, "onsets": onsets, "s": round(time.time()-t0,3),
+            "analysis_cache": "hit" if cached else "miss" if analyze else "skipped", "node": socket.gethostname()}
+
+@shared_task(name="render_dag.plan")
+def dag_plan(results: list[dict], job_id: str, target: float, mode: str, lease: dict | None = None) -> dict:
+    clips=sorted((r for r in results if "idx" in r), key=lambda r: r["idx"])
+    aud=next(r for r in results if "audio" in r)
+    vids=[c["path"] for c in clips]
+    out_plan=output_paths(job_id, mode)[3]
+    plan=load_plan(out_plan, target, len(vids))
+    reused=plan is not None
+    if not reused:
+        with _held(lease):
+            probe.probe_many(vids + [aud["audio"]])
+            # plan zniknął między zleceniem a tym krokiem – analiza tutaj
+            onsets=aud["onsets"] if aud["onsets"] is not None else analyze_audio(aud["audio"])["onsets"]
+            plan=plan_timeline(onsets, target, [ffprobe_duration(v) for v in vids], random.Random(job_seed(job_id)))
+            plan.update({"clips": len(vids), "loudnorm": aud["loudnorm"], "worker_version": WORKER_VERSION,
+                         "mezzanine": MEZZANINE_MODE, "analysis_cache": aud["analysis_cache"]})
+            save_plan(out_plan, plan)
+    _progress(job_id, "plan", 55, {"cuts": len(plan["shots"]), **({"plan": "reused"} if reused else {})})
+    return {"vids": vids, "audio": aud["audio"], "plan_reused": reused,
+            "dag": {"clips": [{k: c[k] for k in ("idx", "s", "cache_hit", "node")} for c in clips],
+                    "audio": {k: aud[k] for k in ("s", "analysis_cache", "node")}}}
+
+@shared_task(name="render_dag.assemble")
+def dag_assemble(planned: dict, job_id: str, target: float, mode: str, t_start: float, est: dict | None = None,
+                 lease: dict | None = None) -> dict:
+    prof, enc = RENDER_MODES[mode]
+    out_mp4, out_json, out_done, out_plan = output_paths(job_id, mode)
+    with open(out_plan) as f: plan=json.load(f)
+    shots=[dict(sh, src=planned["vids"][sh["clip"]]) for sh in plan["shots"]]
+    wd=dag_workdir(job_id, mode)
+    # składanie w OUTPUTS_DIR – rename wyniku w obrębie jednego systemu plików
+    with _held(lease), tempfile.TemporaryDirectory(prefix=f"{job_id}_", dir=OUTPUTS_DIR) as tmpdir:
+        part=os.path.join(tmpdir, os.path.basename(out_mp4))
+        assembly=assemble(shots, planned["audio"], part, target, tmpdir, prof, enc, job_id)
+        _publish(lease, part, out_mp4)
+    _progress(job_id, "finalize", 95)
+    dag=dict(planned["dag"], nodes=sorted({c["node"] for c in planned["dag"]["clips"]} | {socket.gethostname()}))
+    qa=qa_report(job_id, out_mp4, mode, prof, enc, plan, planned["plan_reused"], assembly, t_start, dag=dag, estimate=est)
+    write_qa(out_json, out_done, qa)
+    learn(qa)
+    shutil.rmtree(wd, ignore_errors=True)
+    if lease: Lease.from_dict(lease).release()
+    _progress(job_id, "done", 100, {"out": out_mp4})
+    return {"status":"ok","job_id":job_id,"mode":mode,"out":out_mp4,"qa":out_json}
+
+@shared_task(name="render_dag.failed")
+def dag_failed(request, exc, traceback, job_id: str, mode: str, lease: dict | None = None) -> None:
+    held = Lease.from_dict(lease) if lease else None
+    # job przejął inny render – jego katalog roboczy i zdarzenia; samo wygaśnięcie lease to zwykły błąd joba
+    if isinstance(exc, LeaseLost) and held is not None and _superseded(held): return
+    shutil.rmtree(dag_workdir(job_id, mode), ignore_errors=True)
+    if held is not None: held.release()
+    _progress(job_id, "error", None, {"error": f"{type(exc).__name__}: {exc}"[:500]})
+
+def _superseded(lease: Lease) -> bool:
+    try: return lease.superseded()
+    except Exception: return False  # Redis niedostępny: lepiej zdarzenie error niż wiszący job
+
+def render_dag(job_id: str, target: float, mode: str, vids_in: list[str], plan: dict | None, est: dict | None = None,
+               lease: dict | None = None):
+    n=len(vids_in)
+    header=group([dag_normalize_clip.s(job_id, i, src, n, mode, lease=lease) for i, src in enumerate(vids_in)]
+                 + [dag_audio.s(job_id, target, n, mode, measured=(plan or {}).get("loudnorm"), analyze=plan is None,
+                                lease=lease)])
+    body=chain(dag_plan.s(job_id, target, mode, lease=lease),
+               dag_assemble.s(job_id, target, mode, time.time(), est, lease=lease))
+    return chord(header, body).on_error(dag_failed.s(job_id=job_id, mode=mode, lease=lease))
+
+@shared_task(name="render_job_dag", bind=True)
+def render_job_dag(self, job_id: str, target_duration_s: float | None = None, mode: str = "final") -> dict:
+    if mode not in RENDER_MODES: raise ValueError(f"Nieznany tryb renderu: {mode}")
+    target=float(target_duration_s or TARGET_DEFAULT_S)
+    job_dir=os.path.join(SHARED_DIR, job_id)
+    vids_in=input_videos(job_dir); job_audio(job_dir)
+    lease=acquire_lease(lease_name(job_id, mode), task_id=self.request.id, ttl_s=LOCK_TTL_S)
+    if lease is None: return {"status":"locked"}
+    est=estimate("render_job_dag", vids_in, target, mode)
+    _progress(job_id, "ingest", 3, {"version": WORKER_VERSION, "mode": mode, "dag": len(vids_in), "units_done": 0,
+                                    "estimate_s": est["predicted_s"]})
+    os.makedirs(dag_workdir(job_id, mode), exist_ok=True)
+    plan=load_plan(output_paths(job_id, mode)[3], target, len(vids_in))
+    # ten task zostaje podmieniony na chord – jego wynik (task_id dla API) = wynik dag_assemble
+    return self.replace(render_dag(job_id, target, mode, vids_in, plan, est, lease.as_dict()))
@@ -0,0 +1,116 @@
+from __future__ import annotations
+import subprocess
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from worker.config import (
+    ANALYSIS_SR, ANALYSIS_FRAME, ANALYSIS_HOP, ANALYSIS_BLOCK_S, MIN_CUT_GAP_S, AUBIO_THRESHOLD
+)
+from worker.utils.beatgrid import BeatGrid
+
+# Analiza onsetów/beatów w procesie: audio dekodowane raz (ffmpeg -> mono float32 @ ANALYSIS_SR)
+# i przetwarzane blokami stałej długości, więc pamięć na próbki nie zależy od długości utworu.
+# Z bloków liczone są spectral flux i RMS na ramkę (hop); onsety = piki fluxu nad lokalną średnią,
+# beaty = siatka tempa z autokorelacji fluxu dociągnięta do najbliższych onsetów.
+
+@dataclass
+class Analysis:
+    onsets: list[float]
+    beats: list[float]
+    tempo: float
+    duration_s: float
+    env_rate: float
+    rms: np.ndarray = field(repr=False)
+    flux: np.ndarray = field(repr=False)
+
+def decode_blocks(path: str, sr: int = ANALYSIS_SR, block_s: float = ANALYSIS_BLOCK_S,
+                  max_duration_s: float | None = None) -> Iterator[np.ndarray]:
+    cmd = ["ffmpeg", "-nostdin", "-v", "error", "-i", path]
+    if max_duration_s: cmd += ["-t", f"{max_duration_s:.6f}"]
+    cmd += ["-vn", "-ac", "1", "-ar", str(sr), "-f", "f32le", "-"]
+    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    nbytes = max(1, int(block_s * sr)) * 4
+    try:
+        while True:
+            buf = p.stdout.read(nbytes)
+            if not buf: break
+            yield np.frombuffer(buf[: len(buf) - len(buf) % 4], dtype="<f4")
+    finally:
+        p.stdout.close()
+        err = p.stderr.read().decode("utf-8", "ignore"); p.stderr.close()
+        if p.wait() != 0: raise RuntimeError(f"[DECODE_FAIL] {path}: {err.strip()[-2000:]}")
+
+def _frames_features(blocks: Iterable[np.ndarray], frame: int, hop: int) -> tuple[np.ndarray, np.ndarray, int]:
+    win = np.hanning(frame).astype(np.float32)
+    carry = np.zeros(frame // 2, dtype=np.float32)  # ramka k wycentrowana w k*hop
+    prev = None; flux = []; rms = []; n = 0
+    for block in blocks:
+        n += block.size
+        buf = np.concatenate([carry, block.astype(np.float32, copy=False)])
+        if buf.size < frame: carry = buf; continue
+        fr = sliding_window_view(buf, frame)[::hop]
+        mag = np.log1p(100.0 * np.abs(np.fft.rfft(fr * win, axis=1))).astype(np.float32)
+        before = np.vstack([mag[:1] if prev is None else prev[None, :], mag[:-1]])
+        flux.append(np.maximum(mag - before, 0.0).sum(axis=1))
+        rms.append(np.sqrt(np.mean(fr * fr, axis=1)))
+        prev = mag[-1]
+        carry = buf[fr.shape[0] * hop:]
+    if not flux: return np.zeros(0, np.float32), np.zeros(0, np.float32), n
+    return np.concatenate(flux).astype(np.float32), np.concatenate(rms).astype(np.float32), n
+
+def pick_peaks(env: np.ndarray, rate: float, threshold: float, min_gap_s: float) -> list[float]:
+    if env.size < 3: return []
+    w = max(1, int(round(0.05 * rate)))   # lokalne maksimum w ±50 ms
+    m = max(1, int(round(0.25 * rate)))   # średnia adaptacyjna w ±250 ms
+    x = env / (float(env.max()) or 1.0)
+    padded = np.pad(x, w, mode="edge")
+    is_max = x >= sliding_window_view(padded, 2 * w + 1).max(axis=1)
+    cs = np.concatenate([[0.0], np.cumsum(np.pad(x, m, mode="edge"), dtype=np.float64)])
+    local_mean = (cs[2 * m + 1:] - cs[: -(2 * m + 1)]) / (2 * m + 1)
+    cand = np.flatnonzero(is_max & (x - local_mean >= threshold * float(x.std())) & (x > 0))
+    out = []; last = -1e9
+    for t in (cand / rate).tolist():
+        if t - last >= min_gap_s: out.append(round(t, 6)); last = t
+    return out
+
+def estimate_beats(flux: np.ndarray, rate: float, onsets: list[float],
+                   bpm_min: float = 60.0, bpm_max: float = 180.0) -> tuple[float, list[float]]:
+    lo, hi = int(rate * 60.0 / bpm_max), int(rate * 60.0 / bpm_min)
+    if flux.size < 2 * hi or lo < 1: return 0.0, []
+    x = flux - flux.mean()
+    spec = np.fft.rfft(x, n=2 * x.size)
+    acf = np.fft.irfft(spec * np.conj(spec))[: x.size]
+    lags = np.arange(lo, hi + 1)
+    # prior log-normalny wokół 120 BPM (jak w librosa) – tłumi błędy oktawowe tempa
+    prior = np.exp(-0.5 * np.log2(60.0 * rate / lags / 120.0) ** 2)
+    score = acf[lo:hi + 1] * prior
+    k = int(np.argmax(score))
+    period = float(lags[k])
+    if 0 < k < score.size - 1:  # interpolacja paraboliczna – okres nie musi być całkowitą liczbą hopów
+        a, b, c = score[k - 1], score[k], score[k + 1]
+        den = a - 2 * b + c
+        if den: period += float(0.5 * (a - c) / den)
+    lag = int(round(period))
+    phase = int(np.argmax([flux[o::lag].sum() for o in range(lag)]))
+    # siatka prowadzona onsetami: każdy kolejny beat = poprzedni + okres, dociągnięty do onsetu w ±okres/4
+    step = period / rate; og = BeatGrid(onsets)
+    beats = []; t = phase / rate; end = flux.size / rate
+    while t < end:
+        t = og.snap(t, step / 4) if og else t
+        beats.append(round(t, 6)); t += step
+    return round(60.0 / step, 3), beats
+
+def analyze_blocks(blocks: Iterable[np.ndarray], sr: int = ANALYSIS_SR, frame: int = ANALYSIS_FRAME,
+                   hop: int = ANALYSIS_HOP, threshold: float | None = None,
+                   min_gap_s: float = MIN_CUT_GAP_S) -> Analysis:
+    flux, rms, n = _frames_features(blocks, frame, hop)
+    rate = sr / hop
+    thr = float(AUBIO_THRESHOLD) if threshold is None else threshold
+    onsets = pick_peaks(flux, rate, thr, min_gap_s)
+    tempo, beats = estimate_beats(flux, rate, onsets)
+    return Analysis(onsets=onsets, beats=beats, tempo=tempo, duration_s=n / sr, env_rate=rate, rms=rms, flux=flux)
+
+def analyze(path: str, max_duration_s: float | None = None, **kw) -> Analysis:
+    sr = kw.pop("sr", ANALYSIS_SR)
+    return analyze_blocks(decode_blocks(path, sr=sr, max_duration_s=max_duration_s), sr=sr, **kw)
@@ -0,0 +1,53 @@
+import os, json, hashlib, threading
+import numpy as np
+from worker.config import ANALYSIS_CACHE_DIR, ANALYSIS_CACHE_MAX_MB
+from worker.utils import media_store
+from worker.utils.diskcache import CacheStats, file_sha256, touch, evict_lru
+
+# Artefakty analizy audio w .npz na wolumenie współdzielonym, klucz = sha256(treść utworu)
+# + parametry analizy. Tablice (onsets, beats, rms) idą jako tablice, reszta (tempo,
+# env_rate, pomiar loudnorm) jako JSON w polu "meta" – bez pickle przy odczycie.
+
+_stats = CacheStats("analysiscache:stats")
+_ARRAYS = ("onsets", "beats", "rms")
+
+def enabled() -> bool: return ANALYSIS_CACHE_MAX_MB > 0
+
+def cache_key(audio_path: str, content_hash: str | None = None, **params) -> str:
+    ident = json.dumps({"sha256": content_hash or media_store.content_hash(audio_path) or file_sha256(audio_path), **params}, sort_keys=True, default=str)
+    return hashlib.sha256(ident.encode()).hexdigest()
+
+def _entry(key: str) -> str: return os.path.join(ANALYSIS_CACHE_DIR, key[:2], f"{key}.npz")
+
+def load(key: str) -> dict | None:
+    if not enabled(): return None
+    entry = _entry(key)
+    try:
+        with np.load(entry, allow_pickle=False) as z:
+            out = json.loads(str(z["meta"]))
+            for name in _ARRAYS:
+                if name in z.files: out[name] = z[name]
+    except (FileNotFoundError, ValueError, KeyError, OSError):
+        _stats.count("misses"); return None
+    touch(entry); _stats.count("hits")
+    for name in ("onsets", "beats"):
+        if name in out: out[name] = out[name].tolist()
+    return out
+
+def store(key: str, **artifacts) -> None:
+    if not enabled(): return
+    entry = _entry(key)
+    os.makedirs(os.path.dirname(entry), exist_ok=True)
+    arrays = {k: np.asarray(artifacts[k], dtype=np.float32 if k == "rms" else np.float64)
+              for k in _ARRAYS if artifacts.get(k) is not None}
+    meta = {k: v for k, v in artifacts.items() if k not in _ARRAYS}
+    tmp = f"{entry}.{os.getpid()}.{threading.get_ident()}.tmp.npz"
+    try:
+        with open(tmp, "wb") as f: np.savez_compressed(f, meta=np.array(json.dumps(meta)), **arrays)
+        os.replace(tmp, entry)  # atomowo – inne procesy widzą stary albo kompletny wpis
+    finally:
+        if os.path.exists(tmp): os.remove(tmp)
+    _stats.count("evicted", evict_lru(ANALYSIS_CACHE_DIR, ANALYSIS_CACHE_MAX_MB * 1024 * 1024, ".npz"))
+
+def stats() -> dict:
+    return _stats.snapshot()
@@ -0,0 +1,71 @@
+from __future__ import annotations
+import math, resource
+from typing import Iterator
+import numpy as np
+import soundfile as sf
+from worker.utils.analysis import decode_blocks
+from worker.utils import probe
+
+# Ładowanie audio do analizy bez trzymania całego pliku w pamięci: odczyt blokami,
+# downmix do mono i resampling przyrostowo, z opcjonalnym limitem długości.
+# WAV/FLAC/OGG idą przez soundfile (bloki czytane z pliku; mmap odpada, bo dotknięte
+# strony mapowania liczą się do RSS), pozostałe formaty przez potok ffmpeg.
+
+BLOCK_FRAMES = 65536
+
+class _StreamResampler:
+    # liniowa interpolacja z filtrem uśredniającym (anti-alias) – stan przenoszony między blokami
+    def __init__(self, sr_in: int, sr_out: int):
+        self.step = sr_in / sr_out
+        self.width = max(1, int(math.ceil(self.step))) if sr_out < sr_in else 1
+        self.tail = np.zeros(self.width - 1, dtype=np.float32)
+        self.pos = (self.width - 1) / 2  # kompensacja opóźnienia filtra uśredniającego
+        self.n0 = 0         # indeks pierwszej próbki bieżącego bloku
+        self.last = None
+
+    def __call__(self, x: np.ndarray) -> np.ndarray:
+        if self.width > 1:
+            ext = np.concatenate([self.tail, x])
+            cs = np.concatenate([[0.0], np.cumsum(ext, dtype=np.float64)])
+            y = ((cs[self.width:] - cs[:-self.width]) / self.width).astype(np.float32)
+            self.tail = ext[-(self.width - 1):]
+        else:
+            y = x
+        if self.last is None:
+            idx = np.arange(self.n0, self.n0 + y.size, dtype=np.float64); vals = y
+        else:
+            idx = np.arange(self.n0 - 1, self.n0 + y.size, dtype=np.float64); vals = np.concatenate([[self.last], y])
+        end = self.n0 + y.size - 1
+        n = int(math.floor((end - self.pos) / self.step)) + 1 if end >= self.pos else 0
+        t = self.pos + self.step * np.arange(n)
+        out = np.interp(t, idx, vals).astype(np.float32)
+        self.pos += self.step * n; self.n0 += y.size; self.last = float(y[-1]) if y.size else self.last
+        return out
+
+def iter_mono(path: str, sr: int, max_duration_s: float | None = None) -> Iterator[np.ndarray]:
+    try:
+        f = sf.SoundFile(path)
+    except Exception:
+        yield from decode_blocks(path, sr=sr, max_duration_s=max_duration_s)  # ffmpeg robi downmix + resampling
+        return
+    with f:
+        left = int(max_duration_s * f.samplerate) if max_duration_s else f.frames
+        rs = _StreamResampler(f.samplerate, sr) if f.samplerate != sr else None
+        for block in f.blocks(blocksize=BLOCK_FRAMES, dtype="float32", always_2d=True):
+            if left <= 0: break
+            mono = block[:left].mean(axis=1, dtype=np.float32)
+            left -= mono.size
+            yield rs(mono) if rs else mono
+
+def load_mono(path: str, sr: int, max_duration_s: float | None = None) -> np.ndarray:
+    dur = probe.duration(path) if not max_duration_s else max_duration_s
+    if dur:  # prealokacja zamiast listy bloków + concatenate (brak drugiej pełnej kopii)
+        out = np.empty(int(math.ceil(dur * sr)) + sr, dtype=np.float32); n = 0
+        for b in iter_mono(path, sr, max_duration_s):
+            if n + b.size > out.size: out = np.resize(out, n + b.size + sr)
+            out[n:n + b.size] = b; n += b.size
+        return out[:n].copy() if n < out.size // 2 else out[:n]
+    return np.concatenate(list(iter_mono(path, sr, max_duration_s)) or [np.zeros(0, np.float32)])
+
+def peak_rss_mb() -> float:
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1)
@@ -0,0 +1,62 @@
+from __future__ import annotations
+from typing import Iterable
+import numpy as np
+
+# Posortowana siatka czasów (beaty / onsety) z zapytaniami O(log n) przez searchsorted
+# i wsadowymi (wektorowymi) wariantami dla synchronizacji cięć. Duplikaty są zachowane,
+# żeby liczniki w oknach zgadzały się z dotychczasowym energy_density.
+
+def _arr(xs: Iterable[float] | np.ndarray) -> np.ndarray:
+    return np.asarray(xs if isinstance(xs, np.ndarray) else list(xs), dtype=np.float64)
+
+class BeatGrid:
+    __slots__ = ("t",)
+
+    def __init__(self, times: Iterable[float] | np.ndarray):
+        self.t = np.sort(_arr(times))
+
+    def __len__(self) -> int: return int(self.t.size)
+    def __bool__(self) -> bool: return self.t.size > 0
+
+    def nearest_index(self, ts: np.ndarray | float) -> np.ndarray:
+        q = np.asarray(ts, dtype=np.float64)
+        if self.t.size <= 1: return np.zeros(q.shape, dtype=np.int64)
+        hi = np.clip(np.searchsorted(self.t, q, side="left"), 1, self.t.size - 1)
+        lo = hi - 1
+        # remis -> wcześniejszy beat (jak min(..., key=abs))
+        return np.where(q - self.t[lo] <= self.t[hi] - q, lo, hi)
+
+    def nearest(self, t: float) -> float:
+        if not self.t.size: return float(t)
+        return float(self.t[int(self.nearest_index(t))])
+
+    def nearest_many(self, ts: Iterable[float]) -> np.ndarray:
+        q = _arr(ts)
+        if not self.t.size: return q.copy()
+        return self.t[self.nearest_index(q)]
+
+    def snap(self, t: float, tol: float) -> float:
+        nb = self.nearest(t)
+        return nb if abs(nb - t) <= tol else float(t)
+
+    def count_between(self, lo: float, hi: float) -> int:
+        return int(np.searchsorted(self.t, hi, side="right") - np.searchsorted(self.t, lo, side="left"))
+
+    # liczba punktów w [t-w/2, t+w/2] dla każdego punktu siatki
+    def density(self, window: float) -> np.ndarray:
+        h = window / 2
+        return (np.searchsorted(self.t, self.t + h, side="right") - np.searchsorted(self.t, self.t - h, side="left")).astype(np.int64)
+
+    def errors(self, cuts: Iterable[float]) -> np.ndarray:
+        q = _arr(cuts)
+        return np.abs(self.nearest_many(q) - q)
+
+    def sync_ratio(self, cuts: Iterable[float], win: float = 0.05) -> float | None:
+        if not self.t.size: return None
+        e = self.errors(cuts)
+        return float(np.mean(e <= win)) if e.size else None
+
+    def mae(self, cuts: Iterable[float]) -> float | None:
+        if not self.t.size: return None
+        e = self.errors(cuts)
+        return float(np.mean(e)) if e.size else None
@@ -0,0 +1,198 @@
+import os, re, json, time, uuid, fcntl, socket, threading, subprocess
+from contextlib import contextmanager
+from typing import NamedTuple
+import redis
+from worker.config import (REDIS_URL, CPU_BUDGET, CPU_BUDGET_FILE, CPU_FFMPEG_THREADS, CPU_MIN_THREADS,
+                           CPU_AFFINITY)
+from worker.utils import metrics
+
+# Tokenowy budżet CPU węzła dla procesów potomnych: każde uruchomienie ffmpeg dostaje liczbę wątków
+# (-threads / -filter_threads) i opcjonalnie zbiór rdzeni z jednej puli węzła, więc --concurrency=N dzieci Celery
+# i równoległe warianty batcha nie odpalają N×rdzenie wątków libx264. Stan w pliku JSON pod flock (wspólny dla
+# procesów węzła): grants = przydziały, queue = czekający w kolejności zgłoszeń (FIFO, duży ffmpeg nie głodzi się).
+# Przydziały martwych procesów i porzucone zgłoszenia są odzyskiwane przy każdym wejściu pod lock.
+
+POLL_S = (0.02, 0.25)      # backoff odpytywania, gdy budżet wyczerpany
+TICKET_STALE_S = 5.0       # zgłoszenie bez odświeżenia = czekający wątek zniknął
+NODE = socket.gethostname()
+WAIT_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_r = redis.from_url(REDIS_URL, decode_responses=True)
+
+def _cpus() -> list[int]:
+    try: return sorted(os.sched_getaffinity(0))
+    except AttributeError: return list(range(os.cpu_count() or 1))
+
+def total() -> int:
+    return CPU_BUDGET or len(_cpus())
+
+class Grant(NamedTuple):
+    threads: int
+    cpus: tuple[int, ...] | None
+
+    def preexec(self):
+        if not self.cpus: return None
+        cpus = set(self.cpus)
+        return lambda: os.sched_setaffinity(0, cpus)
+
+# --- stan węzła ------------------------------------------------------------
+
+@contextmanager
+def _state():
+    fd = os.open(CPU_BUDGET_FILE, os.O_RDWR | os.O_CREAT, 0o666)
+    with os.fdopen(fd, "r+") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try: st = json.loads(f.read() or "{}")
+        except ValueError: st = {}
+        st.setdefault("grants", {}); st.setdefault("queue", [])
+        _reap(st)
+        yield st
+        f.seek(0); f.truncate(); f.write(json.dumps(st)); f.flush()
+
+def _alive(pid: int) -> bool:
+    try: os.kill(pid, 0)
+    except ProcessLookupError: return False
+    except PermissionError: pass
+    return True
+
+def _reap(st: dict) -> None:
+    now = time.time()
+    st["grants"] = {k: g for k, g in st["grants"].items() if _alive(g["pid"])}
+    st["queue"] = [t for t in st["queue"] if _alive(t["pid"]) and now - t["ts"] < TICKET_STALE_S]
+
+def _used(st: dict) -> int:
+    return sum(g["tokens"] for g in st["grants"].values())
+
+def _try_grant(st: dict, gid: str, want: int) -> Grant | None:
+    budget = total()
+    want = max(1, min(want, budget))
+    ahead = next((i for i, t in enumerate(st["queue"]) if t["id"] == gid), len(st["queue"]))
+    if ahead > 0: return None  # ktoś czeka dłużej
+    free = budget - _used(st)
+    n = min(want, free)
+    if n < min(want, CPU_MIN_THREADS): return None
+    cpus = None
+    if CPU_AFFINITY:
+        taken = {c for g in st["grants"].values() for c in g.get("cpus") or ()}
+        avail = [c for c in _cpus() if c not in taken]
+        if len(avail) < n: n = len(avail)
+        if n < min(want, CPU_MIN_THREADS): return None
+        cpus = tuple(avail[:n])
+    st["grants"][gid] = {"pid": os.getpid(), "tokens": n, "cpus": list(cpus) if cpus else None, "ts": time.time()}
+    st["queue"] = [t for t in st["queue"] if t["id"] != gid]
+    return Grant(n, cpus)
+
+def _report(st: dict) -> None:
+    try: _r.hset("cpubudget:nodes", NODE, json.dumps({"total": total(), "used": _used(st),
+                                                       "waiting": len(st["queue"]), "ts": time.time()}))
+    except Exception: pass
+
+@contextmanager
+def slot(want: int):
+    """Przydział `want` wątków (mniej, gdy budżet prawie pełny – nie mniej niż CPU_MIN_THREADS) na czas bloku."""
+    gid = uuid.uuid4().hex; t0 = time.monotonic(); delay = POLL_S[0]
+    try:
+        while True:
+            with _state() as st:
+                g = _try_grant(st, gid, want)
+                if g is None:
+                    mine = next((t for t in st["queue"] if t["id"] == gid), None)
+                    if mine: mine["ts"] = time.time()
+                    else: st["queue"].append({"id": gid, "pid": os.getpid(), "want": want, "ts": time.time()})
+                _report(st)
+            if g is not None: break
+            time.sleep(delay); delay = min(delay * 2, POLL_S[1])
+    except BaseException:
+        with _state() as st: st["queue"] = [t for t in st["queue"] if t["id"] != gid]
+        raise
+    waited = time.monotonic() - t0
+    metrics.observe("vrs_cpu_budget_wait_seconds", waited, WAIT_BUCKETS, node=NODE)
+    t1 = time.monotonic()
+    try:
+        yield g
+    finally:
+        with _state() as st:
+            st["grants"].pop(gid, None); _report(st)
+        metrics.inc("vrs_cpu_budget_token_seconds_total", g.threads * (time.monotonic() - t1), node=NODE)
+
+def stats() -> dict:
+    with _state() as st:
+        return {"node": NODE, "total": total(), "used": _used(st), "waiting": len(st["queue"]),
+                "grants": list(st["grants"].values())}
+
+def nodes() -> dict[str, dict]:
+    """Ostatni stan budżetu każdego węzła (dla /metrics w API)."""
+    return {n: json.loads(v) for n, v in _r.hgetall("cpubudget:nodes").items()}
+
+# --- komendy ---------------------------------------------------------------
+
+_THREADS = re.compile(r"(?<!\S)-threads\s+(\d+)")
+_OUTPUT = re.compile(r'\s+("[^"]*"|\S+)\s*$')
+_INPUT = re.compile(r'(?<!\S)-i\s+("[^"]*"|\S+)')
+_GLOB = ("-filter_threads", "-filter_complex_threads")
+_GLOB_THREADS = re.compile(r"(?<!\S)(-filter_threads|-filter_complex_threads)\s+\d+")
+
+def _is_ffmpeg(cmd: str | list[str]) -> bool:
+    head = cmd.lstrip().split(" ", 1)[0] if isinstance(cmd, str) else (cmd[0] if cmd else "")
+    return os.path.basename(head) == "ffmpeg"
+
+def wanted(cmd: str | list[str]) -> int:
+    """Ile wątków chce komenda: jawne -threads, 1 dla remuxu (-c copy) i narzędzi jednowątkowych."""
+    if not _is_ffmpeg(cmd): return 1
+    line = cmd if isinstance(cmd, str) else " ".join(cmd)
+    m = _THREADS.findall(line)
+    if m and int(m[-1]) > 0: return int(m[-1])
+    if re.search(r"-c(:v)?\s+copy", line) and "libx264" not in line: return 1
+    return CPU_FFMPEG_THREADS
+
+def with_threads(cmd: str | list[str], n: int) -> str | list[str]:
+    """-threads n dla każdego dekodera i enkodera wyjścia + wątki filtrów (globalnie, zaraz po 'ffmpeg').
+    Jawne -threads/-filter_threads dostają n w miejscu – bez dopisywania drugiej kopii."""
+    if not _is_ffmpeg(cmd): return cmd
+    if isinstance(cmd, str):
+        line = _THREADS.sub(f"-threads {n}", cmd)
+        line = _GLOB_THREADS.sub(lambda m: f"{m.group(1)} {n}", line)
+        line = re.sub(rf"(?<!-threads {n} )(?<!\S)-i\s", f"-threads {n} -i ", line)
+        last_i = [m.end() for m in _INPUT.finditer(line)]
+        if not _THREADS.search(line, last_i[-1] if last_i else 0):
+            line = _OUTPUT.sub(lambda m: f" -threads {n} {m.group(1)}", line, count=1)
+        head, rest = line.lstrip().split(" ", 1)
+        glob = [f"{o} {n}" for o in _GLOB if not re.search(rf"(?<!\S){o}\s", rest)]
+        return " ".join([head, *glob, rest])
+    out = [cmd[0], *(t for o in _GLOB if o not in cmd for t in (o, str(n)))]
+    for i, a in enumerate(cmd[1:-1], 1):
+        if cmd[i - 1] in ("-threads", *_GLOB): out.append(str(n)); continue
+        if a == "-i" and cmd[i - 2:i - 1] != ["-threads"]: out += ["-threads", str(n)]
+        out.append(a)
+    last_i = max((i for i, a in enumerate(cmd) if a == "-i"), default=0)
+    return out + ([] if "-threads" in cmd[last_i + 2:-1] else ["-threads", str(n)]) + [cmd[-1]]
+
+def _read_pipes(p: subprocess.Popen) -> tuple:
+    pipes = [f for f in (p.stdout, p.stderr) if f]
+    out = {}
+    def read(f): out[id(f)] = f.read(); f.close()
+    threads = [threading.Thread(target=read, args=(f,), daemon=True) for f in pipes[1:]]
+    for t in threads: t.start()
+    if pipes: read(pipes[0])
+    for t in threads: t.join()
+    return out.get(id(p.stdout)), out.get(id(p.stderr))
+
+def _spawn(cmd: str | list[str], check: bool = False, **kwargs) -> subprocess.CompletedProcess:
+    """subprocess.run (bez input/timeout) z własnym os.wait4: rusage procesu (z potomkami shella) idzie
+    do liczników joba w metrics – RUSAGE_CHILDREN jest wspólne dla wszystkich wątków procesu."""
+    with subprocess.Popen(cmd, **kwargs) as p:
+        stdout, stderr = _read_pipes(p)
+        _, status, ru = os.wait4(p.pid, 0)
+        p.returncode = os.waitstatus_to_exitcode(status)  # Popen.wait() nie czeka już na zebrany proces
+    metrics.child_exited(cmd, ru)
+    if check and p.returncode:
+        raise subprocess.CalledProcessError(p.returncode, cmd, stdout, stderr)
+    return subprocess.CompletedProcess(cmd, p.returncode, stdout, stderr)
+
+def run(cmd: str | list[str], **kwargs) -> subprocess.CompletedProcess:
+    """subprocess.run w ramach budżetu węzła (wszystkie uruchomienia ffmpeg/aubio w workerach idą tędy)."""
+    with slot(wanted(cmd)) as g:
+        return _spawn(with_threads(cmd, g.threads), preexec_fn=g.preexec(), **kwargs)
+
+if __name__ == "__main__":
+    print(json.dumps(stats(), indent=2))
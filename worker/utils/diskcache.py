@@ -0,0 +1,56 @@
+import os, hashlib, threading
+import redis
+from worker.config import REDIS_URL
+
+# Wspólne klocki dla cache'y na wolumenie współdzielonym (normcache, analysis_cache):
+# hash treści, LRU po mtime, liczniki trafień per proces + zbiorczo w Redis.
+
+_r = redis.from_url(REDIS_URL, decode_responses=True)
+
+def file_sha256(path: str, chunk: int = 1024 * 1024) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk), b""): h.update(block)
+    return h.hexdigest()
+
+def touch(path: str) -> bool:
+    try: os.utime(path); return True  # mtime = ostatnie użycie (LRU)
+    except FileNotFoundError: return False
+
+def evict_lru(root: str, max_bytes: int, suffix: str) -> int:
+    return evict_lru_sized(root, max_bytes, suffix)[0]
+
+# (usunięte, bajty po eviction) – rozmiar pozwala wołającemu pominąć kolejne skany, póki mieści się w budżecie
+def evict_lru_sized(root: str, max_bytes: int, suffix: str) -> tuple[int, int]:
+    entries = []; total = 0
+    for dirpath, _, files in os.walk(root):
+        for name in files:
+            if not name.endswith(suffix) or name.endswith(".tmp" + suffix): continue
+            p = os.path.join(dirpath, name)
+            try: st = os.stat(p)
+            except FileNotFoundError: continue
+            entries.append((st.st_mtime, st.st_size, p)); total += st.st_size
+    removed = 0
+    for _, size, p in sorted(entries):
+        if total <= max_bytes: break
+        try: os.remove(p); total -= size; removed += 1
+        except FileNotFoundError: pass
+    return removed, total
+
+class CacheStats:
+    def __init__(self, redis_key: str):
+        self.redis_key = redis_key
+        self._d = {"hits": 0, "misses": 0, "evicted": 0}
+        self._lock = threading.Lock()
+
+    def count(self, field: str, n: int = 1) -> None:
+        if n <= 0: return
+        with self._lock: self._d[field] = self._d.get(field, 0) + n
+        try: _r.hincrby(self.redis_key, field, n)
+        except Exception: pass
+
+    def snapshot(self) -> dict:
+        with self._lock: d = dict(self._d)
+        n = d["hits"] + d["misses"]
+        d["hit_ratio"] = round(d["hits"] / n, 3) if n else None
+        return d
@@ -0,0 +1,173 @@
+import os, sys, json, time
+import redis
+from worker.config import REDIS_URL, RENDER_MODES, PIPELINE_MODES, VRILLSY_MAX_CLIPS, VRILLSY_SEG_S
+from worker.utils import metrics, probe
+
+# Estymator czasu renderu (s pracy workera) z tanich wejść: metadane ffprobe klipów, liczba klipów,
+# target, profil wyjścia, oczekiwana liczba cięć. Model liniowy per pipeline; ridge ściąga wagi do PRIOR,
+# więc przy kilku próbkach zachowuje się jak heurystyka, a z czasem uczy się z elapsed_s kończonych renderów.
+# Próbki i model w Redis (wspólne dla API i workerów); bootstrap z QA JSON: python -m worker.utils.estimator fit /outputs
+
+FEATURES = ("bias", "target_s", "clips", "in_mpxs", "in_hard_mpxs", "out_mpxs", "cuts")
+PRIOR = {"bias": 2.0, "target_s": 0.2, "clips": 1.0, "in_mpxs": 0.15, "in_hard_mpxs": 0.1, "out_mpxs": 0.1, "cuts": 0.05}
+HARD_CODECS = {"hevc", "vp9", "av1", "prores", "dnxhd"}  # droższy dekod przy normalizacji
+MEAN_SHOT_S = 0.36        # średnia z lengths_distribution (klatki @30 fps) w render_job
+RATIO_BUCKETS = (0.5, 0.67, 0.8, 0.9, 1.0, 1.1, 1.25, 1.5, 2, 3)
+
+PRIOR_WEIGHT = float(os.getenv("ESTIMATOR_PRIOR_WEIGHT", "20"))  # prior wart tyle próbek
+MAX_SAMPLES = int(os.getenv("ESTIMATOR_MAX_SAMPLES", "2000"))
+REFIT_EVERY = int(os.getenv("ESTIMATOR_REFIT_EVERY", "10"))
+MODEL_CACHE_S = 60
+TASK_TTL_S = 86400
+
+_r = redis.from_url(REDIS_URL, decode_responses=True)
+_models: dict[str, tuple[float, dict]] = {}
+
+def _model_key(pipeline: str) -> str: return f"estimator:model:{pipeline}"
+def _samples_key(pipeline: str) -> str: return f"estimator:samples:{pipeline}"
+
+# --- cechy -----------------------------------------------------------------
+
+def clip_meta(path: str, data: dict | None) -> dict:
+    """(w, h, dur, codec) z ffprobe; bez sondy (brak ffprobe w API) – założenia z rozmiaru pliku (~8 Mb/s, 1080p)."""
+    vs = next((s for s in (data or {}).get("streams", []) if s.get("codec_type") == "video"), None)
+    try: dur = float((data or {}).get("format", {}).get("duration"))
+    except (TypeError, ValueError): dur = None
+    if dur is None:
+        try: dur = os.path.getsize(path) * 8 / 8e6
+        except OSError: dur = 10.0
+    if not vs: return {"w": 1920, "h": 1080, "dur": dur, "codec": "unknown"}
+    return {"w": int(vs.get("width") or 1920), "h": int(vs.get("height") or 1080), "dur": dur,
+            "codec": vs.get("codec_name") or "unknown"}
+
+def features(clips: list[dict], target_s: float, mode: str = "final", pipeline: str = "render_job") -> dict:
+    """Profil wyjścia i kształt montażu pipeline'u, który będzie renderował: vrillsy.render_job dekoduje
+    tylko początki pierwszych klipów i skleja je bez planu cięć, render_job tnie cały target po beatach."""
+    modes = PIPELINE_MODES.get(pipeline, RENDER_MODES)
+    prof, _ = modes.get(mode, modes["final"])
+    if pipeline == "vrillsy.render_job":
+        clips = [dict(c, dur=min(c["dur"], VRILLSY_SEG_S)) for c in clips[:VRILLSY_MAX_CLIPS]]
+        out_s, cuts = min(target_s, VRILLSY_SEG_S * len(clips)), max(0, len(clips) - 1)
+    else:
+        out_s, cuts = target_s, round(target_s / MEAN_SHOT_S, 1)
+    mpxs = [c["w"] * c["h"] * c["dur"] / 1e6 for c in clips]
+    return {"bias": 1.0, "target_s": target_s, "clips": len(clips), "in_mpxs": round(sum(mpxs), 3),
+            "in_hard_mpxs": round(sum(m for m, c in zip(mpxs, clips) if c["codec"] in HARD_CODECS), 3),
+            "out_mpxs": round(prof.width * prof.height * out_s / 1e6, 3), "cuts": cuts}
+
+def job_features(videos: list[str], target_s: float, mode: str = "final", probe_inputs: bool = True,
+                 pipeline: str = "render_job") -> dict:
+    """probe_inputs=False (API, ścieżka żądania): bez ffprobe – tylko pamięć sond procesu, reszta z clip_meta."""
+    probed = probe.probe_many(videos) if probe_inputs else {v: probe.peek(v) for v in videos}
+    return features([clip_meta(v, probed.get(v)) for v in videos], target_s, mode, pipeline)
+
+# --- model -----------------------------------------------------------------
+
+def _solve(a: list[list[float]], b: list[float]) -> list[float]:
+    n = len(b); m = [row[:] + [b[i]] for i, row in enumerate(a)]
+    for c in range(n):
+        p = max(range(c, n), key=lambda r: abs(m[r][c]))
+        m[c], m[p] = m[p], m[c]
+        if abs(m[c][c]) < 1e-12: continue
+        for r in range(n):
+            if r != c:
+                f = m[r][c] / m[c][c]
+                m[r] = [x - f * y for x, y in zip(m[r], m[c])]
+    return [m[i][n] / m[i][i] if abs(m[i][i]) > 1e-12 else 0.0 for i in range(n)]
+
+def fit(samples: list[dict]) -> dict:
+    """Ridge ściągający do PRIOR: (XᵀX + λD)w = Xᵀy + λD·prior, D = średnie x² (kara niezależna od skali cechy),
+    λ = PRIOR_WEIGHT – przy kilku próbkach wagi zostają przy heurystyce, przy setkach decydują dane."""
+    X = [[s["f"].get(k, 0.0) for k in FEATURES] for s in samples]; y = [s["y"] for s in samples]
+    n, k = len(X), len(FEATURES)
+    prior = [PRIOR[f] for f in FEATURES]
+    scale = [max(sum(row[j] ** 2 for row in X) / n, 1e-6) if n else 1.0 for j in range(k)]  # cecha bez danych = prior
+    A = [[sum(row[i] * row[j] for row in X) + (PRIOR_WEIGHT * scale[i] if i == j else 0.0) for j in range(k)] for i in range(k)]
+    b = [sum(row[i] * t for row, t in zip(X, y)) + PRIOR_WEIGHT * scale[i] * prior[i] for i in range(k)]
+    w = _solve(A, b) if n else prior
+    model = {"weights": dict(zip(FEATURES, w)), "n": n, "updated_at": time.time()}
+    errs = [abs(_dot(model["weights"], s["f"]) - s["y"]) / max(s["y"], 1e-3) for s in samples]
+    model["mape"] = round(sum(errs) / n, 4) if n else None
+    return model
+
+def _dot(weights: dict, feats: dict) -> float:
+    return sum(weights.get(k, 0.0) * feats.get(k, 0.0) for k in FEATURES)
+
+def model(pipeline: str) -> dict | None:
+    hit = _models.get(pipeline)
+    if hit and time.time() - hit[0] < MODEL_CACHE_S: return hit[1]
+    try: raw = _r.get(_model_key(pipeline))
+    except Exception: raw = None
+    m = json.loads(raw) if raw else None
+    _models[pipeline] = (time.time(), m)
+    return m
+
+def predict(pipeline: str, feats: dict) -> float:
+    m = model(pipeline)
+    return max(1.0, _dot(m["weights"] if m else PRIOR, feats))
+
+def refit(pipeline: str) -> dict:
+    samples = [json.loads(x) for x in _r.lrange(_samples_key(pipeline), 0, -1)]
+    m = fit(samples)
+    _r.set(_model_key(pipeline), json.dumps(m))
+    _models.pop(pipeline, None)
+    return m
+
+def record(pipeline: str, feats: dict, elapsed_s: float, predicted_s: float | None = None,
+           stages: dict | None = None) -> None:
+    """Próbka z zakończonego renderu; trafność predykcji (actual/predicted) jako histogram."""
+    if not feats or elapsed_s <= 0: return
+    if predicted_s:
+        metrics.observe("vrs_estimate_ratio", elapsed_s / predicted_s, RATIO_BUCKETS, pipeline=pipeline)
+    s = {"f": feats, "y": round(elapsed_s, 3), "p": predicted_s, "ts": round(time.time(), 1)}
+    if stages: s["stages"] = stages
+    try:
+        p = _r.pipeline()
+        p.lpush(_samples_key(pipeline), json.dumps(s)); p.ltrim(_samples_key(pipeline), 0, MAX_SAMPLES - 1)
+        p.incr(f"estimator:n:{pipeline}")
+        n = p.execute()[-1]
+        if n % REFIT_EVERY == 0: refit(pipeline)
+    except Exception: pass
+
+# --- estymata per task (ETA w /status) ------------------------------------
+
+def remember(task_id: str, estimate_s: float) -> None:
+    try: _r.set(f"estimator:task:{task_id}", json.dumps({"estimate_s": estimate_s, "submitted_at": time.time()}),
+                ex=TASK_TTL_S)
+    except Exception: pass
+
+def recall(task_id: str) -> dict | None:
+    try: raw = _r.get(f"estimator:task:{task_id}")
+    except Exception: return None
+    return json.loads(raw) if raw else None
+
+def stats() -> dict:
+    out = {}
+    for key in _r.scan_iter("estimator:model:*"):
+        m = json.loads(_r.get(key) or "null")
+        if m: out[key.split(":", 2)[2]] = {"n": m["n"], "mape": m["mape"]}
+    return out
+
+def load_qa(outputs_dir: str) -> dict[str, list[dict]]:
+    """Próbki z QA JSON (render_job zapisuje cechy w qa["estimate"]) pogrupowane po pipeline."""
+    out: dict[str, list[dict]] = {}
+    for name in os.listdir(outputs_dir):
+        if not name.endswith(".json"): continue
+        try:
+            with open(os.path.join(outputs_dir, name)) as f: qa = json.load(f)
+        except (OSError, ValueError): continue
+        est = qa.get("estimate") if isinstance(qa, dict) else None
+        if not est or not qa.get("elapsed_s"): continue
+        out.setdefault(est["pipeline"], []).append({"f": est["features"], "y": qa["elapsed_s"],
+                                                    "p": est.get("predicted_s"), "stages": qa.get("stages")})
+    return out
+
+if __name__ == "__main__":
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "stats"
+    if cmd == "fit":
+        for pipe, samples in load_qa(sys.argv[2] if len(sys.argv) > 2 else "/outputs").items():
+            p = _r.pipeline()
+            for s in samples[:MAX_SAMPLES]: p.rpush(_samples_key(pipe), json.dumps(s))
+            p.ltrim(_samples_key(pipe), 0, MAX_SAMPLES - 1); p.execute()
+            print(pipe, refit(pipe))
+    else: print(stats())
@@ -0,0 +1,94 @@
+import json, time
+import redis
+from worker.config import REDIS_URL, USER_MAX_CONCURRENT, FAIR_RUNNING_TTL_S
+from worker.utils import metrics
+
+# Fair share per użytkownik: fair:running:<user> = ZSET task_id -> termin wygaśnięcia (sloty w użyciu),
+# nadmiar czeka jako gotowe wywołanie send_task w fair:pending:<user>, a użytkownicy z kolejką
+# w fair:waiting (ZSET, score = kiedy ostatnio obsłużony). Zwolnienie slotu (koniec taska na workerze)
+# wysyła po jednym jobie od najdawniej obsłużonych użytkowników – nikt nie zapycha brokera dwudziestoma renderami.
+# Slot martwego workera wygasa bez zdarzenia, więc workery wołają też pump() cyklicznie (FAIR_PUMP_S).
+# enqueued_at jest stemplowany przy faktycznym wysłaniu: vrs_queue_wait_seconds = czas w brokerze,
+# a czekanie na slot idzie osobno do vrs_fairshare_wait_seconds.
+
+_r = redis.from_url(REDIS_URL, decode_responses=True)
+WAITING = "fair:waiting"
+
+def _running(user: str) -> str: return f"fair:running:{user}"
+def _pending(user: str) -> str: return f"fair:pending:{user}"
+
+# KEYS: running | ARGV: now, deadline, task_id, limit, ttl
+_ACQUIRE = _r.register_script("""
+redis.call('zremrangebyscore', KEYS[1], '-inf', ARGV[1])
+if tonumber(ARGV[4]) > 0 and redis.call('zcard', KEYS[1]) >= tonumber(ARGV[4]) then return 0 end
+redis.call('zadd', KEYS[1], ARGV[2], ARGV[3])
+redis.call('expire', KEYS[1], ARGV[5])
+return 1
+""")
+
+# KEYS: running, pending, waiting | ARGV: now, deadline, limit, user, ttl
+_POP = _r.register_script("""
+redis.call('zremrangebyscore', KEYS[1], '-inf', ARGV[1])
+if tonumber(ARGV[3]) > 0 and redis.call('zcard', KEYS[1]) >= tonumber(ARGV[3]) then return false end
+local raw = redis.call('lpop', KEYS[2])
+if not raw then redis.call('zrem', KEYS[3], ARGV[4]); return false end
+redis.call('zadd', KEYS[1], ARGV[2], cjson.decode(raw)['task_id'])
+redis.call('expire', KEYS[1], ARGV[5])
+if redis.call('llen', KEYS[2]) == 0 then redis.call('zrem', KEYS[3], ARGV[4])
+else redis.call('zadd', KEYS[3], ARGV[1], ARGV[4]) end
+return raw
+""")
+
+def acquire(user: str, task_id: str) -> bool:
+    now = time.time()
+    return bool(_ACQUIRE(keys=[_running(user)], args=[now, now + FAIR_RUNNING_TTL_S, task_id,
+                                                      USER_MAX_CONCURRENT, FAIR_RUNNING_TTL_S]))
+
+def release(user: str, task_id: str) -> None:
+    _r.zrem(_running(user), task_id)
+
+def _dispatch(payload: dict, send) -> None:
+    headers = payload.setdefault("headers", {})
+    now = time.time()
+    deferred = headers.pop("vrs_deferred_at", None)
+    headers["enqueued_at"] = now  # czas w brokerze liczony od wysłania, nie od przyjęcia przez API
+    send(payload)
+    if deferred is not None:
+        metrics.observe("vrs_fairshare_wait_seconds", max(0.0, now - float(deferred)), metrics.QUEUE_BUCKETS,
+                        queue=payload.get("queue", ""))
+
+def submit(user: str, payload: dict, send) -> str:
+    """payload = kwargs send_task (z task_id). "sent" albo "deferred" (czeka na slot użytkownika)."""
+    if acquire(user, payload["task_id"]):
+        _dispatch(payload, send); return "sent"
+    payload = {**payload, "headers": {**(payload.get("headers") or {}), "vrs_deferred_at": time.time()}}
+    p = _r.pipeline()
+    p.rpush(_pending(user), json.dumps(payload)); p.zadd(WAITING, {user: time.time()}, nx=True)
+    p.execute()
+    metrics.inc("vrs_fairshare_deferred_total", queue=payload.get("queue", ""))
+    pump(send)  # slot mógł się zwolnić między acquire a rpush
+    return "deferred"
+
+def pump(send) -> int:
+    """Po jednym oczekującym jobie na użytkownika z wolnym slotem, najdawniej obsłużeni pierwsi."""
+    sent = 0
+    for user in _r.zrange(WAITING, 0, -1):
+        now = time.time()
+        raw = _POP(keys=[_running(user), _pending(user), WAITING],
+                   args=[now, now + FAIR_RUNNING_TTL_S, USER_MAX_CONCURRENT, user, FAIR_RUNNING_TTL_S])
+        if not raw: continue
+        payload = json.loads(raw)
+        try:
+            _dispatch(payload, send)
+        except Exception:
+            release(user, payload["task_id"])
+            p = _r.pipeline(); p.lpush(_pending(user), raw); p.zadd(WAITING, {user: 0}); p.execute()
+            raise
+        sent += 1
+    return sent
+
+def stats() -> dict:
+    users = _r.zrange(WAITING, 0, -1)
+    p = _r.pipeline(transaction=False)
+    for u in users: p.llen(_pending(u))
+    return {"waiting_users": len(users), "pending_jobs": sum(p.execute()) if users else 0}
@@ -0,0 +1,81 @@
+import time, logging, threading
+from celery.signals import task_prerun, task_postrun, worker_ready, worker_shutdown
+from kombu import Queue
+from worker.config import LANES, WORKER_PREFETCH, FAIR_PUMP_S
+from worker.utils import metrics, fairshare, estimator
+
+# Wspólna konfiguracja workerów renderu dla obu aplikacji Celery (worker/app/celery_app i backend/app/celeryapp):
+# lane'y z priorytetem podglądu, ack po renderze (redelivery = przejęcie lease), prefetch, czas w kolejce,
+# uczenie estymatora, zwalnianie slotów fair share i ich cykliczne pompowanie. Producent (API) wybiera lane.
+
+log = logging.getLogger(__name__)
+
+RENDER_TASKS = ("vrillsy.render_job", "render_job", "render_batch", "render_job_dag")
+_app = None
+
+def configure(app, extra_queues: tuple[str, ...] = ()) -> None:
+    """Worker bez -Q słucha wszystkich lane'ów w kolejności LANES (podgląd pierwszy, strategia "priority");
+    długie rendery dostają osobne workery: celery -A ... worker -Q vrillsy.long. extra_queues – stare kolejki
+    (np. "celery") słuchane na końcu, żeby dotychczasowe wiadomości się wyczerpały."""
+    global _app
+    _app = app
+    app.conf.update(
+        task_queues=[Queue(q) for q in (*LANES.values(), *extra_queues)],
+        task_default_queue=LANES["short"],
+        task_routes={name: {"queue": LANES["short"]} for name in RENDER_TASKS},  # producent i tak wskazuje lane
+        broker_transport_options={"queue_order_strategy": "priority"},
+        task_acks_late=True,              # ack po renderze: padnięty worker = redelivery, nie zgubiony job
+        task_reject_on_worker_lost=True,
+        worker_prefetch_multiplier=WORKER_PREFETCH,
+    )
+
+def _header(request, name: str):
+    return getattr(request, name, None) or (getattr(request, "headers", None) or {}).get(name)
+
+_started: dict[str, float] = {}
+
+@task_prerun.connect
+def _queue_wait(task=None, task_id=None, **_):
+    if task.name in RENDER_TASKS:
+        metrics.queue_wait(task.request); _started[task_id] = time.time()
+
+@task_postrun.connect
+def _learn_cost(task=None, task_id=None, retval=None, state=None, **_):
+    """Czas udanego renderu jako próbka estymatora (cechy policzone przez API, nagłówek vrs_features).
+    Taski worker.tasks.render_job uczą estymator same z QA (learn) – tu tylko vrillsy.render_job."""
+    t0 = _started.pop(task_id, None)
+    if task.name != "vrillsy.render_job": return
+    feats = _header(task.request, "vrs_features")
+    if t0 is None or not feats or state != "SUCCESS" or not (isinstance(retval, dict) and retval.get("ok")): return
+    estimator.record(task.name, feats, time.time() - t0, _header(task.request, "vrs_cost_s"))
+
+def _send(payload: dict):
+    return _app.send_task(**payload)
+
+@task_postrun.connect
+def _fair_release(task=None, task_id=None, **_):
+    user = _header(task.request, "vrs_user")
+    if not user or _app is None: return
+    try:
+        fairshare.release(user, task_id)
+        fairshare.pump(_send)
+    except Exception:
+        pass  # sloty i tak wygasają po FAIR_RUNNING_TTL_S
+
+# Slot, który wygasł po FAIR_RUNNING_TTL_S (worker padł w trakcie), nie wywoła _fair_release – bez cyklicznego
+# pump() kolejka użytkownika stałaby do następnego renderu. _POP jest atomowe, więc wiele workerów nie wyśle dwa razy.
+_pump_stop = threading.Event()
+
+def _fair_pump_loop() -> None:
+    while not _pump_stop.wait(FAIR_PUMP_S):
+        try: fairshare.pump(_send)
+        except Exception as e: log.warning("fair share pump failed: %s", e)
+
+@worker_ready.connect
+def _start_fair_pump(**_):
+    if FAIR_PUMP_S > 0 and _app is not None:
+        threading.Thread(target=_fair_pump_loop, name="fair-pump", daemon=True).start()
+
+@worker_shutdown.connect
+def _stop_fair_pump(**_):
+    _pump_stop.set()
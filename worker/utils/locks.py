@@ -1,14 +1,166 @@
-import uuid
+import os, json, uuid, time, fcntl, socket, logging, threading
 import redis
-from worker.config import REDIS_URL, LOCK_TTL_S
+from worker.config import REDIS_URL, LEASE_TTL_S
+
+# Lease joba: lock:<job_id> = {token, fence, owner, task_id} z krótkim TTL odnawianym przez wątek heartbeat.
+# fence = INCR lock:<job_id>:fence przy każdym przejęciu – rośnie monotonicznie, więc zapis wyniku (publish)
+# odrzuca posiadacza, którego lease wygasł i został przejęty. Zwolnienie/odnowienie tylko z własnym tokenem (Lua).
+# Redelivery tego samego taska (worker padł) albo martwy proces właściciela na tym hoście = przejęcie od razu.
+
+log = logging.getLogger(__name__)
 _r = redis.from_url(REDIS_URL, decode_responses=True)
+FENCE_TTL_S = 7 * 86400
+
 def _key(job_id: str) -> str: return f"lock:{job_id}"
-def acquire_job_lock(job_id: str) -> str | None:
-    token = str(uuid.uuid4())
-    ok = _r.set(_key(job_id), token, nx=True, ex=LOCK_TTL_S)
-    return token if ok else None
-def release_job_lock(job_id: str) -> None:
-    try: _r.delete(_key(job_id))
-    except Exception: pass
+def _fkey(job_id: str) -> str: return f"lock:{job_id}:fence"
+
+class LeaseLost(RuntimeError):
+    pass
+
+# KEYS: lock, fence | ARGV: oczekiwana wartość ('' = klucz nie może istnieć), token, owner, task_id, ttl_ms, fence_ttl
+_TAKE = _r.register_script("""
+local cur = redis.call('get', KEYS[1])
+if ARGV[1] == '' then if cur then return false end
+elseif cur ~= ARGV[1] then return false end
+local fence = redis.call('incr', KEYS[2])
+redis.call('expire', KEYS[2], ARGV[6])
+local v = cjson.encode({token=ARGV[2], fence=fence, owner=ARGV[3], task_id=ARGV[4]})
+redis.call('set', KEYS[1], v, 'PX', ARGV[5])
+return v
+""")
+
+# KEYS: lock | ARGV: token, ttl_ms ('' = tylko sprawdzenie), del ('1' = compare-and-delete)
+_OWN = _r.register_script("""
+local cur = redis.call('get', KEYS[1])
+if not cur then return 0 end
+local ok, v = pcall(cjson.decode, cur)
+if not ok or type(v) ~= 'table' or v['token'] ~= ARGV[1] then return 0 end
+if ARGV[3] == '1' then return redis.call('del', KEYS[1]) end
+if ARGV[2] ~= '' then redis.call('pexpire', KEYS[1], ARGV[2]) end
+return 1
+""")
+
+# KEYS: lock, fence | ARGV: token, fence, owner, ttl_ms – wygasły lease wraca do posiadacza z tym samym tokenem,
+# o ile nikt go w międzyczasie nie wziął (licznik fence bez zmian)
+_RECLAIM = _r.register_script("""
+if redis.call('exists', KEYS[1]) == 1 then return 0 end
+if tonumber(redis.call('get', KEYS[2]) or '0') ~= tonumber(ARGV[2]) then return 0 end
+local v = cjson.encode({token=ARGV[1], fence=tonumber(ARGV[2]), owner=ARGV[3], task_id=''})
+redis.call('set', KEYS[1], v, 'PX', ARGV[4])
+return 1
+""")
+
+class Lease:
+    def __init__(self, job_id: str, token: str, fence: int, ttl_s: float):
+        self.job_id, self.token, self.fence, self.ttl_s = job_id, token, fence, ttl_s
+        self.lost = threading.Event()
+        self._stop = threading.Event(); self._thread: threading.Thread | None = None
+
+    def as_dict(self) -> dict:
+        """Do przekazania między taskami (DAG): kolejne kroki odnawiają ten sam lease."""
+        return {"job_id": self.job_id, "token": self.token, "fence": self.fence, "ttl_s": self.ttl_s}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "Lease":
+        return cls(d["job_id"], d["token"], int(d["fence"]), float(d["ttl_s"]))
+
+    def renew(self) -> bool:
+        return bool(_OWN(keys=[_key(self.job_id)], args=[self.token, int(self.ttl_s * 1000), "0"]))
+
+    def held(self) -> bool:
+        return bool(_OWN(keys=[_key(self.job_id)], args=[self.token, "", "0"]))
+
+    def reclaim(self) -> bool:
+        """Po wygaśnięciu TTL (np. krok DAG-u czekał w kolejce dłużej niż LOCK_TTL_S), jeśli nikt nie przejął joba."""
+        return bool(_RECLAIM(keys=[_key(self.job_id), _fkey(self.job_id)],
+                             args=[self.token, self.fence, _owner(), int(self.ttl_s * 1000)]))
+
+    def superseded(self) -> bool:
+        """Job wziął po nas inny render (fence poszedł dalej) – jego katalog roboczy i zdarzenia, nie nasze."""
+        return int(_r.get(_fkey(self.job_id)) or 0) > self.fence
+
+    def release(self) -> None:
+        self.stop()
+        try: _OWN(keys=[_key(self.job_id)], args=[self.token, "", "1"])
+        except Exception: pass  # i tak wygaśnie po ttl_s
+
+    def _beat(self) -> None:
+        deadline = time.monotonic() + self.ttl_s
+        while not self._stop.wait(self.ttl_s / 3):
+            try:
+                if not (self.renew() or self.reclaim()): break
+                deadline = time.monotonic() + self.ttl_s
+            except Exception as e:
+                log.warning("lease %s renew failed: %s", self.job_id, e)
+                if time.monotonic() >= deadline: break
+        else:
+            return
+        log.error("lease %s lost (fence %s)", self.job_id, self.fence)
+        self.lost.set()
+
+    def start(self) -> "Lease":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._beat, name=f"lease-{self.job_id}", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread(): self._thread.join(1)
+
+    def __enter__(self) -> "Lease":
+        if not (self.renew() or self.reclaim()): raise LeaseLost(f"lease {self.job_id} taken over (fence {self.fence})")
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop(); self._stop.clear(); self._thread = None
+
+    def check(self) -> None:
+        if self.lost.is_set(): raise LeaseLost(f"lease {self.job_id} lost (fence {self.fence})")
+
+    def publish(self, tmp: str, dst: str) -> None:
+        """Atomowy rename wyniku tylko dla aktualnego posiadacza: fence nie starszy niż ostatnio opublikowany
+        dla dst (plik .fence/<nazwa> pod flock) i lease nadal nasz w Redis."""
+        fdir = os.path.join(os.path.dirname(dst) or ".", ".fence"); os.makedirs(fdir, exist_ok=True)
+        with open(os.path.join(fdir, os.path.basename(dst)), "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0); last = int(f.read().strip() or 0)
+            if self.fence < last or self.lost.is_set() or not self.held():
+                try: os.unlink(tmp)
+                except OSError: pass
+                raise LeaseLost(f"stale writer for {dst}: fence {self.fence}, published {last}")
+            os.replace(tmp, dst)
+            f.seek(0); f.truncate(); f.write(str(self.fence)); f.flush()
+
+def _owner() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"  # pid dziecka prefork, nie rodzica z czasu importu
+
+def _dead(owner: str) -> bool:
+    host, _, pid = owner.rpartition(":")
+    if host != socket.gethostname() or not pid.isdigit(): return False
+    try: os.kill(int(pid), 0)
+    except ProcessLookupError: return True
+    except PermissionError: pass
+    return False
+
+def acquire_lease(job_id: str, task_id: str | None = None, ttl_s: float = LEASE_TTL_S) -> Lease | None:
+    """None = job renderuje ktoś inny (żywy). Lease trzeba odnawiać: start()/with lease albo renew()."""
+    token = uuid.uuid4().hex; expected = ""
+    for _ in range(3):
+        raw = _TAKE(keys=[_key(job_id), _fkey(job_id)],
+                    args=[expected, token, _owner(), task_id or "", int(ttl_s * 1000), FENCE_TTL_S])
+        if raw:
+            return Lease(job_id, token, int(json.loads(raw)["fence"]), ttl_s)
+        cur = _r.get(_key(job_id))
+        if cur is None: expected = ""; continue
+        try: held = json.loads(cur)
+        except ValueError: return None  # lock starego formatu – czekamy na TTL
+        # ten sam task dostarczony ponownie (acks_late: poprzedni worker padł) albo właściciel nie żyje
+        if (task_id and held.get("task_id") == task_id) or _dead(held.get("owner", "")):
+            log.warning("lease %s taken over from %s (fence %s)", job_id, held.get("owner"), held.get("fence"))
+            expected = cur; continue
+        return None
+    return None
+
 def is_locked(job_id: str) -> bool:
     return _r.exists(_key(job_id)) == 1
@@ -0,0 +1,112 @@
+import os, sys, errno, shutil, time
+from worker.utils.diskcache import file_sha256
+
+# Content-addressed store uploadów na wolumenie współdzielonym: <store>/<sha[:2]>/<sha256>.
+# Katalogi jobów trzymają hardlinki do blobów, więc st_nlink-1 = liczba referencji;
+# blob z nlink==1 nie jest używany przez żaden job i może zostać usunięty.
+# SHA-256 zapisany w xattr inode'u (wspólny dla wszystkich hardlinków) = stabilny klucz dla cache'y.
+
+XATTR = "user.vrs.sha256"
+ORPHAN_GRACE_S = 3600
+
+def blob_path(store_dir: str, sha: str) -> str:
+    return os.path.join(store_dir, sha[:2], sha)
+
+def _tag(path: str, sha: str, size: int) -> None:
+    try: os.setxattr(path, XATTR, f"{sha}:{size}".encode())
+    except (OSError, AttributeError): pass  # fs bez xattr – cache'e policzą hash same
+
+def content_hash(path: str) -> str | None:
+    """SHA-256 z xattr (bez czytania pliku); None gdy brak tagu albo rozmiar się nie zgadza."""
+    try:
+        sha, _, size = os.getxattr(path, XATTR).decode().partition(":")
+        return sha if int(size) == os.stat(path).st_size else None
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def adopt(path: str, sha: str, store_dir: str) -> bool:
+    """Wpina świeżo zapisany plik do store'u. True = identyczny blob już był i plik zastąpiono hardlinkiem."""
+    size = os.stat(path).st_size
+    blob = blob_path(store_dir, sha)
+    os.makedirs(os.path.dirname(blob), exist_ok=True)
+    for _ in range(3):
+        try:
+            os.link(path, blob)  # pierwszy raz: ten inode staje się blobem
+            os.chmod(path, 0o444); _tag(path, sha, size)
+            return False
+        except FileExistsError:
+            pass
+        except OSError as e:
+            if e.errno in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP): return False
+            raise
+        try:
+            if os.stat(blob).st_size != size: return False
+            tmp = path + ".lnk"
+            os.link(blob, tmp)
+        except FileNotFoundError:
+            continue  # blob właśnie zebrany przez gc – spróbuj jeszcze raz jako nowy
+        os.replace(tmp, path)
+        return True
+    return False
+
+def release_dir(job_dir: str, store_dir: str | None) -> int:
+    """Usuwa katalog joba; bloby, które straciły ostatnią referencję, znikają od razu."""
+    shas = set()
+    if store_dir:
+        for dirpath, _, files in os.walk(job_dir):
+            for name in files:
+                h = content_hash(os.path.join(dirpath, name))
+                if h: shas.add(h)
+    shutil.rmtree(job_dir, ignore_errors=True)
+    removed = 0
+    for sha in shas:
+        blob = blob_path(store_dir, sha)
+        try:
+            if os.stat(blob).st_nlink == 1: os.unlink(blob); removed += 1
+        except FileNotFoundError: pass
+    return removed
+
+def gc(store_dir: str, grace_s: float = ORPHAN_GRACE_S) -> dict:
+    """Usuwa bloby bez referencji starsze niż grace_s (ctime zmienia się przy każdym link/unlink)."""
+    now = time.time(); out = {"removed": 0, "freed_bytes": 0}
+    for dirpath, _, files in os.walk(store_dir):
+        for name in files:
+            p = os.path.join(dirpath, name)
+            try: st = os.stat(p)
+            except FileNotFoundError: continue
+            if st.st_nlink == 1 and st.st_ctime < now - grace_s:
+                try: os.unlink(p); out["removed"] += 1; out["freed_bytes"] += st.st_size
+                except FileNotFoundError: pass
+    return out
+
+def stats(store_dir: str) -> dict:
+    out = {"blobs": 0, "bytes": 0, "refs": 0, "orphans": 0, "saved_bytes": 0}
+    for dirpath, _, files in os.walk(store_dir):
+        for name in files:
+            try: st = os.stat(os.path.join(dirpath, name))
+            except FileNotFoundError: continue
+            refs = st.st_nlink - 1
+            out["blobs"] += 1; out["bytes"] += st.st_size; out["refs"] += refs
+            out["orphans"] += refs == 0
+            out["saved_bytes"] += max(0, refs - 1) * st.st_size  # każda referencja ponad pierwszą = kopia, której nie ma
+    return out
+
+def dedupe_tree(root: str, store_dir: str) -> dict:
+    """Jednorazowe wpięcie istniejących plików (np. starych katalogów jobów) do store'u."""
+    out = {"files": 0, "deduplicated": 0}
+    store = os.path.abspath(store_dir)
+    for dirpath, dirnames, files in os.walk(root):
+        dirnames[:] = [d for d in dirnames if not d.startswith(".") and os.path.abspath(os.path.join(dirpath, d)) != store]
+        for name in files:
+            p = os.path.join(dirpath, name)
+            if os.path.islink(p) or not os.path.isfile(p): continue
+            sha = content_hash(p) or file_sha256(p)
+            out["files"] += 1; out["deduplicated"] += adopt(p, sha, store_dir)
+    return out
+
+if __name__ == "__main__":
+    from worker.config import MEDIA_STORE_DIR
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "stats"
+    if cmd == "gc": print(gc(MEDIA_STORE_DIR, float(sys.argv[2]) if len(sys.argv) > 2 else ORPHAN_GRACE_S))
+    elif cmd == "dedupe": print(dedupe_tree(sys.argv[2], MEDIA_STORE_DIR))
+    else: print(stats(MEDIA_STORE_DIR))
@@ -0,0 +1,221 @@
+import os, time, resource, threading, contextvars
+from contextlib import contextmanager
+from contextvars import ContextVar
+from concurrent.futures import ThreadPoolExecutor
+import redis
+from worker.config import REDIS_URL
+
+# Metryki w formacie Prometheusa trzymane w Redis (hash per metryka), żeby worker (prefork, wiele procesów)
+# i API pisały w jedno miejsce, a /metrics w API tylko je renderowało.
+# Pole hasha: 'stage="cut"' (counter) albo 'stage="cut"|0.5' / '|+Inf' / '|sum' (histogram).
+
+_r = redis.from_url(REDIS_URL, decode_responses=True)
+PREFIX = "metrics:"
+
+STAGE_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+QUEUE_BUCKETS = (0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 900)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+METRICS = {
+    "vrs_stage_duration_seconds": ("histogram", "Wall time of render stages"),
+    "vrs_stage_cpu_seconds_total": ("counter", "CPU seconds of the worker process per stage"),
+    "vrs_ffmpeg_cpu_seconds_total": ("counter", "CPU seconds of child processes (ffmpeg/ffprobe) per stage"),
+    "vrs_ffmpeg_processes_total": ("counter", "ffmpeg/ffprobe processes started per stage"),
+    "vrs_stage_read_bytes_total": ("counter", "Block I/O bytes read per stage (self + children)"),
+    "vrs_stage_written_bytes_total": ("counter", "Block I/O bytes written per stage (self + children)"),
+    "vrs_queue_wait_seconds": ("histogram", "Time from enqueue to task start, per task and queue (lane)"),
+    "vrs_fairshare_deferred_total": ("counter", "Renders held back by the per-user concurrency cap"),
+    "vrs_fairshare_wait_seconds": ("histogram", "Time a deferred render waited for a per-user slot before reaching the broker"),
+    "vrs_cpu_budget_wait_seconds": ("histogram", "Time a subprocess launch waited for node CPU tokens"),
+    "vrs_cpu_budget_token_seconds_total": ("counter", "CPU tokens x seconds held by subprocesses (utilization numerator)"),
+    "vrs_estimate_ratio": ("histogram", "Actual / predicted render time per pipeline (estimator accuracy)"),
+    "vrs_http_request_duration_seconds": ("histogram", "API request latency"),
+}
+CACHES = {"normcache": "normcache:stats", "analysiscache": "analysiscache:stats"}
+
+def _labels(labels: dict) -> str:
+    return ",".join(f'{k}="{v}"' for k, v in sorted(labels.items()))
+
+def inc(name: str, n: float = 1.0, **labels) -> None:
+    if n <= 0: return
+    try: _r.hincrbyfloat(PREFIX + name, _labels(labels), n)
+    except Exception: pass
+
+def observe(name: str, value: float, buckets: tuple, **labels) -> None:
+    lab = _labels(labels); key = PREFIX + name
+    try:
+        p = _r.pipeline(transaction=False)
+        for b in buckets:
+            if value <= b: p.hincrby(key, f"{lab}|{b}", 1)
+        p.hincrby(key, f"{lab}|+Inf", 1)
+        p.hincrbyfloat(key, f"{lab}|sum", value)
+        p.execute()
+    except Exception: pass
+
+# --- bufor w procesie (API): observe bez I/O w ścieżce żądania, flush() w tle ------
+
+FLUSH_S = 5.0
+_buf: dict[tuple[str, str], float] = {}  # (klucz metryki, pole hasha) -> przyrost od ostatniego flush
+_buf_lock = threading.Lock()
+
+def observe_buffered(name: str, value: float, buckets: tuple, **labels) -> None:
+    lab = _labels(labels); key = PREFIX + name
+    fields = [f"{lab}|{b}" for b in buckets if value <= b] + [f"{lab}|+Inf"]
+    with _buf_lock:
+        for f in fields: _buf[(key, f)] = _buf.get((key, f), 0) + 1
+        _buf[(key, f"{lab}|sum")] = _buf.get((key, f"{lab}|sum"), 0.0) + value
+
+def flush() -> int:
+    """Wysyła zbuforowane przyrosty jednym pipeline; przy błędzie Redis wracają do bufora (liczba serii jest
+    ograniczona – trasy × metody × statusy), więc nic nie ginie i nic nie blokuje żądań."""
+    with _buf_lock:
+        pending = dict(_buf); _buf.clear()
+    if not pending: return 0
+    try:
+        p = _r.pipeline(transaction=False)
+        for (key, field), v in pending.items():
+            if field.endswith("|sum"): p.hincrbyfloat(key, field, v)
+            else: p.hincrby(key, field, int(v))
+        p.execute()
+    except Exception:
+        with _buf_lock:
+            for k, v in pending.items(): _buf[k] = _buf.get(k, 0) + v
+        return 0
+    return len(pending)
+
+# --- procesy potomne, liczone per job ----------------------------------------
+# rusage każdego procesu potomnego (os.wait4 w cpubudget.run) trafia do liczników joba z bieżącego kontekstu,
+# więc równoległe wątki normalizacji/wariantów i kilka renderów w jednym procesie się nie mieszają.
+
+class JobCounters:
+    def __init__(self):
+        self.ffmpeg = 0; self.encodes = 0; self.child_cpu_s = 0.0; self.read_bytes = 0; self.write_bytes = 0
+        self._lock = threading.Lock()
+
+    def add(self, cmd: str | list[str], ru) -> None:
+        line = cmd if isinstance(cmd, str) else " ".join(cmd)
+        head = os.path.basename(line.lstrip().split(" ", 1)[0])
+        with self._lock:
+            self.ffmpeg += head in ("ffmpeg", "ffprobe")
+            self.encodes += "libx264" in line
+            self.child_cpu_s += ru.ru_utime + ru.ru_stime
+            self.read_bytes += ru.ru_inblock * 512; self.write_bytes += ru.ru_oublock * 512
+
+_job: ContextVar[JobCounters | None] = ContextVar("vrs_job_counters", default=None)
+
+@contextmanager
+def job_counters():
+    """Liczniki procesów potomnych dla bloku (jednego joba); wątki dostają je przez Executor."""
+    c = JobCounters(); tok = _job.set(c)
+    try: yield c
+    finally: _job.reset(tok)
+
+def child_exited(cmd: str | list[str], ru) -> None:
+    c = _job.get()
+    if c is not None: c.add(cmd, ru)
+
+class Executor(ThreadPoolExecutor):
+    """ThreadPoolExecutor przenoszący kontekst (liczniki joba) do wątków roboczych."""
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+def _sample(c: JobCounters) -> tuple:
+    s = resource.getrusage(resource.RUSAGE_SELF)
+    return (time.perf_counter(), s.ru_utime + s.ru_stime, c.child_cpu_s,
+            s.ru_inblock * 512 + c.read_bytes, s.ru_oublock * 512 + c.write_bytes, c.ffmpeg)
+
+class StageClock:
+    """Czas/CPU/IO od poprzedniego mark() przypisany do etapu, który właśnie się zakończył.
+    Procesy potomne z liczników joba (zakończone w trakcie etapu); CPU/IO samego workera – cały proces."""
+
+    FIELDS = ("wall_s", "cpu_s", "ffmpeg_cpu_s", "read_bytes", "write_bytes", "ffmpeg")
+
+    def __init__(self, counters: JobCounters | None = None):
+        self.counters = counters or _job.get() or JobCounters()
+        self._last = _sample(self.counters)
+        self.stages: dict[str, dict] = {}
+
+    def mark(self, stage: str) -> dict:
+        now = _sample(self.counters)
+        d = dict(zip(self.FIELDS, (b - a for a, b in zip(self._last, now))))
+        self._last = now
+        acc = self.stages.setdefault(stage, dict.fromkeys(self.FIELDS, 0))
+        for k, v in d.items(): acc[k] += v
+        observe("vrs_stage_duration_seconds", d["wall_s"], STAGE_BUCKETS, stage=stage)
+        inc("vrs_stage_cpu_seconds_total", d["cpu_s"], stage=stage)
+        inc("vrs_ffmpeg_cpu_seconds_total", d["ffmpeg_cpu_s"], stage=stage)
+        inc("vrs_ffmpeg_processes_total", d["ffmpeg"], stage=stage)
+        inc("vrs_stage_read_bytes_total", d["read_bytes"], stage=stage)
+        inc("vrs_stage_written_bytes_total", d["write_bytes"], stage=stage)
+        return d
+
+    def summary(self) -> dict:
+        return {st: {k: (round(v, 3) if isinstance(v, float) else v) for k, v in d.items()}
+                for st, d in self.stages.items()}
+
+# --- czas w kolejce (nagłówek enqueued_at ustawiany przez producenta) -------
+
+def queue_wait(request) -> float | None:
+    t = getattr(request, "enqueued_at", None) or (getattr(request, "headers", None) or {}).get("enqueued_at")
+    if not t: return None
+    try: wait = max(0.0, time.time() - float(t))
+    except (TypeError, ValueError): return None
+    lane = (getattr(request, "delivery_info", None) or {}).get("routing_key") or ""
+    observe("vrs_queue_wait_seconds", wait, QUEUE_BUCKETS, task=request.task or "", queue=lane)
+    return wait
+
+# --- eksport ---------------------------------------------------------------
+
+def _fmt(v: float) -> str:
+    return str(int(v)) if float(v).is_integer() else repr(float(v))
+
+def _render_histogram(name: str, h: dict) -> list[str]:
+    series: dict[str, dict] = {}
+    for field, v in h.items():
+        lab, _, le = field.rpartition("|")
+        series.setdefault(lab, {})[le] = float(v)
+    out = []
+    for lab, d in sorted(series.items()):
+        sep = "," if lab else ""
+        les = sorted((k for k in d if k not in ("sum", "+Inf")), key=float)
+        for le in les:
+            out.append(f'{name}_bucket{{{lab}{sep}le="{le}"}} {_fmt(d[le])}')
+        out.append(f'{name}_bucket{{{lab}{sep}le="+Inf"}} {_fmt(d.get("+Inf", 0))}')
+        out.append(f'{name}_sum{{{lab}}} {_fmt(d.get("sum", 0))}' if lab else f'{name}_sum {_fmt(d.get("sum", 0))}')
+        out.append(f'{name}_count{{{lab}}} {_fmt(d.get("+Inf", 0))}' if lab else f'{name}_count {_fmt(d.get("+Inf", 0))}')
+    return out
+
+def _local() -> list[dict]:
+    """Niewysłane przyrosty z bufora tego procesu w kształcie hashy z Redis (METRICS, potem puste CACHES)."""
+    with _buf_lock: pending = dict(_buf)
+    by_key: dict[str, dict] = {}
+    for (key, field), v in pending.items(): by_key.setdefault(key, {})[field] = v
+    return [by_key.get(PREFIX + name, {}) for name in METRICS] + [{} for _ in CACHES]
+
+def render() -> str:
+    """Serie z Redis; gdy Redis nie odpowiada – serie z bufora tego procesu i vrs_metrics_store_up 0 zamiast 500."""
+    lines = []
+    try:
+        p = _r.pipeline(transaction=False)
+        for name in METRICS: p.hgetall(PREFIX + name)
+        for key in CACHES.values(): p.hgetall(key)
+        res = p.execute(); up = 1
+    except redis.RedisError:
+        res = _local(); up = 0
+    for (name, (kind, help_)), h in zip(METRICS.items(), res):
+        lines += [f"# HELP {name} {help_}", f"# TYPE {name} {kind}"]
+        if kind == "histogram": lines += _render_histogram(name, h)
+        else: lines += [f"{name}{{{lab}}} {_fmt(float(v))}" for lab, v in sorted(h.items())]
+    lines += ["# HELP vrs_cache_events_total Disk cache lookups and evictions",
+              "# TYPE vrs_cache_events_total counter"]
+    ratios = []
+    for (cache, _), h in zip(CACHES.items(), res[len(METRICS):]):
+        for ev, v in sorted(h.items()):
+            lines.append(f'vrs_cache_events_total{{cache="{cache}",event="{ev}"}} {v}')
+        n = int(h.get("hits", 0)) + int(h.get("misses", 0))
+        if n: ratios.append(f'vrs_cache_hit_ratio{{cache="{cache}"}} {round(int(h.get("hits", 0)) / n, 4)}')
+    lines += ["# HELP vrs_cache_hit_ratio Disk cache hit ratio since counters were created",
+              "# TYPE vrs_cache_hit_ratio gauge", *ratios]
+    lines += ["# HELP vrs_metrics_store_up Whether the shared metrics store (Redis) answered this scrape",
+              "# TYPE vrs_metrics_store_up gauge", f"vrs_metrics_store_up {up}"]
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,74 @@
+import os, time, hashlib, fcntl, threading, shutil
+from typing import Callable
+from worker.config import PROFILE, VideoProfile, NORM_CACHE_DIR, NORM_CACHE_MAX_MB, NORM_FILTER_VERSION
+from worker.utils import media_store
+from worker.utils.diskcache import CacheStats, file_sha256, touch as _touch, evict_lru_sized
+
+# Content-addressed cache wyników normalize_clip: klucz = sha256(treść klipu) + VideoProfile
+# + wersja filtra. Wpisy są niezmienne, publikowane atomowo (os.replace), a budowa
+# jednego klucza jest serializowana flockiem, więc równoległe workery nie transkodują dwa razy.
+# Lock jest per shard (katalog key[:2]), nie per wpis: stała liczba plików .lock zamiast jednego na każdy
+# klucz, który przeżywa eviction swojego wpisu.
+
+_stats = CacheStats("normcache:stats")
+# szacowany rozmiar cache (ostatni skan + wpisy zbudowane przez ten proces); pełny skan katalogu dopiero
+# po przekroczeniu budżetu albo co RESCAN_S (wpisy innych workerów), nie przy każdym chybieniu
+RESCAN_S = 300
+_size = {"bytes": None, "scanned": 0.0}; _size_lock = threading.Lock()
+
+def enabled() -> bool: return NORM_CACHE_MAX_MB > 0
+
+def cache_key(src: str, profile: VideoProfile = PROFILE, content_hash: str | None = None, variant: str = "") -> str:
+    ident = "|".join([
+        content_hash or media_store.content_hash(src) or file_sha256(src),
+        f"{profile.width}x{profile.height}@{profile.fps}", profile.pix_fmt, f"sar={profile.sar}",
+        NORM_FILTER_VERSION, variant,
+    ])
+    return hashlib.sha256(ident.encode()).hexdigest()
+
+def _entry(key: str) -> str: return os.path.join(NORM_CACHE_DIR, key[:2], f"{key}.mp4")
+
+def _link(src: str, dst: str) -> None:
+    if os.path.exists(dst): os.remove(dst)
+    try: os.link(src, dst)  # hardlink: eviction wpisu nie zabiera pliku joba
+    except OSError: shutil.copyfile(src, dst)
+
+# umieszcza znormalizowany klip pod dst; True = trafienie w cache
+def get_or_build(key: str, dst: str, build: Callable[[str], object]) -> bool:
+    entry = _entry(key)
+    if _touch(entry):
+        try:
+            _link(entry, dst); _stats.count("hits"); return True
+        except FileNotFoundError: pass  # wyścig z eviction – budujemy od nowa
+    os.makedirs(os.path.dirname(entry), exist_ok=True)
+    with open(os.path.join(os.path.dirname(entry), ".lock"), "w") as lk:
+        fcntl.flock(lk, fcntl.LOCK_EX)
+        if _touch(entry):  # ktoś zbudował w międzyczasie
+            try:
+                _link(entry, dst); _stats.count("hits"); return True
+            except FileNotFoundError: pass  # evict() nie bierze locka wpisu – budujemy
+        tmp = f"{entry}.{os.getpid()}.{threading.get_ident()}.tmp.mp4"
+        try:
+            build(tmp)
+            size = os.path.getsize(tmp)
+            _link(tmp, dst)  # z tmp, przed publikacją: eviction opublikowanego wpisu nie ma już czego zabrać
+            os.replace(tmp, entry)
+        finally:
+            if os.path.exists(tmp): os.remove(tmp)
+    _stats.count("misses")
+    with _size_lock:
+        if _size["bytes"] is not None: _size["bytes"] += size
+        due = (_size["bytes"] is None or _size["bytes"] > NORM_CACHE_MAX_MB * 1024 * 1024
+               or time.monotonic() - _size["scanned"] > RESCAN_S)
+    if due: evict()
+    return False
+
+def evict(max_bytes: int | None = None) -> int:
+    budget = NORM_CACHE_MAX_MB * 1024 * 1024 if max_bytes is None else max_bytes
+    removed, left = evict_lru_sized(NORM_CACHE_DIR, budget, ".mp4")
+    with _size_lock: _size.update(bytes=left, scanned=time.monotonic())
+    _stats.count("evicted", removed)
+    return removed
+
+def stats() -> dict:
+    return _stats.snapshot()
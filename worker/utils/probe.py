@@ -0,0 +1,91 @@
+import os, json, subprocess, threading
+from collections import OrderedDict
+from worker.utils import cpubudget, metrics
+
+# Jeden ffprobe na plik: pełny JSON (streams + format) memoizowany po (ścieżka, rozmiar, mtime),
+# więc nadpisany plik jest sondowany ponownie, a te same klipy w pętli cięć już nie. ffprobe idzie przez
+# cpubudget.run jak ffmpeg: token budżetu węzła i rusage w licznikach joba (vrs_ffmpeg_processes_total, CPU etapu).
+
+PROBE_CACHE_MAX = int(os.getenv("PROBE_CACHE_MAX", "1024"))
+PROBE_WORKERS = int(os.getenv("PROBE_WORKERS", "8"))
+
+_cache: "OrderedDict[tuple, dict]" = OrderedDict()
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0}
+
+def _key(path: str) -> tuple:
+    st = os.stat(path)
+    return (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+
+def _ffprobe(path: str) -> dict:
+    p = cpubudget.run(["ffprobe", "-v", "error", "-print_format", "json", "-show_format", "-show_streams", path],
+                       stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if p.returncode != 0:
+        raise RuntimeError(f"ffprobe_error:{p.stderr.strip()[:4000]}")
+    return json.loads(p.stdout or "{}")
+
+def probe(path: str) -> dict:
+    k = _key(path)
+    with _lock:
+        if k in _cache:
+            _cache.move_to_end(k); _stats["hits"] += 1
+            return _cache[k]
+    data = _ffprobe(path)
+    with _lock:
+        _stats["misses"] += 1
+        _cache[k] = data
+        while len(_cache) > PROBE_CACHE_MAX: _cache.popitem(last=False)
+    return data
+
+def peek(path: str) -> dict | None:
+    """Wynik z pamięci sond bez uruchamiania ffprobe (None = nie sondowany albo plik zmieniony)."""
+    try: k = _key(path)
+    except OSError: return None
+    with _lock: return _cache.get(k)
+
+# sonduje wszystkie wejścia joba naraz; nieudane sondy -> None
+def probe_many(paths: list[str], workers: int = PROBE_WORKERS) -> dict[str, dict | None]:
+    def one(p: str) -> dict | None:
+        try: return probe(p)
+        except Exception: return None
+    uniq = list(dict.fromkeys(paths))
+    if not uniq: return {}
+    with metrics.Executor(max_workers=max(1, min(workers, len(uniq)))) as ex:  # liczniki joba w wątkach sond
+        return dict(zip(uniq, ex.map(one, uniq)))
+
+def stream(path: str, codec_type: str = "video") -> dict | None:
+    for s in probe(path).get("streams", []):
+        if s.get("codec_type") == codec_type: return s
+    return None
+
+def duration(path: str) -> float | None:
+    try: data = probe(path)
+    except Exception: return None
+    try: return float(data.get("format", {}).get("duration"))
+    except (TypeError, ValueError): pass
+    durs = []
+    for s in data.get("streams", []):
+        try: durs.append(float(s["duration"]))
+        except (KeyError, TypeError, ValueError): pass
+    return max(durs) if durs else None
+
+def get_rotation(stream):
+    try:
+        tags = stream.get("tags", {}) or {}
+        r = tags.get("rotate")
+        if r is None:
+            r = stream.get("side_data_list", [{}])[0].get("rotation")
+        if r is None:
+            return 0
+        r = int(float(r))
+        r = r % 360
+        return r
+    except Exception:
+        return 0
+
+def rotation(path: str) -> int:
+    s = stream(path, "video")
+    return get_rotation(s) if s else 0
+
+def stats() -> dict:
+    with _lock: return dict(_stats, entries=len(_cache))
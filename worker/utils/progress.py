@@ -0,0 +1,39 @@
+import json, time
+import redis
+from worker.config import REDIS_URL
+
+# Postęp joba: snapshot w hashu job:<id> (dla odpytywania) + zdarzenie na kanale job:<id>:events
+# (API trzyma jedną subskrypcję wzorca na proces i rozsyła zdarzenia do klientów SSE/WebSocket).
+
+_r = redis.from_url(REDIS_URL, decode_responses=True)
+TERMINAL = ("done", "error")
+CHANNEL_PATTERN = "job:*:events"
+
+def hash_key(job_id: str) -> str: return f"job:{job_id}"
+def channel(job_id: str) -> str: return f"job:{job_id}:events"
+def job_of(chan: str) -> str: return chan[4:-7]  # job:<id>:events -> <id>
+
+def event(job_id: str, d: dict) -> dict:
+    """Hash/payload (wartości jako stringi) -> zdarzenie dla klienta (progress jako int)."""
+    out = dict(d, job_id=job_id)
+    if "progress" in out:
+        try: out["progress"] = int(out["progress"])
+        except (TypeError, ValueError): pass
+    return out
+
+def publish(job_id: str, stage: str, pct: int | None = None, extra: dict | None = None) -> None:
+    d = {"stage": stage}
+    if pct is not None: d["progress"] = str(int(pct))  # "error" zostawia ostatni znany postęp
+    if extra: d.update({str(k): str(v) for k, v in extra.items()})
+    ev = dict(event(job_id, d), ts=round(time.time(), 3))
+    try:
+        p = _r.pipeline(transaction=False)
+        p.hset(hash_key(job_id), mapping=d)
+        p.publish(channel(job_id), json.dumps(ev))
+        p.execute()
+    except Exception: pass
+
+def incr(job_id: str, field: str) -> int:
+    """Licznik w hashu joba (np. ukończone subtaski DAG-u z różnych workerów)."""
+    try: return int(_r.hincrby(hash_key(job_id), field, 1))
+    except Exception: return 0
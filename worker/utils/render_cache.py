@@ -0,0 +1,78 @@
+import hashlib, json, os, time
+import redis
+from worker.config import REDIS_URL, RENDER_MODES, PIPELINE_MODES, WORKER_VERSION, RENDER_CACHE_TTL_S, RENDER_INFLIGHT_TTL_S
+
+# Render jest deterministyczny (seed z job_id, wejścia po treści), więc identyczne zlecenie = identyczny wynik.
+# render:fp:<odcisk> -> {"state": "running"|"done", task_id, job_id, out}; API zajmuje wpis (SET NX) przed wysłaniem
+# taska, kolejne identyczne zlecenia dostają task_id biegnącego renderu albo gotowy plik. Worker po zakończeniu
+# podmienia wpis na "done" (albo usuwa go po błędzie) – tylko jeśli wpis nadal należy do jego task_id.
+
+_r = redis.from_url(REDIS_URL, decode_responses=True)
+STATS_KEY = "render:cache:stats"
+
+# SET/DEL wpisu tylko gdy nadal ma oczekiwaną wartość (inny task mógł go przejąć po wygaśnięciu)
+_CAS = _r.register_script("""
+if redis.call('get', KEYS[1]) ~= ARGV[1] then return 0 end
+if ARGV[2] == '' then return redis.call('del', KEYS[1]) end
+redis.call('set', KEYS[1], ARGV[2], 'EX', ARGV[3])
+return 1
+""")
+
+def _key(fp: str) -> str: return f"render:fp:{fp}"
+def _tkey(task_id: str) -> str: return f"render:task:{task_id}"
+
+def fingerprint(audio_sha: str, video_shas: list[str], mode: str, params: dict, pipeline: str) -> str:
+    prof, enc = PIPELINE_MODES.get(pipeline, RENDER_MODES)[mode]  # parametry, których pipeline faktycznie używa
+    doc = {"audio": audio_sha, "videos": list(video_shas), "mode": mode, "params": params,
+           "profile": [prof.width, prof.height, prof.fps, prof.pix_fmt], "encode": [enc.preset, enc.crf],
+           "pipeline": pipeline, "worker_version": WORKER_VERSION}
+    return hashlib.sha256(json.dumps(doc, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+def _hit(kind: str) -> None:
+    try: _r.hincrby(STATS_KEY, kind, 1)
+    except Exception: pass
+
+def claim(fp: str, task_id: str, job_id: str, alive=None) -> dict | None:
+    """None = wpis zajęty dla task_id (wołający wysyła task). Inaczej istniejący wpis: "done" z plikiem
+    albo "running" (alive(task_id) -> False oznacza martwy task, wtedy wpis jest przejmowany)."""
+    rec = json.dumps({"state": "running", "task_id": task_id, "job_id": job_id, "ts": time.time()})
+    for _ in range(3):
+        if _r.set(_key(fp), rec, nx=True, ex=RENDER_INFLIGHT_TTL_S):
+            _hit("miss"); return None
+        raw = _r.get(_key(fp))
+        if raw is None: continue
+        cur = json.loads(raw)
+        if cur["state"] == "done" and os.path.exists(cur.get("out") or ""):
+            _hit("hit"); return cur
+        if cur["state"] == "running" and (alive is None or alive(cur["task_id"])):
+            _hit("inflight"); return cur
+        _CAS(keys=[_key(fp)], args=[raw, "", 0])  # plik sprzątnięty albo task padł – zlecenie od nowa
+    _hit("miss")
+    return None
+
+def release(fp: str, task_id: str) -> None:
+    """Wycofanie zajętego wpisu, gdy wysłanie taska się nie udało."""
+    finish(fp, task_id, None, ok=False)
+
+def finish(fp: str | None, task_id: str | None, out: str | None, ok: bool) -> None:
+    if not fp or not task_id: return
+    try:
+        raw = _r.get(_key(fp))
+        if raw is None or json.loads(raw).get("task_id") != task_id: return
+        if not ok:
+            _CAS(keys=[_key(fp)], args=[raw, "", 0]); return
+        rec = dict(json.loads(raw), state="done", out=out, ts=time.time())
+        if _CAS(keys=[_key(fp)], args=[raw, json.dumps(rec), RENDER_CACHE_TTL_S]):
+            _r.set(_tkey(task_id), fp, ex=RENDER_CACHE_TTL_S)
+    except Exception: pass
+
+def by_task(task_id: str) -> dict | None:
+    """Gotowy wpis dla task_id – wynik w backendzie Celery mógł już wygasnąć (result_expires)."""
+    fp = _r.get(_tkey(task_id))
+    raw = _r.get(_key(fp)) if fp else None
+    if not raw: return None
+    rec = json.loads(raw)
+    return rec if rec["state"] == "done" and rec["task_id"] == task_id else None
+
+def stats() -> dict:
+    return {k: int(v) for k, v in _r.hgetall(STATS_KEY).items()}